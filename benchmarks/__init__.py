@@ -0,0 +1,5 @@
+"""
+This package defines benchmarks of :mod:`lokiunimore`, running its components against local fakes of the services they depend on.
+
+They are not part of the distributed package; run them from the root of the repository, such as with ``python -m benchmarks.membership``.
+"""
@@ -0,0 +1,190 @@
+"""
+This module defines what the benchmarks have in common: setting up the configuration and the client, and measuring how the client handles a batch of events.
+"""
+
+import collections
+import functools
+import os
+import statistics
+import time
+import sqlalchemy
+import sqlalchemy.event
+import sqlalchemy.orm
+
+from lokiunimore.matrix.client import LokiClient
+from lokiunimore.sql.tables import Base
+from benchmarks.homeserver import FakeHomeserver
+
+PLACEHOLDER_ENVIRONMENT = {
+    "LOKI_EMAIL": "loki@bench.invalid",
+    "MATRIX_HOMESERVER": "http://127.0.0.1",
+    "MATRIX_USER_ID": "@loki:bench",
+    "MATRIX_USER_SECRET": "bench",
+    "MATRIX_PUBLIC_SPACE_ID": "!public:bench",
+    "MATRIX_PUBLIC_SPACE_ALIAS": "#public:bench",
+    "MATRIX_PRIVATE_SPACE_ID": "!private:bench",
+    "MATRIX_HELP_ROOM_ALIAS": "#help:bench",
+    "TELEGRAM_APP_ID": "1",
+    "TELEGRAM_APP_HASH": "bench",
+    "TELEGRAM_BOT_TOKEN": "1:bench",
+    "TELEGRAM_BOT_USERNAME": "bench",
+    "TELEGRAM_PUBLIC_JOIN_LINK": "https://t.me/bench",
+    "TELEGRAM_PRIVATE_JOIN_LINKS": "Bench>https://t.me/bench",
+    "TELEGRAM_HELP_ROOM_USERNAME": "bench",
+    "DISCORD_INVITE_LINK": "https://discord.gg/bench",
+    "FLASK_SECRET_KEY": "bench",
+    "FLASK_SERVER_NAME": "bench.invalid",
+    "FLASK_APPLICATION_ROOT": "/",
+    "FLASK_PREFERRED_URL_SCHEME": "https",
+    "OIDC_CLIENT_ID": "bench",
+    "OIDC_CLIENT_SECRET": "bench",
+    "OIDC_CONFIGURATION_URL": "https://bench.invalid/.well-known/openid-configuration",
+    "OIDC_API_BASE_URL": "https://bench.invalid/",
+    "OIDC_EMAIL_REGEX": ".+",
+}
+"""
+Values for the required configuration, only used if missing from the environment, as the benchmarks never reach the services they configure.
+"""
+
+
+def benchmark_environment(database_url: str, **overrides: str) -> dict[str, str]:
+    """
+    :param database_url: The URL of the database the benchmark uses, replacing the configured one.
+    :param overrides: Other configuration the benchmark depends on, replacing the environment.
+    :return: The current environment, completed with :data:`.PLACEHOLDER_ENVIRONMENT` and the configuration of the benchmark.
+    """
+
+    return {**PLACEHOLDER_ENVIRONMENT, **os.environ, **overrides, "SQLALCHEMY_DATABASE_URL": database_url, "MATRIX_SKIP_EVENTS": ""}
+
+
+def configure_environment(database_url: str, **overrides: str) -> None:
+    """
+    Set up the environment the configuration of :mod:`lokiunimore` is read from in this process; must be called before the configuration is first accessed.
+
+    See :func:`.benchmark_environment` for the parameters.
+    """
+
+    os.environ.update(benchmark_environment(database_url, **overrides))
+
+
+def create_client(homeserver: FakeHomeserver, user_id: str, database_url: str) -> LokiClient:
+    """
+    :param homeserver: The started homeserver to connect to.
+    :param user_id: The id of the user to act as, without logging in.
+    :param database_url: The URL of the database to use, whose tables are created if missing.
+    :return: A client ready to sync.
+    """
+
+    client = LokiClient(homeserver=homeserver.url, user=user_id, database_url=database_url)
+    client.user_id = user_id
+    client.access_token = "bench"
+    client.device_id = "BENCH"
+    Base.metadata.create_all(bind=client.sqla_engine)
+    return client
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """
+    :return: The value below which the given fraction of ``values`` fall, interpolating between the nearest two.
+    """
+
+    if not values:
+        return float("nan")
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=1000, method="inclusive")[round(fraction * 1000) - 1]
+
+
+class Measurement:
+    """
+    Measures the events handled by a client while in a ``with`` statement, along with the database queries and homeserver requests they cause.
+    """
+
+    def __init__(self, client: LokiClient, homeserver: FakeHomeserver):
+        self.client: LokiClient = client
+        self.homeserver: FakeHomeserver = homeserver
+        self.durations: list[float] = []
+        self.queries: int = 0
+        self.elapsed: float = 0
+        self.requests: collections.Counter[str] = collections.Counter()
+        self._active: bool = False
+        self._started_at: float | None = None
+
+        for callback in client.event_callbacks:
+            callback.func = self._timed(callback.func)
+
+    def _timed(self, f):
+        @functools.wraps(f)
+        async def wrapped(*args, **kwargs):
+            if not self._active:
+                return await f(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await f(*args, **kwargs)
+            finally:
+                self.durations.append(time.perf_counter() - start)
+
+        return wrapped
+
+    def _count_query(self, *args) -> None:
+        self.queries += 1
+
+    def __enter__(self):
+        self.homeserver.requests.clear()
+        sqlalchemy.event.listen(self.client.sqla_engine, "before_cursor_execute", self._count_query)
+        self._active = True
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.elapsed += time.perf_counter() - self._started_at
+        self._active = False
+        sqlalchemy.event.remove(self.client.sqla_engine, "before_cursor_execute", self._count_query)
+        self.requests.update({route: count for route, count in self.homeserver.requests.items() if not route.endswith("/sync")})
+
+    def results(self) -> dict:
+        """
+        :return: The measured values, as a JSON-serializable dict.
+        """
+
+        events = len(self.durations)
+        return {
+            "events": events,
+            "elapsed_seconds": self.elapsed,
+            "events_per_second": events / self.elapsed if self.elapsed else 0,
+            "latency_p50_seconds": percentile(self.durations, 0.5),
+            "latency_p99_seconds": percentile(self.durations, 0.99),
+            "queries_per_event": self.queries / events if events else 0,
+            "requests_per_event": sum(self.requests.values()) / events if events else 0,
+            "requests": dict(self.requests.most_common()),
+        }
+
+
+def format_results(results: dict) -> str:
+    """
+    :return: The results of :meth:`.Measurement.results`, formatted for humans.
+    """
+
+    lines = [
+        f"{'events':<24}{results['events']}",
+        f"{'elapsed':<24}{results['elapsed_seconds']:.3f} s",
+        f"{'events/s':<24}{results['events_per_second']:.1f}",
+        f"{'latency p50':<24}{results['latency_p50_seconds'] * 1000:.2f} ms",
+        f"{'latency p99':<24}{results['latency_p99_seconds'] * 1000:.2f} ms",
+        f"{'db queries/event':<24}{results['queries_per_event']:.2f}",
+        f"{'http requests/event':<24}{results['requests_per_event']:.2f}",
+    ]
+    for route, count in results["requests"].items():
+        lines.append(f"    {count:>8}  {route}")
+    return "\n".join(lines)
+
+
+__all__ = (
+    "PLACEHOLDER_ENVIRONMENT",
+    "benchmark_environment",
+    "configure_environment",
+    "create_client",
+    "percentile",
+    "Measurement",
+    "format_results",
+)
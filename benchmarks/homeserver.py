@@ -0,0 +1,206 @@
+"""
+This module defines a fake Matrix homeserver, implementing just enough of the client-server API to benchmark :class:`lokiunimore.matrix.client.LokiClient`.
+"""
+
+import asyncio
+import collections
+import itertools
+import logging
+import secrets
+import time
+import aiohttp.web
+
+log = logging.getLogger(__name__)
+
+
+def member_event(user_id: str, membership: str, prev_membership: str | None = None, sender: str | None = None) -> dict:
+    """
+    :param user_id: The user whose membership changed.
+    :param membership: The new membership of the user, such as ``join``.
+    :param prev_membership: The previous membership of the user, if any.
+    :param sender: The user who changed the membership; defaults to ``user_id``.
+    :return: A ``m.room.member`` event, as included in a sync response.
+    """
+
+    event = {
+        "type": "m.room.member",
+        "event_id": f"${secrets.token_urlsafe(16)}",
+        "sender": sender or user_id,
+        "origin_server_ts": int(time.time() * 1000),
+        "state_key": user_id,
+        "content": {"membership": membership},
+    }
+    if prev_membership is not None:
+        event["unsigned"] = {"prev_content": {"membership": prev_membership}}
+    return event
+
+
+def name_event(sender: str, name: str) -> dict:
+    """
+    :return: A ``m.room.name`` event, as included in a sync response.
+    """
+
+    return {
+        "type": "m.room.name",
+        "event_id": f"${secrets.token_urlsafe(16)}",
+        "sender": sender,
+        "origin_server_ts": int(time.time() * 1000),
+        "state_key": "",
+        "content": {"name": name},
+    }
+
+
+def joined_room(state: list[dict] = (), timeline: list[dict] = ()) -> dict:
+    """
+    :return: The entry of a joined room of a sync response.
+    """
+
+    return {
+        "state": {"events": list(state)},
+        "timeline": {"events": list(timeline), "limited": False, "prev_batch": "start"},
+        "ephemeral": {"events": []},
+        "account_data": {"events": []},
+    }
+
+
+class FakeHomeserver:
+    """
+    A local homeserver answering sync requests with prepared batches of events, and accepting every other supported request without storing anything.
+
+    Every request is counted by route, so that the work caused by a batch can be measured.
+    """
+
+    def __init__(self, hierarchies: dict[str, list[str]] = None, latency: float = 0):
+        """
+        :param hierarchies: The ids of the rooms in the hierarchy of each space, by space id.
+        :param latency: The number of seconds every request other than syncs waits before being answered, simulating a remote homeserver.
+        """
+
+        self.hierarchies: dict[str, list[str]] = hierarchies or {}
+        self.latency: float = latency
+        self.batches: list[dict] = []
+        self.requests: collections.Counter[str] = collections.Counter()
+        self._counter: itertools.count = itertools.count()
+        self._runner: aiohttp.web.AppRunner | None = None
+        self.url: str | None = None
+
+        self.app: aiohttp.web.Application = aiohttp.web.Application(middlewares=[self._middleware])
+        self.app.router.add_get("/_matrix/client/{version}/sync", self.sync)
+        self.app.router.add_get("/_matrix/client/{version}/rooms/{room_id}/hierarchy", self.hierarchy)
+        self.app.router.add_post("/_matrix/client/{version}/rooms/{room_id}/kick", self.kick)
+        self.app.router.add_post("/_matrix/client/{version}/createRoom", self.create_room)
+        self.app.router.add_put("/_matrix/client/{version}/rooms/{room_id}/send/{event_type}/{txn_id}", self.send)
+        self.app.router.add_get("/_matrix/client/{version}/profile/{user_id}/displayname", self.displayname)
+        self.app.router.add_post("/_matrix/client/{version}/join/{room_id}", self.join)
+        self.app.router.add_post("/_matrix/client/{version}/rooms/{room_id}/invite", self.invite)
+        self.app.router.add_post("/_matrix/client/{version}/login", self.login)
+        self.app.router.add_route("*", "/{path:.*}", self.unrecognized)
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} at {self.url}>"
+
+    @aiohttp.web.middleware
+    async def _middleware(self, request: aiohttp.web.Request, handler):
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unknown"
+        self.requests[f"{request.method} {route}"] += 1
+        if self.latency and handler is not self.sync:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    def add_batch(self, rooms: dict[str, dict]) -> None:
+        """
+        Queue a batch of events to be returned by the next sync.
+
+        :param rooms: The joined rooms of the batch, by room id; see :func:`.joined_room`.
+        """
+
+        self.add_sync({
+            "rooms": {"join": rooms, "invite": {}, "leave": {}},
+            "presence": {"events": []},
+            "account_data": {"events": []},
+            "to_device": {"events": []},
+        })
+
+    def add_sync(self, body: dict) -> None:
+        """
+        Queue a whole sync response to be returned by the next sync, such as one recorded by :class:`lokiunimore.matrix.recording.TrafficRecorder`.
+
+        :param body: The body of the response, whose batch token is replaced.
+        """
+
+        self.batches.append({**body, "next_batch": f"b{len(self.batches) + 1}"})
+
+    async def sync(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        since = request.query.get("since")
+        index = int(since.removeprefix("b")) if since else 0
+        if index < len(self.batches):
+            return aiohttp.web.json_response(self.batches[index])
+        # Nothing new: the batch token stays the same
+        return aiohttp.web.json_response({"next_batch": since, "rooms": {"join": {}, "invite": {}, "leave": {}}})
+
+    async def hierarchy(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        space_id = request.match_info["room_id"]
+        rooms = [space_id, *self.hierarchies.get(space_id, [])]
+        return aiohttp.web.json_response({"rooms": [{"room_id": room_id, "children_state": []} for room_id in rooms]})
+
+    async def kick(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        return aiohttp.web.json_response({})
+
+    async def create_room(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        return aiohttp.web.json_response({"room_id": f"!created{next(self._counter)}:bench"})
+
+    async def send(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        return aiohttp.web.json_response({"event_id": f"$sent{next(self._counter)}"})
+
+    async def displayname(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        user_id = request.match_info["user_id"]
+        return aiohttp.web.json_response({"displayname": user_id.removeprefix("@").split(":", 1)[0]})
+
+    async def join(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        return aiohttp.web.json_response({"room_id": request.match_info["room_id"]})
+
+    async def invite(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        return aiohttp.web.json_response({})
+
+    async def login(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        body = await request.json()
+        return aiohttp.web.json_response({"user_id": body["identifier"]["user"], "access_token": "bench", "device_id": f"BENCH{next(self._counter)}"})
+
+    async def unrecognized(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        return aiohttp.web.json_response({"errcode": "M_UNRECOGNIZED", "error": "Not implemented by the fake homeserver"}, status=404)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Start serving.
+
+        :param host: The address to listen on.
+        :param port: The port to listen on, or ``0`` to pick a free one.
+        :return: The URL of the homeserver.
+        """
+
+        self._runner = aiohttp.web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = aiohttp.web.TCPSite(self._runner, host, port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        log.debug("Fake homeserver listening at %s", self.url)
+        return self.url
+
+    async def stop(self) -> None:
+        """
+        Stop serving.
+        """
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+__all__ = (
+    "member_event",
+    "name_event",
+    "joined_room",
+    "FakeHomeserver",
+)
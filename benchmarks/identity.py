@@ -0,0 +1,138 @@
+"""
+This module defines a fake OpenID Connect identity provider, signing in anybody immediately, so that the web app can be benchmarked without a real one.
+"""
+
+import asyncio
+import collections
+import logging
+import secrets
+import time
+import urllib.parse
+import aiohttp.web
+import authlib.jose
+
+log = logging.getLogger(__name__)
+
+
+class FakeIdentityProvider:
+    """
+    An identity provider whose authorization endpoint redirects back immediately, as if the user had signed in and consented.
+
+    The email of the signed in user is taken from the ``login_hint`` parameter of the authorization request, and is always verified.
+    """
+
+    def __init__(self, latency: float = 0):
+        """
+        :param latency: The number of seconds every request waits before being answered, simulating a remote identity provider.
+        """
+
+        self.latency: float = latency
+        self.key: authlib.jose.RSAKey = authlib.jose.JsonWebKey.generate_key("RSA", 2048, is_private=True, options={"kid": "bench"})
+        self.requests: collections.Counter[str] = collections.Counter()
+        self._codes: dict[str, dict] = {}
+        self._runner: aiohttp.web.AppRunner | None = None
+        self.url: str | None = None
+
+        self.app: aiohttp.web.Application = aiohttp.web.Application(middlewares=[self._middleware])
+        self.app.router.add_get("/.well-known/openid-configuration", self.configuration)
+        self.app.router.add_get("/jwks", self.jwks)
+        self.app.router.add_get("/authorize", self.authorize)
+        self.app.router.add_post("/token", self.token)
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} at {self.url}>"
+
+    @aiohttp.web.middleware
+    async def _middleware(self, request: aiohttp.web.Request, handler):
+        self.requests[f"{request.method} {request.path}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    async def configuration(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        return aiohttp.web.json_response({
+            "issuer": self.url,
+            "authorization_endpoint": f"{self.url}/authorize",
+            "token_endpoint": f"{self.url}/token",
+            "jwks_uri": f"{self.url}/jwks",
+            "response_types_supported": ["code"],
+            "subject_types_supported": ["public"],
+            "id_token_signing_alg_values_supported": ["RS256"],
+        })
+
+    async def jwks(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        return aiohttp.web.json_response({"keys": [self.key.as_dict(is_private=False)]})
+
+    async def authorize(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        query = request.query
+        code = secrets.token_urlsafe(16)
+        self._codes[code] = {
+            "client_id": query["client_id"],
+            "nonce": query.get("nonce"),
+            "email": query.get("login_hint") or f"{code}@bench.invalid",
+        }
+        redirect = query["redirect_uri"] + "?" + urllib.parse.urlencode({"code": code, "state": query.get("state", "")})
+        raise aiohttp.web.HTTPFound(redirect)
+
+    async def token(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        form = await request.post()
+        grant = self._codes.pop(form.get("code"), None)
+        if grant is None:
+            return aiohttp.web.json_response({"error": "invalid_grant"}, status=400)
+
+        now = int(time.time())
+        local_part = grant["email"].split("@", 1)[0]
+        claims = {
+            "iss": self.url,
+            "sub": local_part,
+            "aud": grant["client_id"],
+            "iat": now,
+            "exp": now + 300,
+            "email": grant["email"],
+            "email_verified": True,
+            "given_name": local_part,
+            "family_name": "Bench",
+        }
+        if grant["nonce"]:
+            claims["nonce"] = grant["nonce"]
+        id_token = authlib.jose.jwt.encode({"alg": "RS256", "kid": "bench"}, claims, self.key).decode("ascii")
+
+        return aiohttp.web.json_response({
+            "access_token": secrets.token_urlsafe(16),
+            "token_type": "Bearer",
+            "expires_in": 300,
+            "scope": "openid email profile",
+            "id_token": id_token,
+        })
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Start serving.
+
+        :param host: The address to listen on.
+        :param port: The port to listen on, or ``0`` to pick a free one.
+        :return: The URL of the identity provider, which is also its issuer.
+        """
+
+        self._runner = aiohttp.web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = aiohttp.web.TCPSite(self._runner, host, port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        log.debug("Fake identity provider listening at %s", self.url)
+        return self.url
+
+    async def stop(self) -> None:
+        """
+        Stop serving.
+        """
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+__all__ = (
+    "FakeIdentityProvider",
+)
@@ -0,0 +1,139 @@
+"""
+This module checks that each entry point of :mod:`lokiunimore` only imports what it uses, and that it does so within its time budget.
+
+Each entry point is imported in a fresh interpreter with ``-X importtime``; the command fails if any of them imports one of its forbidden packages, or takes longer than its budget to import.
+"""
+
+import argparse
+import dataclasses
+import json
+import re
+import subprocess
+import sys
+
+
+@dataclasses.dataclass
+class ImportBudget:
+    """
+    What an entry point may import, and how long it may take to.
+    """
+
+    module: str
+    """
+    The module of the entry point, such as ``lokiunimore.config.__main__``.
+    """
+
+    milliseconds: float
+    """
+    The maximum number of milliseconds importing the module may take, on a reasonably fast machine.
+    """
+
+    forbidden: tuple[str, ...] = ()
+    """
+    The top-level packages the module must not import, directly or indirectly.
+    """
+
+
+WEB_STACK = ("flask", "flask_sqlalchemy", "authlib", "werkzeug", "jinja2")
+CLIENTS = ("nio", "telethon", "aiohttp")
+
+BUDGETS = (
+    ImportBudget("lokiunimore.config.__main__", milliseconds=100, forbidden=("sqlalchemy", "requests", *WEB_STACK, *CLIENTS)),
+    ImportBudget("lokiunimore.sql.__main__", milliseconds=800, forbidden=("requests", *WEB_STACK, *CLIENTS)),
+    ImportBudget("lokiunimore.web.server", milliseconds=400, forbidden=("sqlalchemy", *WEB_STACK, *CLIENTS)),
+    ImportBudget("lokiunimore.matrix.__main__", milliseconds=2500, forbidden=("telethon",)),
+    ImportBudget("lokiunimore.matrix.worker", milliseconds=2500, forbidden=("telethon",)),
+    ImportBudget("lokiunimore.matrix.reconcile", milliseconds=2500, forbidden=("telethon",)),
+    ImportBudget("lokiunimore.telegram.__main__", milliseconds=2500, forbidden=("nio",)),
+    ImportBudget("lokiunimore.runtime.__main__", milliseconds=3000),
+)
+"""
+The budget of each entry point.
+
+The web server imports the web app only after having parsed its configuration, and the bots need the web app to build the URLs of the profiles.
+"""
+
+_importtime_line = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure_imports(module: str) -> tuple[float, set[str]]:
+    """
+    Import a module in a fresh interpreter.
+
+    :param module: The module to import.
+    :return: The number of milliseconds the import took, and the names of all the modules it imported.
+    :raises RuntimeError: If the import failed.
+    """
+
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"Could not import {module}:\n{process.stderr}")
+
+    milliseconds = 0.0
+    imported = set()
+    for line in process.stderr.splitlines():
+        if (match := _importtime_line.match(line)) is None:
+            continue
+        imported.add(match.group(4))
+        if match.group(4) == module:
+            milliseconds = int(match.group(2)) / 1000
+    return milliseconds, imported
+
+
+def check_budget(budget: ImportBudget, repeat: int = 3, scale: float = 1) -> dict:
+    """
+    :param budget: The budget to check.
+    :param repeat: The number of times to import the module, keeping the fastest, so that noise doesn't break the budget.
+    :param scale: The factor to multiply the time budget by, for slower machines.
+    :return: The outcome of the check, as a JSON-serializable dict.
+    """
+
+    measurements = [measure_imports(budget.module) for _ in range(repeat)]
+    milliseconds = min(time for time, _ in measurements)
+    imported = measurements[0][1]
+    violations = sorted(package for package in budget.forbidden if package in imported)
+
+    return {
+        "module": budget.module,
+        "milliseconds": milliseconds,
+        "budget_milliseconds": budget.milliseconds * scale,
+        "modules": len(imported),
+        "forbidden_imports": violations,
+        "ok": milliseconds <= budget.milliseconds * scale and not violations,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the entry points of lokiunimore only import what they use, within their time budget.")
+    parser.add_argument("--repeat", type=int, default=3, help="the number of times to import each entry point, keeping the fastest")
+    parser.add_argument("--scale", type=float, default=1, help="the factor to multiply the time budgets by, for slower machines")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = [check_budget(budget, repeat=args.repeat, scale=args.scale) for budget in BUDGETS]
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        for result in results:
+            status = "ok" if result["ok"] else "FAIL"
+            line = f"{status:<6}{result['module']:<36}{result['milliseconds']:>9.1f} ms / {result['budget_milliseconds']:>6.0f} ms{result['modules']:>6} modules"
+            if result["forbidden_imports"]:
+                line += f"  imports {', '.join(result['forbidden_imports'])}"
+            print(line)
+
+    sys.exit(0 if all(result["ok"] for result in results) else 1)
+
+
+__all__ = (
+    "ImportBudget",
+    "BUDGETS",
+    "measure_imports",
+    "check_budget",
+    "main",
+)
+
+
+if __name__ == "__main__":
+    main()
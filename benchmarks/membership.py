@@ -0,0 +1,155 @@
+"""
+This module benchmarks the handling of membership events by :class:`lokiunimore.matrix.client.LokiClient`, from the sync response to the requests sent to the homeserver.
+
+The client is fed a batch of users joining and leaving the public space of the default community by a :class:`.FakeHomeserver`, and the following are reported:
+
+- the number of events handled per second;
+- the median and the 99th percentile of the time taken to handle each event;
+- the number of database queries and of homeserver requests made per event.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import sqlalchemy.orm
+
+from lokiunimore.sql.tables import MatrixUser
+from lokiunimore.web.app import create_app
+from benchmarks.homeserver import FakeHomeserver, member_event, name_event, joined_room
+from benchmarks.harness import configure_environment, create_client, Measurement, format_results
+
+BOT_USER_ID = "@loki:bench"
+PUBLIC_SPACE_ID = "!public:bench"
+PRIVATE_SPACE_ID = "!private:bench"
+
+
+class Scenario:
+    """
+    The rooms known to the bot, and the batch of membership changes it receives.
+    """
+
+    def __init__(self, joiners: int, leavers: int, rooms: int, dm_rooms: int):
+        """
+        :param joiners: The number of users joining the public space.
+        :param leavers: The number of users leaving the public space, and being kicked from all its rooms.
+        :param rooms: The number of rooms in each space.
+        :param dm_rooms: The number of direct message rooms the bot already has; the first users of the batch have one each, so that both finding and creating management rooms are exercised.
+        """
+
+        self.joiners: list[str] = [f"@joiner{i}:bench" for i in range(joiners)]
+        self.leavers: list[str] = [f"@leaver{i}:bench" for i in range(leavers)]
+        self.rooms: list[str] = [f"!room{i}:bench" for i in range(rooms)]
+
+        users = [*self.joiners, *self.leavers]
+        self.dm_users: list[str] = [users[i] if i < len(users) else f"@stranger{i}:bench" for i in range(dm_rooms)]
+
+    @property
+    def events(self) -> int:
+        return len(self.joiners) + len(self.leavers)
+
+    def hierarchies(self) -> dict[str, list[str]]:
+        return {PUBLIC_SPACE_ID: self.rooms, PRIVATE_SPACE_ID: self.rooms}
+
+    def initial_batch(self) -> dict[str, dict]:
+        """
+        :return: The rooms of the first sync, where the bot and the leavers are already members of everything, and no event needs to be handled.
+        """
+
+        members = [member_event(BOT_USER_ID, "join"), *(member_event(user_id, "join") for user_id in self.leavers)]
+
+        rooms = {
+            PUBLIC_SPACE_ID: joined_room(state=[name_event(BOT_USER_ID, "Public"), *members]),
+            PRIVATE_SPACE_ID: joined_room(state=[name_event(BOT_USER_ID, "Private"), member_event(BOT_USER_ID, "join")]),
+        }
+        for number, room_id in enumerate(self.rooms):
+            rooms[room_id] = joined_room(state=[name_event(BOT_USER_ID, f"Room {number}"), *members])
+        for number, user_id in enumerate(self.dm_users):
+            rooms[f"!dm{number}:bench"] = joined_room(state=[member_event(BOT_USER_ID, "join"), member_event(user_id, "join")])
+        return rooms
+
+    def membership_batch(self) -> dict[str, dict]:
+        """
+        :return: The rooms of the second sync, containing the membership changes to handle.
+        """
+
+        return {
+            PUBLIC_SPACE_ID: joined_room(timeline=[
+                *(member_event(user_id, "join") for user_id in self.joiners),
+                *(member_event(user_id, "leave", prev_membership="join") for user_id in self.leavers),
+            ]),
+        }
+
+
+async def run_benchmark(scenario: Scenario, database_url: str, latency: float = 0) -> dict:
+    """
+    Run the benchmark once.
+
+    :param scenario: The scenario to benchmark.
+    :param database_url: The URL of an empty database to use.
+    :param latency: The number of seconds every request to the homeserver takes to be answered.
+    :return: The results of the benchmark; see :meth:`.Measurement.results`.
+    """
+
+    create_app()
+
+    homeserver = FakeHomeserver(hierarchies=scenario.hierarchies(), latency=latency)
+    homeserver.add_batch(scenario.initial_batch())
+    homeserver.add_batch(scenario.membership_batch())
+    await homeserver.start()
+
+    client = create_client(homeserver, user_id=BOT_USER_ID, database_url=database_url)
+    with sqlalchemy.orm.Session(bind=client.sqla_engine) as session:
+        for user_id in scenario.leavers:
+            MatrixUser.create(session=session, id=user_id)
+        session.commit()
+
+    measurement = Measurement(client, homeserver)
+    try:
+        await client.sync(timeout=0, full_state=True)
+        with measurement:
+            await client.sync(timeout=0)
+    finally:
+        await client.close()
+        await homeserver.stop()
+        client.sqla_engine.dispose()
+
+    return measurement.results()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the handling of membership events against a fake homeserver.")
+    parser.add_argument("--joiners", type=int, default=100, help="the number of users joining the public space")
+    parser.add_argument("--leavers", type=int, default=100, help="the number of users leaving the public space")
+    parser.add_argument("--rooms", type=int, default=20, help="the number of rooms in each space")
+    parser.add_argument("--dm-rooms", type=int, default=100, help="the number of direct message rooms the bot already has")
+    parser.add_argument("--latency", type=float, default=0, help="the number of milliseconds the homeserver takes to answer each request")
+    parser.add_argument("--database-url", help="the URL of an empty database to use, instead of a temporary SQLite file")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON, to compare them across runs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="lokiunimore-bench-") as directory:
+        database_url = args.database_url or f"sqlite:///{os.path.join(directory, 'bench.sqlite')}"
+        configure_environment(database_url, MATRIX_USER_ID=BOT_USER_ID, MATRIX_PUBLIC_SPACE_ID=PUBLIC_SPACE_ID, MATRIX_PRIVATE_SPACE_ID=PRIVATE_SPACE_ID)
+
+        scenario = Scenario(joiners=args.joiners, leavers=args.leavers, rooms=args.rooms, dm_rooms=args.dm_rooms)
+        results = asyncio.run(run_benchmark(scenario, database_url=database_url, latency=args.latency / 1000))
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print(format_results(results))
+
+
+__all__ = (
+    "Scenario",
+    "run_benchmark",
+    "main",
+)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+This module replays a capture recorded by :class:`lokiunimore.matrix.recording.TrafficRecorder` through :class:`lokiunimore.matrix.client.LokiClient`, against a :class:`.FakeHomeserver`.
+
+The recorded sync responses are returned in order, at the pace they were recorded at, or faster; the first one only sets up the state of the rooms, and the members of the spaces it contains are added to the database, as they would be in production.
+
+Besides the results of the other benchmarks, how late the syncs were replayed compared to the recording is reported, to find out whether the bot could keep up.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import sqlalchemy.orm
+
+from lokiunimore.matrix.client import LokiClient, request_endpoint
+from lokiunimore.matrix.recording import read_capture
+from lokiunimore.sql.tables import MatrixUser
+from lokiunimore.web.app import create_app
+from benchmarks.homeserver import FakeHomeserver
+from benchmarks.harness import configure_environment, create_client, Measurement, format_results
+
+_hierarchy_path = re.compile(r"/rooms/([^/]+)/hierarchy")
+
+
+class Capture:
+    """
+    The parts of a capture needed to replay it.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The path of the capture to load.
+        """
+
+        records = read_capture(path)
+        self.header: dict = next(records)
+        self.syncs: list[tuple[float, dict]] = []
+        self.hierarchies: dict[str, list[str]] = {}
+        self.requests: collections.Counter[str] = collections.Counter()
+
+        for record in records:
+            if record["kind"] == "sync":
+                self.syncs.append((record["t"], record["body"]))
+                continue
+
+            path = record["path"].split("?", 1)[0]
+            self.requests[f"{record['method']} {request_endpoint(path)}"] += 1
+            # The hierarchies of the spaces can't be found in the syncs
+            if (match := _hierarchy_path.search(path)) and record["response"]:
+                space_id = match.group(1)
+                self.hierarchies[space_id] = [room["room_id"] for room in record["response"].get("rooms", []) if room["room_id"] != space_id]
+
+    @property
+    def user_id(self) -> str:
+        return self.header["user_id"]
+
+    @property
+    def public_space_id(self) -> str:
+        return self.header["public_space_id"]
+
+    @property
+    def private_space_id(self) -> str:
+        return self.header["private_space_id"]
+
+
+def _without_timelines(body: dict) -> dict:
+    rooms = body.get("rooms", {})
+    joined = {room_id: {**room, "timeline": {**room.get("timeline", {}), "events": []}} for room_id, room in rooms.get("join", {}).items()}
+    return {**body, "rooms": {**rooms, "join": joined, "invite": {}}}
+
+
+def _seed_users(client: LokiClient, capture: Capture) -> int:
+    """
+    Add the members of the spaces to the database, as if the bot had seen them join.
+
+    :return: The number of added users.
+    """
+
+    public = client.rooms.get(capture.public_space_id)
+    private = client.rooms.get(capture.private_space_id)
+    private_members = set(private.users) if private is not None else set()
+
+    count = 0
+    with sqlalchemy.orm.Session(bind=client.sqla_engine) as session:
+        for user_id in (public.users if public is not None else ()):
+            if user_id == client.user_id:
+                continue
+            matrix_user = MatrixUser.create(session=session, id=user_id)
+            matrix_user.joined_private_space = user_id in private_members
+            count += 1
+        session.commit()
+    return count
+
+
+async def replay(capture: Capture, database_url: str, speed: float = 1, latency: float = 0) -> dict:
+    """
+    Replay a capture once.
+
+    :param capture: The capture to replay.
+    :param database_url: The URL of an empty database to use.
+    :param speed: How many times faster than recorded the syncs are replayed, or ``0`` to replay them as fast as possible.
+    :param latency: The number of seconds every request to the homeserver takes to be answered.
+    :return: The results of the replay; see :meth:`.Measurement.results`.
+    """
+
+    if not capture.syncs:
+        raise ValueError("The capture contains no syncs")
+
+    create_app()
+
+    homeserver = FakeHomeserver(hierarchies=capture.hierarchies, latency=latency)
+    (_, initial), *batches = capture.syncs
+    homeserver.add_sync(_without_timelines(initial))
+    for _, body in batches:
+        homeserver.add_sync(body)
+    await homeserver.start()
+
+    client = create_client(homeserver, user_id=capture.user_id, database_url=database_url)
+    measurement = Measurement(client, homeserver)
+    lags = []
+    try:
+        await client.sync(timeout=0, full_state=True)
+        _seed_users(client, capture)
+
+        replay_started_at = time.monotonic()
+        first_offset = batches[0][0] if batches else 0
+        for offset, _ in batches:
+            if speed:
+                scheduled_at = replay_started_at + (offset - first_offset) / speed
+                if (delay := scheduled_at - time.monotonic()) > 0:
+                    await asyncio.sleep(delay)
+                lags.append(max(time.monotonic() - scheduled_at, 0))
+            with measurement:
+                await client.sync(timeout=0)
+    finally:
+        await client.close()
+        await homeserver.stop()
+        client.sqla_engine.dispose()
+
+    return {
+        **measurement.results(),
+        "syncs": len(batches),
+        "recorded_seconds": batches[-1][0] - first_offset if batches else 0,
+        "max_lag_seconds": max(lags, default=0),
+        "recorded_requests": dict(capture.requests.most_common()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a capture of the traffic of the Matrix bot against a fake homeserver.")
+    parser.add_argument("capture", help="the path of the capture to replay, recorded by setting MATRIX_RECORD_DIR")
+    parser.add_argument("--speed", type=float, default=1, help="how many times faster than recorded to replay the syncs, or 0 to replay them as fast as possible")
+    parser.add_argument("--latency", type=float, default=0, help="the number of milliseconds the homeserver takes to answer each request")
+    parser.add_argument("--database-url", help="the URL of an empty database to use, instead of a temporary SQLite file")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON, to compare them across runs")
+    args = parser.parse_args()
+
+    capture = Capture(args.capture)
+
+    with tempfile.TemporaryDirectory(prefix="lokiunimore-replay-") as directory:
+        database_url = args.database_url or f"sqlite:///{os.path.join(directory, 'replay.sqlite')}"
+        configure_environment(database_url, MATRIX_USER_ID=capture.user_id, MATRIX_PUBLIC_SPACE_ID=capture.public_space_id, MATRIX_PRIVATE_SPACE_ID=capture.private_space_id)
+        results = asyncio.run(replay(capture, database_url=database_url, speed=args.speed, latency=args.latency / 1000))
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+
+    print(format_results(results))
+    print(f"{'syncs':<24}{results['syncs']}, recorded over {results['recorded_seconds']:.1f} s")
+    print(f"{'max lag':<24}{results['max_lag_seconds'] * 1000:.2f} ms")
+    print("recorded requests")
+    for route, count in results["recorded_requests"].items():
+        print(f"    {count:>8}  {route}")
+
+
+__all__ = (
+    "Capture",
+    "replay",
+    "main",
+)
+
+
+if __name__ == "__main__":
+    main()
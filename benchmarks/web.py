@@ -0,0 +1,308 @@
+"""
+This module load-tests the account linking flow of the web app, running the production server against fake identity provider and homeserver.
+
+Each simulated user, with a fresh Matrix account in a seeded database, goes through the whole flow:
+
+#. visits their profile page;
+#. starts linking their account, being redirected to the identity provider;
+#. signs in immediately, being redirected back to the web app to authorize the link;
+#. is invited to the private space;
+#. visits their profile page again.
+
+The throughput and the latency percentiles of each route of the web app are reported.
+
+With a read replica, which is a copy of the seeded database never receiving the writes of the journeys, users who see their profile as unlinked at the end of their journey count as stale reads.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+import sqlalchemy
+import sqlalchemy.orm
+import yarl
+
+from lokiunimore.sql.tables import Base, MatrixUser
+from benchmarks.homeserver import FakeHomeserver
+from benchmarks.identity import FakeIdentityProvider
+from benchmarks.harness import benchmark_environment, percentile
+
+JOURNEY = (
+    ("page_matrix_profile", 200),
+    ("page_matrix_link", 302),
+    (None, 302),
+    ("page_oidc_authorize", 302),
+    ("page_matrix_invite", 302),
+    ("page_matrix_profile", 200),
+)
+"""
+The route of each request of a journey, or :data:`None` for the request to the identity provider, along with the expected status.
+"""
+
+
+def seed_users(database_url: str, count: int) -> list[str]:
+    """
+    Create the tables, and add Matrix users who haven't linked an account yet.
+
+    :return: The tokens of the created users.
+    """
+
+    engine = sqlalchemy.create_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+    with sqlalchemy.orm.Session(bind=engine) as session:
+        users = [MatrixUser.create(session=session, id=f"@student{number}:bench") for number in range(count)]
+        session.commit()
+        tokens = [user.token for user in users]
+    engine.dispose()
+    return tokens
+
+
+def copy_database(source_url: str, target_url: str) -> None:
+    """
+    Create the tables in the target database, and copy to it all the rows of the source one, such as to make a read replica which doesn't replicate.
+    """
+
+    source = sqlalchemy.create_engine(source_url)
+    target = sqlalchemy.create_engine(target_url)
+    Base.metadata.create_all(bind=target)
+    with source.connect() as source_connection, target.begin() as target_connection:
+        for table in Base.metadata.sorted_tables:
+            if rows := source_connection.execute(table.select()).mappings().all():
+                target_connection.execute(table.insert(), [dict(row) for row in rows])
+    source.dispose()
+    target.dispose()
+
+
+def _free_port(host: str) -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class Journeys:
+    """
+    Runs the journeys of the simulated users, recording the duration of each request by route.
+    """
+
+    def __init__(self, url: str):
+        """
+        :param url: The URL of the web app.
+        """
+
+        self.url: yarl.URL = yarl.URL(url)
+        self.durations: dict[str, list[float]] = collections.defaultdict(list)
+        self.errors: collections.Counter[str] = collections.Counter()
+
+    async def run(self, number: int, token: str) -> bool:
+        """
+        Run the journey of a user, stopping at the first unexpected response.
+
+        :param number: The number of the user, which their email is derived from.
+        :param token: The token of the profile of the user.
+        :return: Whether the journey was completed.
+        """
+
+        # Flask sets the session cookie for the IP address of the server, which aiohttp only accepts if unsafe
+        async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True)) as session:
+            url = self.url.join(yarl.URL(f"/matrix/{token}/"))
+            for step, (route, expected_status) in enumerate(JOURNEY):
+                if route is None:
+                    # Tell the identity provider who is signing in
+                    url = url.update_query(login_hint=f"student{number}@bench.invalid")
+                elif step == 1:
+                    url = self.url.join(yarl.URL(f"/matrix/{token}/link"))
+
+                start = time.perf_counter()
+                async with session.get(url, allow_redirects=False) as response:
+                    await response.read()
+                    duration = time.perf_counter() - start
+
+                if route is not None:
+                    self.durations[route].append(duration)
+                if response.status != expected_status:
+                    self.errors[route or "identity_provider"] += 1
+                    return False
+                if step == len(JOURNEY) - 1 and f"/matrix/{token}/link" in (await response.text()):
+                    # The profile still offers to link an account, so it was read from a replica missing the link
+                    self.errors["stale_read"] += 1
+                    return False
+                if response.status == 302:
+                    url = response.url.join(yarl.URL(response.headers["Location"]))
+
+        return True
+
+
+def summarize(journeys: Journeys, elapsed: float) -> dict:
+    """
+    :return: The throughput and the latency percentiles of each route, as a JSON-serializable dict.
+    """
+
+    routes = {}
+    for route, durations in journeys.durations.items():
+        routes[route] = {
+            "requests": len(durations),
+            "errors": journeys.errors[route],
+            "requests_per_second": len(durations) / elapsed,
+            "latency_p50_seconds": percentile(durations, 0.5),
+            "latency_p90_seconds": percentile(durations, 0.9),
+            "latency_p99_seconds": percentile(durations, 0.99),
+        }
+    return {"elapsed_seconds": elapsed, "stale_reads": journeys.errors["stale_read"], "routes": routes}
+
+
+def format_summary(summary: dict, completed: int, users: int) -> str:
+    """
+    :return: The results of :func:`.summarize`, formatted for humans.
+    """
+
+    lines = [
+        f"{completed} of {users} journeys completed in {summary['elapsed_seconds']:.2f} s, with {summary['stale_reads']} stale reads",
+        f"{'route':<24}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}",
+    ]
+    for route, values in summary["routes"].items():
+        lines.append(
+            f"{route:<24}{values['requests']:>10}{values['errors']:>8}{values['requests_per_second']:>10.1f}"
+            f"{values['latency_p50_seconds'] * 1000:>10.1f}{values['latency_p90_seconds'] * 1000:>10.1f}{values['latency_p99_seconds'] * 1000:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    """
+    Wait until the web app answers, or raise if it exited or didn't answer in time.
+    """
+
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"The web server exited with status {process.returncode}")
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"The web server didn't answer at {url} within {timeout} seconds")
+
+
+async def load_test(database_url: str, users: int, concurrency: int, workers: int, gevent: bool = False, latency: float = 0, replica_url: str | None = None) -> tuple[dict, int]:
+    """
+    Run the load test once.
+
+    :param database_url: The URL of an empty database to use.
+    :param replica_url: The URL of another empty database, to copy the seeded database to and use as a read replica.
+    :param users: The number of simulated users.
+    :param concurrency: The number of users going through the flow at the same time.
+    :param workers: The number of workers of the web server.
+    :param gevent: Whether the web server should use :mod:`gevent` workers.
+    :param latency: The number of seconds every request to the identity provider and to the homeserver takes to be answered.
+    :return: The results of :func:`.summarize`, and the number of completed journeys.
+    """
+
+    tokens = seed_users(database_url, users)
+    if replica_url:
+        copy_database(database_url, replica_url)
+
+    homeserver = FakeHomeserver(latency=latency)
+    identity_provider = FakeIdentityProvider(latency=latency)
+    await homeserver.start()
+    await identity_provider.start()
+
+    host = "127.0.0.1"
+    port = _free_port(host)
+    environment = benchmark_environment(
+        database_url,
+        MATRIX_HOMESERVER=homeserver.url,
+        OIDC_CONFIGURATION_URL=f"{identity_provider.url}/.well-known/openid-configuration",
+        OIDC_API_BASE_URL=identity_provider.url,
+        OIDC_EMAIL_REGEX=".+",
+        FLASK_SERVER_NAME=f"{host}:{port}",
+        FLASK_PREFERRED_URL_SCHEME="http",
+        GUNICORN_BIND=f"{host}:{port}",
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_ASYNC="true" if gevent else "",
+        SQLALCHEMY_REPLICA_URLS=replica_url or "",
+        LOKI_LOG_LEVEL=os.environ.get("LOKI_LOG_LEVEL", "WARNING"),
+        # The identity provider doesn't use HTTPS
+        AUTHLIB_INSECURE_TRANSPORT="1",
+    )
+    server = subprocess.Popen([sys.executable, "-m", "lokiunimore.web.server"], env=environment)
+
+    url = f"http://{host}:{port}"
+    journeys = Journeys(url)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def journey(number: int, token: str) -> bool:
+        async with semaphore:
+            return await journeys.run(number, token)
+
+    try:
+        await wait_until_ready(url, server)
+        start = time.perf_counter()
+        completed = sum(await asyncio.gather(*(journey(number, token) for number, token in enumerate(tokens))))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+        await identity_provider.stop()
+        await homeserver.stop()
+
+    return summarize(journeys, elapsed), completed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the account linking flow of the web app against fake identity provider and homeserver.")
+    parser.add_argument("--users", type=int, default=200, help="the number of simulated users")
+    parser.add_argument("--concurrency", type=int, default=20, help="the number of users going through the flow at the same time")
+    parser.add_argument("--workers", type=int, default=4, help="the number of workers of the web server")
+    parser.add_argument("--gevent", action="store_true", help="use gevent workers, as with GUNICORN_ASYNC")
+    parser.add_argument("--latency", type=float, default=0, help="the number of milliseconds the identity provider and the homeserver take to answer each request")
+    parser.add_argument("--database-url", help="the URL of an empty database to use, instead of a temporary SQLite file")
+    parser.add_argument("--replica", action="store_true", help="read from a copy of the seeded database in a temporary SQLite file, as from a replica")
+    parser.add_argument("--replica-url", help="the URL of another empty database to copy the seeded database to and read from, as from a replica")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON, to compare them across runs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="lokiunimore-web-") as directory:
+        database_url = args.database_url or f"sqlite:///{os.path.join(directory, 'web.sqlite')}"
+        replica_url = args.replica_url or (f"sqlite:///{os.path.join(directory, 'replica.sqlite')}" if args.replica else None)
+        summary, completed = asyncio.run(load_test(
+            database_url,
+            users=args.users,
+            concurrency=args.concurrency,
+            workers=args.workers,
+            gevent=args.gevent,
+            latency=args.latency / 1000,
+            replica_url=replica_url,
+        ))
+
+    if args.json:
+        json.dump({**summary, "users": args.users, "completed": completed}, sys.stdout, indent=2)
+        print()
+    else:
+        print(format_summary(summary, completed=completed, users=args.users))
+
+
+__all__ = (
+    "JOURNEY",
+    "seed_users",
+    "copy_database",
+    "Journeys",
+    "summarize",
+    "format_summary",
+    "load_test",
+    "main",
+)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,11 @@
 Module listing all configurable variables.
 """
 
+import os
 import re
+import logging
+import tempfile
 import cfig
-import sqlalchemy.engine
 import dotenv
 
 
@@ -20,6 +22,132 @@ def LOKI_EMAIL(val: str) -> str:
     return val
 
 
+@config.optional()
+def LOKI_HEALTH_BIND(val: str | None) -> tuple[str, int] | None:
+    """
+    The address and port the unified runtime of the bots should report the health of its components and its metrics at, such as `127.0.0.1:8081`.
+    If not set, health is not reported.
+    """
+    if not val:
+        return None
+    host, port = val.rsplit(":", 1)
+    return host, int(port)
+
+
+@config.optional()
+def LOKI_METRICS_BIND(val: str | None) -> tuple[str, int] | None:
+    """
+    The address and port each process should serve its metrics at, such as `127.0.0.1:9100`.
+    If the port is taken, such as by another worker of the web server, the following ports are tried.
+    If not set, metrics are only served by the unified runtime, at the address of `LOKI_HEALTH_BIND`.
+    """
+    if not val:
+        return None
+    host, port = val.rsplit(":", 1)
+    return host, int(port)
+
+
+@config.optional()
+def LOKI_TRACE_EXPORT(val: str | None) -> str | None:
+    """
+    Where the bots should export the traces of the events they handle: either the URL of a collector accepting OTLP over HTTP with JSON encoding, such as `http://127.0.0.1:4318`, or the path of a file to append them to.
+    If not set, events are not traced.
+    """
+    return val or None
+
+
+@config.optional()
+def LOKI_TRACE_SAMPLE_RATE(val: str | None) -> float:
+    """
+    The fraction of the events to trace, between `0` and `1`.
+    Defaults to `1`, tracing every event.
+    """
+    if not val:
+        return 1.0
+    rate = float(val)
+    if not 0 <= rate <= 1:
+        raise ValueError("LOKI_TRACE_SAMPLE_RATE must be between 0 and 1")
+    return rate
+
+
+def parse_log_levels(val: str) -> dict[str, int]:
+    """
+    Parse levels in the format of `LOKI_LOG_LEVEL`, such as `INFO,lokiunimore.matrix.client=DEBUG`.
+
+    :return: The level of each logger by name, where the empty name stands for the logger of the whole package.
+    :raises ValueError: If any of the levels is unknown.
+    """
+    levels = {}
+    for item in val.split(","):
+        name, _, level = item.rpartition("=")
+        number = logging.getLevelName(level.strip().upper())
+        if not isinstance(number, int):
+            raise ValueError(f"Unknown log level: {level!r}")
+        levels[name.strip()] = number
+    return levels
+
+
+@config.optional()
+def LOKI_LOG_LEVEL(val: str | None) -> dict[str, int]:
+    """
+    The minimum level of the messages to log, such as `INFO`, optionally followed by the levels of specific loggers, such as `INFO,lokiunimore.matrix.client=DEBUG`.
+    Defaults to `DEBUG`.
+    """
+    return parse_log_levels(val or "DEBUG")
+
+
+@config.optional()
+def LOKI_LOG_LEVEL_FILE(val: str | None) -> str | None:
+    """
+    The path of a file containing log levels in the same format as `LOKI_LOG_LEVEL`, which replace them whenever the process receives `SIGHUP`, so that they can be changed without restarting it.
+    If not set, `SIGHUP` is left to its default action.
+    """
+    return val or None
+
+
+@config.optional()
+def LOKI_LOG_FORMAT(val: str | None) -> str:
+    """
+    How to format logged messages: either `color`, for human-readable colored lines, or `json`, for one JSON object per line, suitable for log shipping.
+    Defaults to `color`.
+    """
+    val = (val or "color").lower()
+    if val not in ("color", "json"):
+        raise ValueError("LOKI_LOG_FORMAT must be either `color` or `json`")
+    return val
+
+
+@config.optional()
+def LOKI_PROFILE_DIR(val: str | None) -> str:
+    """
+    The directory the bots should write their profiles to, when profiling is toggled by sending them `SIGUSR1`.
+    Defaults to the temporary directory of the system.
+    """
+    return val or tempfile.gettempdir()
+
+
+@config.optional()
+def LOKI_LOOP_LAG_THRESHOLD(val: str | None) -> float:
+    """
+    The number of milliseconds a callback of the bots may block their event loop for before it is logged, along with its stack.
+    Set to `0` to not watch the event loop.
+    Defaults to `250`.
+    """
+    if not val:
+        return 0.25
+    return int(val) / 1000
+
+
+@config.optional()
+def LOKI_CONFIG_SNAPSHOT(val: str | None) -> str | None:
+    """
+    The path of a configuration snapshot written by `python -m lokiunimore.config.snapshot`, to load the whole configuration from instead of resolving it again at every start.
+    Once set, every other variable is ignored, so the snapshot must be written again when any of them changes.
+    If not set, the configuration is resolved from the environment.
+    """
+    return val or None
+
+
 @config.required()
 def MATRIX_HOMESERVER(val: str) -> str:
     """
@@ -60,6 +188,35 @@ def MATRIX_SKIP_EVENTS(val: str | None) -> bool:
     return val and val.lower() == "true"
 
 
+@config.optional()
+def MATRIX_RECONCILE_INTERVAL(val: str | None) -> int:
+    """
+    The number of seconds between two reconciliations of the database with the actual members of the Matrix spaces, performed by the Matrix bot to recover from missed events.
+    For example, `21600` to reconcile every six hours.
+    Defaults to `0`, which disables periodic reconciliation; it can still be performed manually with `python -m lokiunimore.matrix.reconcile`.
+    """
+    if not val:
+        return 0
+    return int(val)
+
+
+@config.optional()
+def MATRIX_MEMBERSHIP_QUEUE(val: str | None) -> bool:
+    """
+    Set this to `true` to have the Matrix bot queue the membership changes of the spaces in the database instead of handling them itself, so that they can be handled in parallel by any number of `python -m lokiunimore.matrix.worker` processes.
+    """
+    return bool(val) and val.lower() == "true"
+
+
+@config.optional()
+def MATRIX_RECORD_DIR(val: str | None) -> str | None:
+    """
+    The directory the Matrix bot should record its traffic with the homeserver to, redacted, so that it can be replayed with `python -m benchmarks.replay`.
+    Defaults to not recording anything.
+    """
+    return val or None
+
+
 @config.required()
 def MATRIX_PUBLIC_SPACE_ID(val: str) -> str:
     """
@@ -176,6 +333,41 @@ def TELEGRAM_PRIVATE_JOIN_LINKS(val: str) -> dict:
     return mapping
 
 
+@config.optional()
+def TELEGRAM_PUBLIC_CHAT_ID(val: str | None) -> int | None:
+    """
+    The marked id of the public Telegram group to monitor, whose members may verify their identity.
+    For example, `-1001234567890`.
+    If not set, joins and leaves of Telegram groups are not monitored.
+    """
+    if not val:
+        return None
+    return int(val)
+
+
+@config.optional()
+def TELEGRAM_PRIVATE_CHAT_IDS(val: str | None) -> list[int]:
+    """
+    A `|` separated list of the marked ids of the private Telegram groups to monitor, whose members must have verified their identity.
+    For example, `-1001234567890|-1009876543210`.
+    """
+    if not val:
+        return []
+    return [int(chat_id) for chat_id in val.split("|")]
+
+
+@config.optional()
+def TELEGRAM_INVITE_POOL_SIZE(val: str | None) -> int:
+    """
+    The number of unused single-use invite links the bot should keep ready for each of the `TELEGRAM_PRIVATE_CHAT_IDS`, to hand out to verified users.
+    If `0`, no links are generated, and the `TELEGRAM_PRIVATE_JOIN_LINKS` are displayed instead.
+    Defaults to `20`.
+    """
+    if not val:
+        return 20
+    return int(val)
+
+
 @config.required()
 def TELEGRAM_HELP_ROOM_USERNAME(val: str) -> str:
     """
@@ -194,14 +386,105 @@ def DISCORD_INVITE_LINK(val: str) -> str:
 
 
 @config.required()
-def SQLALCHEMY_DATABASE_URL(val: str) -> sqlalchemy.engine.URL:
+def SQLALCHEMY_DATABASE_URL(val: str) -> "sqlalchemy.engine.URL":
     """
     The URL of the database to store data in.
     https://docs.sqlalchemy.org/en/14/core/engines.html#database-urls
     """
+    # Imported here, so that displaying the configuration doesn't import the whole of sqlalchemy
+    import sqlalchemy.engine.url
     return sqlalchemy.engine.url.make_url(val)
 
 
+@config.optional()
+def SQLALCHEMY_POOL_SIZE(val: str | None) -> int:
+    """
+    The number of connections to the database each process should keep open, shared by all its components.
+    The web server keeps a pool in each of its workers.
+    Defaults to `5`.
+    """
+    if not val:
+        return 5
+    return int(val)
+
+
+@config.optional()
+def SQLALCHEMY_MAX_OVERFLOW(val: str | None) -> int:
+    """
+    The number of connections to the database each process may open temporarily beyond `SQLALCHEMY_POOL_SIZE`, closing them as soon as they are returned.
+    Once all are in use, further queries wait for one to be returned.
+    Defaults to `5`.
+    """
+    if not val:
+        return 5
+    return int(val)
+
+
+@config.optional()
+def SQLALCHEMY_POOL_RECYCLE(val: str | None) -> int:
+    """
+    The number of seconds after which a pooled connection to the database is closed and opened again, before the database or a proxy drops it for being idle.
+    Set to `-1` to never recycle connections.
+    Defaults to `1800`.
+    """
+    if not val:
+        return 1800
+    return int(val)
+
+
+@config.optional()
+def SQLALCHEMY_POOL_PRE_PING(val: str | None) -> bool:
+    """
+    Set this to `false` to stop checking that a pooled connection to the database is still alive before using it, saving a round trip per checkout at the cost of failing a query whenever the database restarts.
+    """
+    return not val or val.lower() != "false"
+
+
+@config.optional()
+def SQLALCHEMY_STATEMENT_CACHE_SIZE(val: str | None) -> int:
+    """
+    The number of compiled SQL statements each process should cache, so that queries run repeatedly aren't compiled again every time.
+    Set to `0` to disable the cache.
+    Defaults to `500`.
+    """
+    if not val:
+        return 500
+    return int(val)
+
+
+@config.optional()
+def SQLALCHEMY_PGBOUNCER(val: str | None) -> bool:
+    """
+    Set this to `true` if the database is reached through PgBouncer, to have every process leave the pooling to it instead of keeping connections open of its own.
+    PgBouncer must use the `session` pool mode for the leader election of the Matrix bot to work, as it relies on session-level advisory locks.
+    """
+    return bool(val) and val.lower() == "true"
+
+
+@config.optional()
+def SQLALCHEMY_REPLICA_URLS(val: str | None) -> tuple["sqlalchemy.engine.URL", ...]:
+    """
+    The space-separated URLs of read replicas of the database, which the web app should send the queries of its read-only pages to.
+    Users who have just written to the database read from it instead for `SQLALCHEMY_REPLICA_MAX_LAG` seconds, so that they see their own changes.
+    If not set, every query is sent to the database.
+    """
+    if not val:
+        return ()
+    import sqlalchemy.engine.url
+    return tuple(sqlalchemy.engine.url.make_url(url) for url in val.split())
+
+
+@config.optional()
+def SQLALCHEMY_REPLICA_MAX_LAG(val: str | None) -> int:
+    """
+    The number of seconds the replicas in `SQLALCHEMY_REPLICA_URLS` may lag behind the database, during which users who have just written to it keep reading from it.
+    Defaults to `30`.
+    """
+    if not val:
+        return 30
+    return int(val)
+
+
 @config.required()
 def FLASK_SECRET_KEY(val: str) -> str:
     """
@@ -238,6 +521,59 @@ def FLASK_PREFERRED_URL_SCHEME(val: str) -> str:
     return val
 
 
+@config.optional()
+def FLASK_STATIC_BUILD_DIR(val: str | None) -> str:
+    """
+    The directory where the fingerprinted and precompressed static assets of the Flask webserver are built in.
+    Defaults to a `lokiunimore-static` directory in the system's temporary directory.
+    """
+    if not val:
+        return os.path.join(tempfile.gettempdir(), "lokiunimore-static")
+    return val
+
+
+@config.optional()
+def GUNICORN_BIND(val: str | None) -> str:
+    """
+    The address the production web server should listen on.
+    Defaults to `0.0.0.0:80`.
+    """
+    if not val:
+        return "0.0.0.0:80"
+    return val
+
+
+@config.optional()
+def GUNICORN_WORKERS(val: str | None) -> int:
+    """
+    The number of worker processes the production web server should fork.
+    Defaults to twice the number of CPUs plus one.
+    """
+    if not val:
+        return (os.cpu_count() or 1) * 2 + 1
+    return int(val)
+
+
+@config.optional()
+def GUNICORN_ASYNC(val: str | None) -> bool:
+    """
+    Set this to `true` to have the production web server use cooperative gevent workers, which keep serving other requests while waiting for the identity provider, the homeserver or the database.
+    Requires the `async` extra to be installed.
+    """
+    return bool(val) and val.lower() == "true"
+
+
+@config.optional()
+def GUNICORN_WORKER_CONNECTIONS(val: str | None) -> int:
+    """
+    The maximum number of requests each worker of the production web server should handle concurrently, if `GUNICORN_ASYNC` is enabled.
+    Defaults to `1000`.
+    """
+    if not val:
+        return 1000
+    return int(val)
+
+
 @config.required()
 def OIDC_CLIENT_ID(val: str) -> str:
     """
@@ -296,13 +632,38 @@ def OIDC_EMAIL_REGEX(val: str) -> re.Pattern:
     return re.compile(val)
 
 
+@config.optional()
+def OIDC_CACHE_TTL(val: str | None) -> int:
+    """
+    The number of seconds the OpenID Connect discovery document and signing keys are cached for in the database before being fetched again.
+    Signing keys are always fetched again if an unknown key is encountered, to handle key rotation.
+    Defaults to `3600`.
+    """
+    if not val:
+        return 3600
+    return int(val)
+
+
 __all__ = (
     "config",
     "LOKI_EMAIL",
+    "LOKI_HEALTH_BIND",
+    "LOKI_METRICS_BIND",
+    "LOKI_LOG_LEVEL",
+    "LOKI_LOG_LEVEL_FILE",
+    "LOKI_LOG_FORMAT",
+    "LOKI_PROFILE_DIR",
+    "LOKI_LOOP_LAG_THRESHOLD",
+    "LOKI_CONFIG_SNAPSHOT",
+    "LOKI_TRACE_EXPORT",
+    "LOKI_TRACE_SAMPLE_RATE",
     "MATRIX_HOMESERVER",
     "MATRIX_USER_ID",
     "MATRIX_USER_SECRET",
     "MATRIX_SKIP_EVENTS",
+    "MATRIX_RECONCILE_INTERVAL",
+    "MATRIX_MEMBERSHIP_QUEUE",
+    "MATRIX_RECORD_DIR",
     "MATRIX_PUBLIC_SPACE_ID",
     "MATRIX_PUBLIC_SPACE_ALIAS",
     "MATRIX_PRIVATE_SPACE_ID",
@@ -313,17 +674,34 @@ __all__ = (
     "TELEGRAM_BOT_USERNAME",
     "TELEGRAM_PUBLIC_JOIN_LINK",
     "TELEGRAM_PRIVATE_JOIN_LINKS",
+    "TELEGRAM_PUBLIC_CHAT_ID",
+    "TELEGRAM_PRIVATE_CHAT_IDS",
+    "TELEGRAM_INVITE_POOL_SIZE",
     "TELEGRAM_HELP_ROOM_USERNAME",
     "DISCORD_INVITE_LINK",
     "SQLALCHEMY_DATABASE_URL",
+    "SQLALCHEMY_POOL_SIZE",
+    "SQLALCHEMY_MAX_OVERFLOW",
+    "SQLALCHEMY_POOL_RECYCLE",
+    "SQLALCHEMY_POOL_PRE_PING",
+    "SQLALCHEMY_STATEMENT_CACHE_SIZE",
+    "SQLALCHEMY_PGBOUNCER",
+    "SQLALCHEMY_REPLICA_URLS",
+    "SQLALCHEMY_REPLICA_MAX_LAG",
     "FLASK_SECRET_KEY",
     "FLASK_SERVER_NAME",
     "FLASK_APPLICATION_ROOT",
     "FLASK_PREFERRED_URL_SCHEME",
+    "FLASK_STATIC_BUILD_DIR",
+    "GUNICORN_BIND",
+    "GUNICORN_WORKERS",
+    "GUNICORN_ASYNC",
+    "GUNICORN_WORKER_CONNECTIONS",
     "OIDC_CLIENT_ID",
     "OIDC_CLIENT_SECRET",
     "OIDC_CONFIGURATION_URL",
     "OIDC_API_BASE_URL",
     "OIDC_SCOPES",
     "OIDC_EMAIL_REGEX",
+    "OIDC_CACHE_TTL",
 )
@@ -0,0 +1,243 @@
+"""
+Module defining an immutable snapshot of the whole configuration, resolved and validated once per process.
+
+The snapshot may be written to a file, such as while building a container image, so that processes started later load it instead of resolving the configuration again::
+
+    $ python -m lokiunimore.config.snapshot /etc/lokiunimore/config.json
+    $ LOKI_CONFIG_SNAPSHOT=/etc/lokiunimore/config.json python -m lokiunimore.matrix
+"""
+
+import argparse
+import dataclasses
+import functools
+import json
+import logging
+import os
+import re
+import sys
+import types
+import typing as t
+
+from .config import config, LOKI_CONFIG_SNAPSHOT
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+"""
+The version of the format of the snapshot files, increased whenever it changes incompatibly.
+"""
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class ConfigSnapshot:
+    """
+    The resolved value of every configurable variable, as an attribute named like it.
+
+    Mappings and sequences are frozen into :class:`types.MappingProxyType` and :class:`tuple`, so that no value may be changed after the snapshot is taken.
+
+    See :mod:`lokiunimore.config.config` for the description of each variable.
+    """
+
+    LOKI_EMAIL: str
+    LOKI_HEALTH_BIND: tuple[str, int] | None
+    LOKI_METRICS_BIND: tuple[str, int] | None
+    LOKI_TRACE_EXPORT: str | None
+    LOKI_TRACE_SAMPLE_RATE: float
+    LOKI_LOG_LEVEL: t.Mapping[str, int]
+    LOKI_LOG_LEVEL_FILE: str | None
+    LOKI_LOG_FORMAT: str
+    LOKI_PROFILE_DIR: str
+    LOKI_LOOP_LAG_THRESHOLD: float
+    LOKI_CONFIG_SNAPSHOT: str | None
+    MATRIX_HOMESERVER: str
+    MATRIX_USER_ID: str
+    MATRIX_USER_SECRET: str
+    MATRIX_SKIP_EVENTS: bool
+    MATRIX_RECONCILE_INTERVAL: int
+    MATRIX_MEMBERSHIP_QUEUE: bool
+    MATRIX_RECORD_DIR: str | None
+    MATRIX_PUBLIC_SPACE_ID: str
+    MATRIX_PUBLIC_SPACE_ALIAS: str
+    MATRIX_PRIVATE_SPACE_ID: str
+    MATRIX_HELP_ROOM_ALIAS: str
+    TELEGRAM_APP_ID: int
+    TELEGRAM_APP_HASH: str
+    TELEGRAM_BOT_TOKEN: str
+    TELEGRAM_BOT_USERNAME: str
+    TELEGRAM_PUBLIC_JOIN_LINK: str
+    TELEGRAM_PRIVATE_JOIN_LINKS: t.Mapping[str, str]
+    TELEGRAM_PUBLIC_CHAT_ID: int | None
+    TELEGRAM_PRIVATE_CHAT_IDS: tuple[int, ...]
+    TELEGRAM_INVITE_POOL_SIZE: int
+    TELEGRAM_HELP_ROOM_USERNAME: str
+    DISCORD_INVITE_LINK: str
+    SQLALCHEMY_DATABASE_URL: "sqlalchemy.engine.URL"
+    SQLALCHEMY_POOL_SIZE: int
+    SQLALCHEMY_MAX_OVERFLOW: int
+    SQLALCHEMY_POOL_RECYCLE: int
+    SQLALCHEMY_POOL_PRE_PING: bool
+    SQLALCHEMY_STATEMENT_CACHE_SIZE: int
+    SQLALCHEMY_PGBOUNCER: bool
+    SQLALCHEMY_REPLICA_URLS: tuple["sqlalchemy.engine.URL", ...]
+    SQLALCHEMY_REPLICA_MAX_LAG: int
+    FLASK_SECRET_KEY: str
+    FLASK_SERVER_NAME: str
+    FLASK_APPLICATION_ROOT: str
+    FLASK_PREFERRED_URL_SCHEME: str
+    FLASK_STATIC_BUILD_DIR: str
+    GUNICORN_BIND: str
+    GUNICORN_WORKERS: int
+    GUNICORN_ASYNC: bool
+    GUNICORN_WORKER_CONNECTIONS: int
+    OIDC_CLIENT_ID: str
+    OIDC_CLIENT_SECRET: str
+    OIDC_CONFIGURATION_URL: str
+    OIDC_API_BASE_URL: str
+    OIDC_SCOPES: str
+    OIDC_EMAIL_REGEX: re.Pattern
+    OIDC_CACHE_TTL: int
+
+    @classmethod
+    def from_values(cls, values: t.Mapping[str, t.Any]) -> "ConfigSnapshot":
+        """
+        :param values: The resolved value of every configurable variable, by name.
+        :raises ValueError: If ``values`` doesn't contain exactly the configurable variables.
+        """
+
+        expected = set(config.proxies)
+        if missing := expected - values.keys():
+            raise ValueError(f"Missing values for {', '.join(sorted(missing))}")
+        if unknown := values.keys() - expected:
+            raise ValueError(f"Unknown variables {', '.join(sorted(unknown))}")
+        return cls(**{key: _freeze(value) for key, value in values.items()})
+
+    @classmethod
+    def from_config(cls) -> "ConfigSnapshot":
+        """
+        Resolve every configurable variable from the sources of :data:`lokiunimore.config.config`.
+
+        :raises cfig.errors.BatchResolutionFailure: If any variable is missing or invalid, listing all of them.
+        """
+
+        return cls.from_values(config.proxies.resolve())
+
+    @classmethod
+    def load(cls, path: str) -> "ConfigSnapshot":
+        """
+        Load a snapshot written by :meth:`.dump`, without running any resolver.
+
+        :raises ValueError: If the file is not a snapshot, or was written for a different version of the configuration.
+        """
+
+        with open(path) as file:
+            document = json.load(file)
+
+        if document.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} is not a configuration snapshot of version {SNAPSHOT_VERSION}")
+        return cls.from_values({key: _decode(value) for key, value in document["values"].items()})
+
+    def dump(self, path: str) -> None:
+        """
+        Write the snapshot to a JSON file, readable only by its owner as it contains secrets.
+        """
+
+        document = {
+            "version": SNAPSHOT_VERSION,
+            "values": {field.name: _encode(getattr(self, field.name)) for field in dataclasses.fields(self)},
+        }
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(descriptor, "w") as file:
+            json.dump(document, file, indent=2)
+
+    def as_dict(self) -> dict[str, t.Any]:
+        """
+        :return: The value of every configurable variable, by name, such as to update the configuration of :mod:`flask` with.
+        """
+
+        return {field.name: getattr(self, field.name) for field in dataclasses.fields(self)}
+
+    def install(self) -> None:
+        """
+        Make the proxies of :data:`lokiunimore.config.config` return the values of this snapshot, so that code reading them sees the same values without resolving them again.
+        """
+
+        for key, proxy in config.proxies.items():
+            proxy.__wrapped__ = getattr(self, key)
+
+
+def _freeze(value: t.Any) -> t.Any:
+    # Exact types only, as the URL of the database is a named tuple
+    if type(value) is dict:
+        return types.MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if type(value) in (list, tuple):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _encode(value: t.Any) -> t.Any:
+    if hasattr(value, "render_as_string"):
+        return {"url": value.render_as_string(hide_password=False)}
+    if isinstance(value, re.Pattern):
+        return {"pattern": value.pattern, "flags": value.flags}
+    if isinstance(value, t.Mapping):
+        return {"mapping": {key: _encode(item) for key, item in value.items()}}
+    if isinstance(value, tuple):
+        return {"tuple": [_encode(item) for item in value]}
+    return value
+
+
+def _decode(value: t.Any) -> t.Any:
+    if not isinstance(value, dict):
+        return value
+    if "mapping" in value:
+        return {key: _decode(item) for key, item in value["mapping"].items()}
+    if "tuple" in value:
+        return tuple(_decode(item) for item in value["tuple"])
+    if "pattern" in value:
+        return re.compile(value["pattern"], value["flags"])
+    if "url" in value:
+        # Imported here, so that loading a snapshot imports sqlalchemy only as much as resolving the configuration would
+        import sqlalchemy.engine.url
+        return sqlalchemy.engine.url.make_url(value["url"])
+    raise ValueError(f"Unknown encoded value: {value!r}")
+
+
+@functools.cache
+def get_snapshot() -> ConfigSnapshot:
+    """
+    Take the snapshot of the configuration the first time it is called in the process, and return the same snapshot afterwards.
+
+    The snapshot is loaded from :data:`lokiunimore.config.LOKI_CONFIG_SNAPSHOT` if set, or resolved from the environment otherwise; either way, it is then installed in the proxies of the configuration.
+
+    :raises cfig.errors.BatchResolutionFailure: If any variable is missing or invalid.
+    """
+
+    if path := LOKI_CONFIG_SNAPSHOT.__wrapped__:
+        log.debug("Loading the configuration snapshot at %s", path)
+        # The path the snapshot was written with, if any, may differ from the one it was loaded from
+        snapshot = dataclasses.replace(ConfigSnapshot.load(path), LOKI_CONFIG_SNAPSHOT=path)
+    else:
+        snapshot = ConfigSnapshot.from_config()
+    snapshot.install()
+    return snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve and validate the configuration, and write it to a snapshot to be loaded via LOKI_CONFIG_SNAPSHOT.")
+    parser.add_argument("path", help="the path of the snapshot to write")
+    args = parser.parse_args()
+
+    snapshot = ConfigSnapshot.from_config()
+    snapshot.dump(args.path)
+    print(f"Wrote the snapshot of {len(config.proxies)} variables to {args.path}", file=sys.stderr)
+
+
+__all__ = (
+    "SNAPSHOT_VERSION",
+    "ConfigSnapshot",
+    "get_snapshot",
+)
+
+
+if __name__ == "__main__":
+    main()
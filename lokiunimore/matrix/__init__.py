@@ -1 +1,10 @@
-from .client import *
+import importlib
+
+
+def __getattr__(name):
+    # Lazily re-export the contents of .client, so that importing a submodule doesn't import the whole client.
+    module = importlib.import_module(".client", __name__)
+    try:
+        return getattr(module, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
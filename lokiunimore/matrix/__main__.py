@@ -1,26 +1,58 @@
 import asyncio
 
 from lokiunimore.utils.logs import install_log_handler
+from lokiunimore.utils.metrics import serve_metrics
+from lokiunimore.utils.tracing import tracer, exporter_for
+from lokiunimore.utils.profiling import install_profiling
 from lokiunimore.matrix.client import LokiClient
-from lokiunimore.config import config, MATRIX_USER_SECRET, MATRIX_HOMESERVER, MATRIX_USER_ID, SQLALCHEMY_DATABASE_URL
+from lokiunimore.matrix.reconcile import Reconciler
+from lokiunimore.matrix.recording import TrafficRecorder
+from lokiunimore.sql.leader import LeaderElection
+from lokiunimore.web.app import create_app, shared_engine
+from lokiunimore.config import LOKI_METRICS_BIND, LOKI_TRACE_EXPORT, LOKI_TRACE_SAMPLE_RATE, LOKI_PROFILE_DIR, LOKI_LOOP_LAG_THRESHOLD, MATRIX_USER_SECRET, MATRIX_HOMESERVER, MATRIX_USER_ID, MATRIX_RECONCILE_INTERVAL, MATRIX_MEMBERSHIP_QUEUE, MATRIX_RECORD_DIR, MATRIX_PUBLIC_SPACE_ID, MATRIX_PRIVATE_SPACE_ID
+from lokiunimore.config.snapshot import get_snapshot
 
 
 def main():
     install_log_handler()
+    create_app()
+    sqla_engine = shared_engine()
+    if bind := LOKI_METRICS_BIND.__wrapped__:
+        serve_metrics(bind)
+    if target := LOKI_TRACE_EXPORT.__wrapped__:
+        tracer.configure(exporter_for(target), sample_rate=LOKI_TRACE_SAMPLE_RATE.__wrapped__)
     loop = asyncio.new_event_loop()
 
     client = LokiClient(
         homeserver=MATRIX_HOMESERVER.__wrapped__,
         user=MATRIX_USER_ID.__wrapped__,
-        database_url=SQLALCHEMY_DATABASE_URL.__wrapped__
+        sqla_engine=sqla_engine,
+        queue_membership=MATRIX_MEMBERSHIP_QUEUE.__wrapped__,
     )
 
+    if record_dir := MATRIX_RECORD_DIR.__wrapped__:
+        client.recorder = TrafficRecorder(record_dir, user_id=MATRIX_USER_ID.__wrapped__, public_space_id=MATRIX_PUBLIC_SPACE_ID.__wrapped__, private_space_id=MATRIX_PRIVATE_SPACE_ID.__wrapped__)
+
+    # Only one replica may act at a time, the others wait logged in to take over
+    election = LeaderElection(client.sqla_engine, name="matrix")
+
+    async def lead():
+        if interval := MATRIX_RECONCILE_INTERVAL.__wrapped__:
+            reconciler = Reconciler(client)
+            # Keep a reference, so that the task isn't garbage collected
+            reconcile_task = asyncio.create_task(reconciler.run_forever(interval))
+
+        await client.sync_forever(60_000, full_state=True, set_presence="online")
+
     async def run():
+        install_profiling(output_dir=LOKI_PROFILE_DIR.__wrapped__, lag_threshold=LOKI_LOOP_LAG_THRESHOLD.__wrapped__)
         await client.login_with_shared_secret(MATRIX_USER_SECRET.__wrapped__)
-        await client.sync_forever(60_000, full_state=True, set_presence="online")
+        await election.lead(lead)
 
     async def cleanup():
         await client.logout()
+        if client.recorder is not None:
+            client.recorder.close()
 
     try:
         loop.run_until_complete(run())
@@ -29,5 +61,5 @@ def main():
 
 
 if __name__ == "__main__":
-    config.proxies.resolve()
+    get_snapshot()
     main()
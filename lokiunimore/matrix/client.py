@@ -11,6 +11,8 @@ import nio.crypto
 import logging
 import hashlib
 import hmac
+import re
+import time
 import typing as t
 import functools
 import sqlalchemy
@@ -19,13 +21,40 @@ import sqlalchemy.orm
 T = t.TypeVar("T")
 log = logging.getLogger(__name__)
 
-from lokiunimore.sql.tables import MatrixUser, MatrixProcessedEvent
+from lokiunimore.sql.tables import Community, MatrixUser, MatrixProcessedEvent
+from lokiunimore.sql.communities import CommunityRegistry
+from lokiunimore.sql.engine import create_engine
 from lokiunimore.utils.device_names import generate_device_name
-from lokiunimore.config import MATRIX_PUBLIC_SPACE_ID, MATRIX_PRIVATE_SPACE_ID, MATRIX_SKIP_EVENTS
-from lokiunimore.matrix.templates.messages import WELCOME_MESSAGE_TEXT, WELCOME_MESSAGE_HTML, SUCCESS_MESSAGE_TEXT, SUCCESS_MESSAGE_HTML, GOODBYE_MESSAGE_TEXT, GOODBYE_MESSAGE_HTML, UNLINK_MESSAGE_TEXT, UNLINK_MESSAGE_HTML
+from lokiunimore.utils.metrics import counter, histogram
+from lokiunimore.utils.tracing import tracer, traced
+from lokiunimore.config import MATRIX_SKIP_EVENTS
+from lokiunimore.matrix.queue import enqueue_membership
+from lokiunimore.matrix.recording import TrafficRecorder
+from lokiunimore.matrix.templates import messages
 from lokiunimore.web.app import app
 
 
+REQUEST_SECONDS = histogram("loki_matrix_request_seconds", "Duration of the requests to the homeserver, including retries.", labels=("method", "endpoint", "status"))
+SYNC_SECONDS = histogram("loki_matrix_sync_seconds", "Duration of the sync requests, including the time spent waiting for new events.", buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 90, 120))
+SYNC_BYTES = histogram("loki_matrix_sync_bytes", "Size of the bodies of the sync responses.", buckets=(1e3, 1e4, 1e5, 1e6, 1e7, 1e8))
+EVENTS_TOTAL = counter("loki_matrix_events_total", "Events received by the callbacks of the bot, by type and by what was done with them.", labels=("type", "outcome"))
+HANDLER_SECONDS = histogram("loki_matrix_handler_seconds", "Duration of the handlers of membership changes.", labels=("handler",))
+
+_static_segment = re.compile(r"^(?:[a-zA-Z_.]+|[rv]\d+)$")
+
+
+def request_endpoint(path: str) -> str:
+    """
+    Remove the query and the identifiers from the path of a request, so that requests to the same endpoint share the same metrics.
+
+    :param path: The path of the request, such as ``/_matrix/client/r0/rooms/%21a%3Ab/invite?access_token=...``.
+    :return: The path of the endpoint, such as ``/_matrix/client/r0/rooms/{}/invite``.
+    """
+
+    segments = path.split("?", 1)[0].split("/")
+    return "/".join(segment if not segment or _static_segment.match(segment) else "{}" for segment in segments)
+
+
 class RequestError(Exception):
     """
     A request to the Matrix homeserver failed.
@@ -42,9 +71,32 @@ class ExtendedAsyncClient(nio.AsyncClient):
     An :class:`~nio.AsyncClient` with some extra features to be upstreamed some day.
     """
 
+    recorder: TrafficRecorder | None = None
+    """
+    The recorder of the traffic with the homeserver, if it's being recorded.
+    """
+
     def __repr__(self):
         return f"<{self.__class__.__qualname__} for {self.user} at {self.homeserver}>"
 
+    async def send(
+            self,
+            method: str,
+            path: str,
+            data: t.Union[None, str, nio.crypto.AsyncDataT] = None,
+            headers: t.Optional[t.Dict[str, str]] = None,
+            trace_context: t.Any = None,
+            timeout: t.Optional[float] = None,
+    ) -> aiohttp.ClientResponse:
+        """
+        Extend :meth:`nio.client.AsyncClient.send` to record the requests and their responses, if :attr:`.recorder` is set.
+        """
+
+        response = await super().send(method, path, data=data, headers=headers, trace_context=trace_context, timeout=timeout)
+        if self.recorder is not None:
+            await self.recorder.record_response(method, path, data, response)
+        return response
+
     def _send(
             self,
             response_class: t.Type[T],
@@ -79,10 +131,43 @@ class ExtendedAsyncClient(nio.AsyncClient):
         )
 
         if isinstance(result, nio.responses.ErrorResponse):
-            log.warning(f"{method} {path} errored: {result!r}")
+            log.warning("%s %s errored: %r", method, path, result)
             raise RequestError(result)
 
-        return result
+        return self._observe_request(method, path, result)
+
+    @staticmethod
+    async def _observe_request(method: str, path: str, request: t.Awaitable[T]) -> T:
+        """
+        Await a request, recording its duration and its outcome in the metrics.
+        """
+
+        endpoint = request_endpoint(path)
+        status = "exception"
+        start = time.perf_counter()
+        span = tracer.start_span(f"{method} {endpoint}", **{"http.method": method, "http.route": endpoint})
+        try:
+            response = await request
+            status = (response.status_code or "error") if isinstance(response, nio.responses.ErrorResponse) else "ok"
+            return response
+        finally:
+            if span is not None:
+                span.set_attribute("matrix.status", status)
+                span.end()
+            duration = time.perf_counter() - start
+            REQUEST_SECONDS.observe(duration, method=method, endpoint=endpoint, status=status)
+            if endpoint.endswith("/sync") and status == "ok":
+                SYNC_SECONDS.observe(duration)
+
+    async def create_matrix_response(self, response_class: t.Type, transport_response: aiohttp.ClientResponse, data: t.Optional[t.Tuple[t.Any, ...]] = None) -> nio.Response:
+        """
+        Extend :meth:`nio.client.AsyncClient.create_matrix_response` to record the size of the sync responses.
+        """
+
+        if issubclass(response_class, nio.SyncResponse):
+            # The body is cached by aiohttp, so it isn't read twice
+            SYNC_BYTES.observe(len(await transport_response.read()))
+        return await super().create_matrix_response(response_class, transport_response, data)
 
     async def register_with_shared_secret(self, shared_secret: str, username: str, displayname: str, password: str):
         """
@@ -97,7 +182,7 @@ class ExtendedAsyncClient(nio.AsyncClient):
         .. note:: ``shared_secret`` is not the same shared secret of :meth:`.login_with_shared_secret`.
         """
 
-        log.debug(f"Registering via shared-secret registration: {username}")
+        log.debug("Registering via shared-secret registration: %s", username)
 
         path = nio.Api._build_path(
             ["v1", "register"],
@@ -128,7 +213,7 @@ class ExtendedAsyncClient(nio.AsyncClient):
         }))
         registration.raise_for_status()
 
-        log.info(f"Registered via shared-secret registration: {username}")
+        log.info("Registered via shared-secret registration: %s", username)
 
     async def login_with_shared_secret(self, shared_secret: str) -> None:
         """
@@ -139,7 +224,7 @@ class ExtendedAsyncClient(nio.AsyncClient):
         .. note:: ``shared_secret`` is not the same shared secret of :meth:`.register_with_shared_secret`.
         """
 
-        log.debug(f"Logging in as {self.user} with a shared secret...")
+        log.debug("Logging in as %s with a shared secret...", self.user)
 
         token = hmac.new(key=shared_secret.encode("utf8"), msg=self.user.encode("utf8"), digestmod=hashlib.sha512).hexdigest()
 
@@ -153,7 +238,7 @@ class ExtendedAsyncClient(nio.AsyncClient):
             "initial_device_display_name": generate_device_name(__name__),
         })
 
-        log.debug(f"Login successful!")
+        log.debug("Login successful!")
 
     async def room_hierarchy(self, room_id: str, max_depth: int, suggested_only: bool) -> list[dict]:
         """
@@ -165,7 +250,7 @@ class ExtendedAsyncClient(nio.AsyncClient):
         :return:
         """
 
-        log.debug(f"Getting room hierarchy for: {room_id!r}")
+        log.debug("Getting room hierarchy for: %r", room_id)
 
         current = None
         rooms = []
@@ -194,10 +279,11 @@ class ExtendedAsyncClient(nio.AsyncClient):
             if not current:
                 break
 
-        log.debug(f"Successfully retrieved a hierarchy of {len(rooms)} rooms!")
+        log.debug("Successfully retrieved a hierarchy of %s rooms!", len(rooms))
 
         return rooms
 
+    @traced
     async def put_management_room(self, user_id: str) -> str:
         """
         Find the first available management room with the given user, or create one if none exist.
@@ -206,7 +292,7 @@ class ExtendedAsyncClient(nio.AsyncClient):
         :returns: The room id of the created room.
         """
 
-        log.debug(f"Creating a management room for %s", user_id)
+        log.debug("Creating a management room for %s", user_id)
 
         for room in self.rooms.values():
             is_dm = "m.direct" in room.tags
@@ -215,19 +301,20 @@ class ExtendedAsyncClient(nio.AsyncClient):
             contains_user_id = user_id in room.users.keys() or user_id in room.invited_users.keys()
 
             if (is_dm or is_group) and has_two_users and contains_user_id:
-                log.debug(f"Found existing management room %s for %s", room.room_id, user_id)
+                log.debug("Found existing management room %s for %s", room.room_id, user_id)
                 return room.room_id
 
         else:
-            log.debug(f"Creating new management room for %s", user_id)
+            log.debug("Creating new management room for %s", user_id)
             response = await self.room_create(invite=[user_id], is_direct=True)
 
             if not isinstance(response, nio.RoomCreateResponse):
                 raise Exception("Failed to create a management room.")
 
-            log.info(f"Created new managememt room %s for %s", response.room_id, user_id)
+            log.info("Created new managememt room %s for %s", response.room_id, user_id)
             return response.room_id
 
+    @traced
     async def room_send_message_html(self, room_id: str, text: str, html: str):
         """
         Send an HTML message with a text fallback.
@@ -245,6 +332,7 @@ class ExtendedAsyncClient(nio.AsyncClient):
             "body": text,
         })
 
+    @traced
     async def mention_html(self, user_id: str) -> str:
         """
         Create a rich HTML mention.
@@ -261,6 +349,33 @@ class ExtendedAsyncClient(nio.AsyncClient):
         return f"""<a href="https://matrix.to/#/{user_id}">{display_name}</a>"""
 
 
+def community_message(community: Community, name: str) -> str:
+    """
+    Get a message of :mod:`lokiunimore.matrix.templates.messages`, as customized by the given community.
+
+    :param community: The community to send the message on behalf of.
+    :param name: The name of the message, such as ``WELCOME_MESSAGE_TEXT``.
+    :return: The template of the message.
+    """
+
+    return (community.messages or {}).get(name) or getattr(messages, name)
+
+
+def measure_handler(f):
+    """
+    Decorator recording the duration of a handler of :class:`.LokiClient` in the metrics, and tracing it.
+    """
+
+    handler = f.__name__.lstrip("_").removeprefix("handle_")
+
+    @functools.wraps(f)
+    async def wrapped(*args, **kwargs):
+        with HANDLER_SECONDS.time(handler=handler), tracer.span(handler):
+            return await f(*args, **kwargs)
+
+    return wrapped
+
+
 def filter_processed_events(f):
     """
     Decorator applicable to a :mod:`nio` callback to filter incoming events whose IDs have been marked in the database as *already processed*, and marking events successfully processed by the function as "processed".
@@ -268,39 +383,82 @@ def filter_processed_events(f):
 
     @functools.wraps(f)
     async def wrapped(self, room: nio.MatrixRoom, event: nio.Event):
-        if event_id := getattr(event, "event_id", None):
-            log.debug(f"Checking if event should be processed: {event_id}")
-            if self._event_processed_check(event):
-                if not MATRIX_SKIP_EVENTS.__wrapped__:
-                    log.debug(f"Processing event: {event_id}")
-                    await f(self, room, event)
+        event_type = event.__class__.__name__
+        # The delay between the event reaching the homeserver and reaching the bot
+        server_timestamp = getattr(event, "server_timestamp", None)
+        lag_ms = int(time.time() * 1000) - server_timestamp if server_timestamp else None
+
+        with tracer.trace(event_type, **{"matrix.event_id": getattr(event, "event_id", None), "matrix.room_id": room.room_id, "matrix.sync_lag_ms": lag_ms}) as span:
+            if event_id := getattr(event, "event_id", None):
+                log.debug("Checking if event should be processed: %s", event_id)
+                with tracer.span("check processed"):
+                    should_process = self._event_processed_check(event)
+                if should_process:
+                    if not MATRIX_SKIP_EVENTS.__wrapped__:
+                        log.debug("Processing event: %s", event_id)
+                        await f(self, room, event)
+                        outcome = "processed"
+                    else:
+                        log.debug("Skipping event due to MATRIX_SKIP_EVENTS: %s", event_id)
+                        outcome = "skipped"
+                    log.debug("Marking event as processed: %s", event_id)
+                    with tracer.span("mark processed"):
+                        self._event_processed_mark(event)
                 else:
-                    log.debug(f"Skipping event due to MATRIX_SKIP_EVENTS: {event_id}")
-                log.debug(f"Marking event as processed: {event_id}")
-                self._event_processed_mark(event)
+                    log.debug("Skipping already processed event: %s", event_id)
+                    outcome = "duplicate"
             else:
-                log.debug(f"Skipping already processed event: {event_id}")
-        else:
-            log.debug(f"Received partial event with no id, which should always be processed")
-            await f(self, room, event)
-            log.debug(f"Processed partial event successfully")
+                log.debug("Received partial event with no id, which should always be processed")
+                await f(self, room, event)
+                outcome = "partial"
+                log.debug("Processed partial event successfully")
+
+            EVENTS_TOTAL.inc(type=event_type, outcome=outcome)
+            if span is not None:
+                span.set_attribute("matrix.outcome", outcome)
 
     return wrapped
 
 
 class LokiClient(ExtendedAsyncClient):
-    def __init__(self, *args, database_url: str, **kwargs):
+    def __init__(
+            self,
+            *args,
+            database_url: str | None = None,
+            sqla_engine: sqlalchemy.engine.Engine | None = None,
+            handle_events: bool = True,
+            queue_membership: bool = False,
+            **kwargs
+    ):
+        """
+        :param database_url: The URL of the database to create an engine for, if ``sqla_engine`` isn't given.
+        :param sqla_engine: An existing engine to use, so that its connection pool can be shared with other components running in the same process.
+        :param handle_events: Whether received events should be handled at all; workers of :mod:`lokiunimore.matrix.worker` only sync to keep the state of the rooms.
+        :param queue_membership: Whether membership changes of other users should be queued for the workers instead of being handled immediately.
+        """
+
         super().__init__(*args, **kwargs)
 
-        self.sqla_engine: sqlalchemy.engine.Engine = sqlalchemy.create_engine(database_url)
+        self.sqla_engine: sqlalchemy.engine.Engine = sqla_engine if sqla_engine is not None else create_engine(database_url)
         """
         The :mod:`sqlalchemy` :class:`~sqlalchemy.engine.Engine` associated with this client.
         """
 
-        # noinspection PyTypeChecker
-        self.add_event_callback(self.__handle_membership_change, nio.InviteMemberEvent)
-        # noinspection PyTypeChecker
-        self.add_event_callback(self.__handle_membership_change, nio.RoomMemberEvent)
+        self.queue_membership: bool = queue_membership
+        """
+        Whether membership changes of other users are queued for the workers instead of being handled immediately.
+        """
+
+        self.communities: CommunityRegistry = CommunityRegistry()
+        """
+        The communities whose spaces are monitored by this client.
+        """
+
+        if handle_events:
+            # noinspection PyTypeChecker
+            self.add_event_callback(self.__handle_membership_change, nio.InviteMemberEvent)
+            # noinspection PyTypeChecker
+            self.add_event_callback(self.__handle_membership_change, nio.RoomMemberEvent)
 
     @contextlib.contextmanager
     def _sqla_session(self) -> t.Generator[sqlalchemy.orm.Session, None, None]:
@@ -347,47 +505,88 @@ class LokiClient(ExtendedAsyncClient):
             # If the event is a name change, or something like that, don't do anything
             return
 
+        # Events about myself are always handled immediately
+        if self.queue_membership and event.state_key != self.user_id:
+            with self._sqla_session() as session:
+                session: sqlalchemy.orm.Session
+                # Like dispatch_membership, ignore the rooms which aren't the space of any community, such as direct messages
+                if self.communities.by_room(session, room.room_id) is None:
+                    return
+                enqueue_membership(session=session, event_id=event.event_id, room_id=room.room_id, user_id=event.state_key, membership=event.membership, prev_membership=event.prev_membership)
+                session.commit()
+            return
+
+        await self.dispatch_membership(room_id=room.room_id, user_id=event.state_key, membership=event.membership)
+
+    def community_of(self, room_id: str) -> tuple[Community, bool] | None:
+        """
+        Find the community a space belongs to.
+
+        :param room_id: The id of the room.
+        :return: The community whose public or private space is the given room, and whether it is the private one, or :data:`None` if it isn't the space of any community.
+        """
+
+        with self._sqla_session() as session:
+            return self.communities.by_room(session, room_id)
+
+    async def dispatch_membership(self, room_id: str, user_id: str, membership: str) -> None:
+        """
+        Handle a change of membership of a user in a room.
+
+        :param room_id: The id of the room.
+        :param user_id: The id of the user.
+        :param membership: The new membership of the user, such as ``join``.
+        """
+
         # Catch events about myself immediately
-        elif event.state_key == self.user_id:
+        if user_id == self.user_id:
             # If I'm invited to a room, join it
-            if event.membership == "invite":
-                await self.__handle_received_invite(room)
+            if membership == "invite":
+                await self.__handle_received_invite(room_id)
+            return
 
-        elif event.membership == "join":
-            # If somebody joins the parent space, notify them of my presence and send them their profile URL
-            if room.room_id == MATRIX_PUBLIC_SPACE_ID:
-                await self.__handle_public_space_joiner(event.state_key)
+        # Only the spaces of the communities are monitored
+        if (found := self.community_of(room_id)) is None:
+            return
+        community, is_private = found
+
+        if membership == "join":
             # If somebody joins the child space, notify them of the successful login
-            elif room.room_id == MATRIX_PRIVATE_SPACE_ID:
-                await self.__handle_private_space_joiner(event.state_key)
+            if is_private:
+                await self.__handle_private_space_joiner(community, user_id)
+            # If somebody joins the parent space, notify them of my presence and send them their profile URL
+            else:
+                await self.__handle_public_space_joiner(community, user_id)
 
-        elif event.membership == "leave":
-            # If somebody leaves the parent space, remove them from all subrooms, delete their account, and finally notify them
-            if room.room_id == MATRIX_PUBLIC_SPACE_ID:
-                await self.__handle_public_space_leaver(event.state_key)
+        elif membership == "leave":
             # If somebody leaves the child space, remove them from all subrooms, delete their linking, and finally notify them
-            elif room.room_id == MATRIX_PRIVATE_SPACE_ID:
-                await self.__handle_private_space_leaver(event.state_key)
+            if is_private:
+                await self.__handle_private_space_leaver(community, user_id)
+            # If somebody leaves the parent space, remove them from all subrooms, delete their account, and finally notify them
+            else:
+                await self.__handle_public_space_leaver(community, user_id)
 
-        elif event.membership == "ban":
-            # TODO: If somebody is banned from the parent space... propagate the ban?
-            if room.room_id == MATRIX_PUBLIC_SPACE_ID:
-                await self.__handle_public_space_leaver(event.state_key)
+        elif membership == "ban":
             # TODO: If somebody is banned from the child space... propagate the ban?
-            elif room.room_id == MATRIX_PRIVATE_SPACE_ID:
-                await self.__handle_private_space_leaver(event.state_key)
+            if is_private:
+                await self.__handle_private_space_leaver(community, user_id)
+            # TODO: If somebody is banned from the parent space... propagate the ban?
+            else:
+                await self.__handle_public_space_leaver(community, user_id)
 
-    async def __handle_received_invite(self, room: nio.MatrixRoom):
-        log.debug(f"Received invite to: {room.room_id}")
-        await self.join(room.room_id)
-        log.info(f"Accepted invite to: {room.room_id}")
+    @measure_handler
+    async def __handle_received_invite(self, room_id: str):
+        log.debug("Received invite to: %s", room_id)
+        await self.join(room_id)
+        log.info("Accepted invite to: %s", room_id)
 
-    async def __handle_public_space_joiner(self, user_id: str):
-        log.debug(f"User joined public space: {user_id}")
+    @measure_handler
+    async def __handle_public_space_joiner(self, community: Community, user_id: str):
+        log.debug("User joined public space of %s: %s", community.id, user_id)
 
         with self._sqla_session() as session:
             session: sqlalchemy.orm.Session
-            matrix_user: MatrixUser = MatrixUser.create(session=session, id=user_id)
+            matrix_user: MatrixUser = MatrixUser.create(session=session, id=user_id, community_id=community.id)
             session.commit()
 
             with app.app_context():
@@ -397,102 +596,105 @@ class LokiClient(ExtendedAsyncClient):
                     profile_url=matrix_user.profile_url(),
                 )
 
-        log.debug(f"Notifying user of the account creation: {user_id}")
+        log.debug("Notifying user of the account creation: %s", user_id)
         await self.room_send_message_html(
             await self.put_management_room(user_id),
-            text=WELCOME_MESSAGE_TEXT.format(**formatting),
-            html=WELCOME_MESSAGE_HTML.format(**formatting)
+            text=community_message(community, "WELCOME_MESSAGE_TEXT").format(**formatting),
+            html=community_message(community, "WELCOME_MESSAGE_HTML").format(**formatting)
         )
-        log.debug(f"Notified user of the account creation: {user_id}")
+        log.debug("Notified user of the account creation: %s", user_id)
 
-        log.info(f"Handled joiner of public space: {user_id}")
+        log.info("Handled joiner of public space: %s", user_id)
 
-    async def __handle_private_space_joiner(self, user_id: str):
-        log.info(f"User joined private space: {user_id}")
+    @measure_handler
+    async def __handle_private_space_joiner(self, community: Community, user_id: str):
+        log.info("User joined private space of %s: %s", community.id, user_id)
 
-        log.debug(f"Setting MatrixUser as joined for: {user_id}")
+        log.debug("Setting MatrixUser as joined for: %s", user_id)
         with self._sqla_session() as session:
             session: sqlalchemy.orm.Session
-            matrix_user: MatrixUser = session.query(MatrixUser).get(user_id)
+            matrix_user: MatrixUser = session.get(MatrixUser, (user_id, community.id))
             if matrix_user is None:
-                log.warning(f"User joined private space without having a pre-existent record in the db: {user_id}")
-                matrix_user = MatrixUser.create(session=session, id=user_id)
+                log.warning("User joined private space without having a pre-existent record in the db: %s", user_id)
+                matrix_user = MatrixUser.create(session=session, id=user_id, community_id=community.id)
                 session.commit()
 
             matrix_user.joined_private_space = True
             session.commit()
-            log.debug(f"Set MatrixUser as joined for: {user_id}")
+            log.debug("Set MatrixUser as joined for: %s", user_id)
 
             with app.app_context():
                 formatting = dict(
                     profile_url=matrix_user.profile_url(),
                 )
 
-        log.debug(f"Notifying user of the account link: {user_id}")
+        log.debug("Notifying user of the account link: %s", user_id)
         await self.room_send_message_html(
             await self.put_management_room(user_id),
-            text=SUCCESS_MESSAGE_TEXT.format(**formatting),
-            html=SUCCESS_MESSAGE_HTML.format(**formatting)
+            text=community_message(community, "SUCCESS_MESSAGE_TEXT").format(**formatting),
+            html=community_message(community, "SUCCESS_MESSAGE_HTML").format(**formatting)
         )
-        log.debug(f"Notified user of the account link: {user_id}")
+        log.debug("Notified user of the account link: %s", user_id)
 
-        log.info(f"Handled joiner of private space: {user_id}")
+        log.info("Handled joiner of private space: %s", user_id)
 
-    async def __handle_public_space_leaver(self, user_id: str):
-        log.info(f"User left public space: {user_id}")
+    @measure_handler
+    async def __handle_public_space_leaver(self, community: Community, user_id: str):
+        log.info("User left public space of %s: %s", community.id, user_id)
 
-        log.debug(f"Deleting MatrixUser for: {user_id}")
+        log.debug("Deleting MatrixUser for: %s", user_id)
         with self._sqla_session() as session:
             session: sqlalchemy.orm.Session
-            matrix_user: MatrixUser = session.query(MatrixUser).get(user_id)
+            matrix_user: MatrixUser = session.get(MatrixUser, (user_id, community.id))
             if matrix_user is None:
-                log.warning(f"User left public space without having a pre-existent record in the db: {user_id}")
+                log.warning("User left public space without having a pre-existent record in the db: %s", user_id)
             else:
                 matrix_user.destroy(session=session)
                 session.commit()
 
-        log.debug(f"Notifying user of the account deletion: {user_id}")
+        log.debug("Notifying user of the account deletion: %s", user_id)
         await self.room_send_message_html(
             await self.put_management_room(user_id),
-            text=GOODBYE_MESSAGE_TEXT,
-            html=GOODBYE_MESSAGE_HTML
+            text=community_message(community, "GOODBYE_MESSAGE_TEXT"),
+            html=community_message(community, "GOODBYE_MESSAGE_HTML")
         )
-        log.debug(f"Notified user of the account deletion: {user_id}")
+        log.debug("Notified user of the account deletion: %s", user_id)
 
-        log.debug(f"Finding room hierarchy of the public space...")
-        public_hierarchy = await self.room_hierarchy(MATRIX_PUBLIC_SPACE_ID.__wrapped__, max_depth=9, suggested_only=False)
+        log.debug("Finding room hierarchy of the public space...")
+        public_hierarchy = await self.room_hierarchy(community.public_space_id, max_depth=9, suggested_only=False)
 
-        log.debug(f"Finding room hierarchy of the private space...")
-        private_hierarchy = await self.room_hierarchy(MATRIX_PRIVATE_SPACE_ID.__wrapped__, max_depth=9, suggested_only=False)
+        log.debug("Finding room hierarchy of the private space...")
+        private_hierarchy = await self.room_hierarchy(community.private_space_id, max_depth=9, suggested_only=False)
 
         hierarchy = [*public_hierarchy, *private_hierarchy]
 
-        log.debug(f"Removing public space leaver from {len(hierarchy)} rooms: {user_id}")
+        log.debug("Removing public space leaver from %s rooms: %s", len(hierarchy), user_id)
         success_count = 0
         for room in hierarchy:
             room_id = room["room_id"]
             try:
                 await self.room_kick(room_id=room_id, user_id=user_id, reason="Loki account deleted")
             except RequestError as e:
-                log.warning(f"Could not remove public space leaver {user_id} from {room_id}: {e!r}")
+                log.warning("Could not remove public space leaver %s from %s: %r", user_id, room_id, e)
             else:
                 success_count += 1
-        log.debug(f"Removed public space leaver from {success_count} rooms: {user_id}")
+        log.debug("Removed public space leaver from %s rooms: %s", success_count, user_id)
 
-        log.info(f"Handled leaver of public space: {user_id}")
+        log.info("Handled leaver of public space: %s", user_id)
 
-    async def __handle_private_space_leaver(self, user_id: str):
-        log.debug(f"User left private space: {user_id}")
+    @measure_handler
+    async def __handle_private_space_leaver(self, community: Community, user_id: str):
+        log.debug("User left private space of %s: %s", community.id, user_id)
 
-        log.debug(f"Unlinking account for: {user_id}")
+        log.debug("Unlinking account for: %s", user_id)
         with self._sqla_session() as session:
             session: sqlalchemy.orm.Session
-            matrix_user: MatrixUser = session.query(MatrixUser).get(user_id)
+            matrix_user: MatrixUser = session.get(MatrixUser, (user_id, community.id))
             if matrix_user is None:
-                log.warning(f"User left private space without having a pre-existent record in the db: {user_id}")
+                log.warning("User left private space without having a pre-existent record in the db: %s", user_id)
                 return
             elif matrix_user.account is None:
-                log.warning(f"User left private space without having a linked account in the db: {user_id}")
+                log.warning("User left private space without having a linked account in the db: %s", user_id)
             else:
                 matrix_user.unlink(session=session)
                 session.commit()
@@ -502,27 +704,27 @@ class LokiClient(ExtendedAsyncClient):
                     profile_url=matrix_user.profile_url(),
                 )
 
-        log.debug(f"Notifying user of the account unlinking: {user_id}")
+        log.debug("Notifying user of the account unlinking: %s", user_id)
         await self.room_send_message_html(
             await self.put_management_room(user_id),
-            text=UNLINK_MESSAGE_TEXT.format(**formatting),
-            html=UNLINK_MESSAGE_HTML.format(**formatting)
+            text=community_message(community, "UNLINK_MESSAGE_TEXT").format(**formatting),
+            html=community_message(community, "UNLINK_MESSAGE_HTML").format(**formatting)
         )
-        log.debug(f"Notified user of the account unlinking: {user_id}")
+        log.debug("Notified user of the account unlinking: %s", user_id)
 
-        log.debug(f"Finding room hierarchy of the private space...")
-        hierarchy = await self.room_hierarchy(MATRIX_PRIVATE_SPACE_ID.__wrapped__, max_depth=9, suggested_only=False)
+        log.debug("Finding room hierarchy of the private space...")
+        hierarchy = await self.room_hierarchy(community.private_space_id, max_depth=9, suggested_only=False)
 
-        log.debug(f"Removing private space leaver from {len(hierarchy)} rooms: {user_id}")
+        log.debug("Removing private space leaver from %s rooms: %s", len(hierarchy), user_id)
         success_count = 0
         for room in hierarchy:
             room_id = room["room_id"]
             try:
                 await self.room_kick(room_id=room_id, user_id=user_id, reason="Loki account unlinked")
             except RequestError as e:
-                log.warning(f"Could not remove private space leaver {user_id} from {room_id}: {e}")
+                log.warning("Could not remove private space leaver %s from %s: %s", user_id, room_id, e)
             else:
                 success_count += 1
-        log.debug(f"Removed private space leaver from {success_count} rooms: {user_id}")
+        log.debug("Removed private space leaver from %s rooms: %s", success_count, user_id)
 
-        log.info(f"Handled leaver of private space: {user_id}")
+        log.info("Handled leaver of private space: %s", user_id)
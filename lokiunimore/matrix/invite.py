@@ -0,0 +1,195 @@
+"""
+This module defines the bulk invite to the private space of the linked Matrix users who haven't joined it yet.
+
+Run it as a script to invite all of them, in every community or only in the given one::
+
+    python -m lokiunimore.matrix.invite [--concurrency N] [--retry-all] [--community ID]
+
+Results are recorded per user in the database, so an interrupted run can be resumed by running it again.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+import nio
+import sqlalchemy
+import sqlalchemy.orm
+
+from lokiunimore.config import MATRIX_USER_SECRET, MATRIX_HOMESERVER, MATRIX_USER_ID
+from lokiunimore.config.snapshot import get_snapshot
+from lokiunimore.sql.tables import Community, MatrixUser, MatrixBulkInvite
+from lokiunimore.utils.logs import install_log_handler
+from lokiunimore.utils.ratelimit import RateLimiter
+from lokiunimore.matrix.client import LokiClient
+from lokiunimore.web.app import create_app, shared_engine
+
+log = logging.getLogger(__name__)
+
+
+class BulkInviter:
+    """
+    Invites the linked :class:`.MatrixUser`\\ s of a community who haven't joined its private space, streaming them from the database in chunks and inviting them with a pool of rate-limited workers.
+    """
+
+    def __init__(self, client: LokiClient, community: Community, chunk_size: int = 500, concurrency: int = 4, rate: float = 5):
+        """
+        :param client: The logged in client to invite users with.
+        :param community: The community whose users should be invited to its private space.
+        :param chunk_size: The number of users to load from the database, and of results to write to it, at a time.
+        :param concurrency: The number of invites which may be in flight at the same time.
+        :param rate: The number of invites to send per second, on average.
+        """
+
+        self.client: LokiClient = client
+        self.community: Community = community
+        self.chunk_size: int = chunk_size
+        self.concurrency: int = concurrency
+        self.limiter: RateLimiter = RateLimiter(rate=rate, burst=concurrency)
+
+    def _load_chunk(self, after: str | None, retry_all: bool) -> list[str]:
+        """
+        :param after: The id of the last user of the previous chunk, or :data:`None` for the first chunk.
+        :param retry_all: Whether users which have already been invited successfully should be invited again.
+        :return: The ids of the next chunk of users to invite, in order.
+        """
+
+        with self.client._sqla_session() as session:
+            session: sqlalchemy.orm.Session
+            query = (
+                sqlalchemy.select(MatrixUser.id)
+                .outerjoin(MatrixBulkInvite)
+                .where(MatrixUser.community_id == self.community.id)
+                .where(MatrixUser.account_email.is_not(None))
+                .where(MatrixUser.joined_private_space.is_(False))
+                .order_by(MatrixUser.id)
+                .limit(self.chunk_size)
+            )
+            if not retry_all:
+                query = query.where(sqlalchemy.or_(MatrixBulkInvite.matrix_user_id.is_(None), MatrixBulkInvite.error.is_not(None)))
+            if after is not None:
+                query = query.where(MatrixUser.id > after)
+            return list(session.scalars(query))
+
+    def _record(self, results: list[MatrixBulkInvite]) -> None:
+        with self.client._sqla_session() as session:
+            session: sqlalchemy.orm.Session
+            for result in results:
+                session.merge(result)
+            session.commit()
+
+    async def invite(self, user_id: str) -> MatrixBulkInvite:
+        """
+        Invite a single user, waiting out any rate limit of the homeserver.
+
+        :return: The result of the invite, not yet recorded.
+        """
+
+        while True:
+            await self.limiter.acquire()
+            response = await self.client.room_invite(room_id=self.community.private_space_id, user_id=user_id)
+
+            if isinstance(response, nio.RoomInviteError) and response.status_code == "M_LIMIT_EXCEEDED":
+                retry_after = (response.retry_after_ms or 1000) / 1000
+                log.warning("Rate limited by the homeserver, waiting %.1f seconds", retry_after)
+                await asyncio.sleep(retry_after)
+                continue
+
+            error = f"{response.status_code}: {response.message}" if isinstance(response, nio.RoomInviteError) else None
+            if error:
+                log.warning("Could not invite %s: %s", user_id, error)
+            else:
+                log.debug("Invited %s", user_id)
+            return MatrixBulkInvite(matrix_user_id=user_id, community_id=self.community.id, attempted_at=time.time(), error=error)
+
+    async def _worker(self, queue: asyncio.Queue[str | None], results: list[MatrixBulkInvite]) -> None:
+        while (user_id := await queue.get()) is not None:
+            results.append(await self.invite(user_id))
+
+    async def run(self, retry_all: bool = False) -> tuple[int, int]:
+        """
+        Invite all the users who need to be invited.
+
+        :param retry_all: Whether users which have already been invited successfully should be invited again.
+        :return: The number of successful and of failed invites.
+        """
+
+        succeeded = failed = 0
+        after = None
+
+        while chunk := await asyncio.to_thread(self._load_chunk, after, retry_all):
+            after = chunk[-1]
+            queue: asyncio.Queue[str | None] = asyncio.Queue()
+            for user_id in chunk:
+                queue.put_nowait(user_id)
+            for _ in range(self.concurrency):
+                queue.put_nowait(None)
+
+            results: list[MatrixBulkInvite] = []
+            workers = [asyncio.create_task(self._worker(queue, results)) for _ in range(self.concurrency)]
+            try:
+                await asyncio.gather(*workers)
+            except BaseException:
+                for worker in workers:
+                    worker.cancel()
+                raise
+            finally:
+                # Record whatever was done, even if interrupted
+                await asyncio.to_thread(self._record, results)
+
+            chunk_failed = sum(result.error is not None for result in results)
+            succeeded += len(results) - chunk_failed
+            failed += chunk_failed
+            log.info("Invited %d users of %s so far, %d failed", succeeded, self.community.id, failed)
+
+        return succeeded, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Invite to the private space the linked Matrix users who haven't joined it.")
+    parser.add_argument("--concurrency", type=int, default=4, help="the number of invites which may be in flight at the same time")
+    parser.add_argument("--rate", type=float, default=5, help="the number of invites to send per second")
+    parser.add_argument("--retry-all", action="store_true", help="invite again the users which have already been invited successfully")
+    parser.add_argument("--community", help="the id of the only community whose users should be invited")
+    args = parser.parse_args()
+
+    install_log_handler()
+    create_app()
+    sqla_engine = shared_engine()
+
+    client = LokiClient(
+        homeserver=MATRIX_HOMESERVER.__wrapped__,
+        user=MATRIX_USER_ID.__wrapped__,
+        sqla_engine=sqla_engine
+    )
+
+    with client._sqla_session() as session:
+        if args.community is None:
+            communities = client.communities.all(session)
+        elif (community := client.communities.get(session, args.community)) is not None:
+            communities = [community]
+        else:
+            raise SystemExit(f"No such community: {args.community}")
+
+    async def run():
+        await client.login_with_shared_secret(MATRIX_USER_SECRET.__wrapped__)
+        try:
+            for community in communities:
+                inviter = BulkInviter(client, community=community, concurrency=args.concurrency, rate=args.rate)
+                await inviter.run(retry_all=args.retry_all)
+        finally:
+            await client.logout()
+            await client.close()
+
+    asyncio.run(run())
+
+
+__all__ = (
+    "BulkInviter",
+    "main",
+)
+
+
+if __name__ == "__main__":
+    get_snapshot()
+    main()
@@ -0,0 +1,60 @@
+"""
+This module defines the durable queue of membership changes shared by the Matrix bot and the workers of :mod:`lokiunimore.matrix.worker`.
+"""
+
+import time
+import hashlib
+import logging
+import sqlalchemy.orm
+
+from lokiunimore.sql.tables import MatrixMembershipJob
+
+log = logging.getLogger(__name__)
+
+
+MEMBERSHIP_PARTITIONS = 64
+"""
+The number of partitions the membership changes are split in, which is also the maximum number of workers which can be busy at the same time.
+"""
+
+
+def partition_of(user_id: str) -> int:
+    """
+    :param user_id: The id of a Matrix user.
+    :return: The partition the membership changes of the user belong to, the same across all processes.
+    """
+
+    return int.from_bytes(hashlib.sha256(user_id.encode("utf8")).digest()[:4], "big") % MEMBERSHIP_PARTITIONS
+
+
+def enqueue_membership(session: sqlalchemy.orm.Session, event_id: str, room_id: str, user_id: str, membership: str, prev_membership: str | None) -> MatrixMembershipJob | None:
+    """
+    Add a membership change to the queue, unless it already is in it.
+
+    :param session: The `sqlalchemy.orm.Session` to use.
+    :return: The created job, or :data:`None` if the event had already been queued.
+    """
+
+    if session.query(MatrixMembershipJob.id).filter_by(event_id=event_id).first() is not None:
+        log.debug("Membership event already queued: %s", event_id)
+        return None
+
+    job = MatrixMembershipJob(
+        event_id=event_id,
+        room_id=room_id,
+        user_id=user_id,
+        membership=membership,
+        prev_membership=prev_membership,
+        partition=partition_of(user_id),
+        available_at=time.time(),
+    )
+    session.add(job)
+    log.debug("Queued membership change of %s in %s", user_id, room_id)
+    return job
+
+
+__all__ = (
+    "MEMBERSHIP_PARTITIONS",
+    "partition_of",
+    "enqueue_membership",
+)
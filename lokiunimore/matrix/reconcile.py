@@ -0,0 +1,337 @@
+"""
+This module defines the reconciliation of the database with the actual members of the Matrix spaces monitored by :mod:`lokiunimore`, to recover from events missed by :class:`~lokiunimore.matrix.client.LokiClient`.
+
+Run it as a script to perform a single reconciliation of every community, or only of the given one::
+
+    python -m lokiunimore.matrix.reconcile [--dry-run] [--community ID]
+"""
+
+import argparse
+import asyncio
+import logging
+import typing as t
+import nio
+import sqlalchemy
+import sqlalchemy.orm
+
+from lokiunimore.config import MATRIX_USER_SECRET, MATRIX_HOMESERVER, MATRIX_USER_ID
+from lokiunimore.config.snapshot import get_snapshot
+from lokiunimore.sql.tables import Account, Community, MatrixUser, MatrixBulkInvite, TelegramUser
+from lokiunimore.utils.logs import install_log_handler
+from lokiunimore.utils.ratelimit import RateLimiter
+from lokiunimore.matrix.client import LokiClient
+from lokiunimore.web.app import create_app, shared_engine
+
+log = logging.getLogger(__name__)
+
+
+class ReconciliationPlan(t.NamedTuple):
+    """
+    The corrections needed to make the database and the spaces agree with each other.
+    """
+
+    create: set[str]
+    """
+    The users in the public space without a :class:`.MatrixUser`, who are welcomed as if they had just joined it.
+    """
+
+    destroy: set[str]
+    """
+    The users with a :class:`.MatrixUser` who aren't in the public space anymore.
+    """
+
+    mark_joined: set[str]
+    """
+    The linked users in the private space who aren't marked as such.
+    """
+
+    unlink: set[str]
+    """
+    The users marked as joined who aren't in the private space anymore.
+    """
+
+    kicks: list[tuple[str, str]]
+    """
+    The room id and user id pairs of the users to remove from the rooms of the spaces: the destroyed users from every room still containing them, and the unlinked users from the rooms of the private space.
+    """
+
+    def __len__(self):
+        return len(self.create) + len(self.destroy) + len(self.mark_joined) + len(self.unlink) + len(self.kicks)
+
+    def __str__(self):
+        return f"{len(self.create)} to create, {len(self.destroy)} to destroy, {len(self.mark_joined)} to mark as joined, {len(self.unlink)} to unlink, {len(self.kicks)} kicks"
+
+
+def plan_reconciliation(
+        public_rooms: dict[str, set[str]],
+        private_rooms: dict[str, set[str]],
+        public_space_id: str,
+        private_space_id: str,
+        users: dict[str, tuple[bool, bool]],
+        bot_id: str,
+) -> ReconciliationPlan:
+    """
+    Compare the members of the spaces with the database, to redo what the event handlers of :class:`~lokiunimore.matrix.client.LokiClient` would have done for the membership changes of the spaces it missed.
+
+    Users are only removed from the rooms of the spaces if they left the public space, or the private one while marked as joined, like the handlers would have; members of the rooms the bot doesn't track, such as moderators, other bots, or users who joined a room directly, are never removed.
+
+    :param public_rooms: The joined members of each room in the hierarchy of the public space, including the space itself.
+    :param private_rooms: The joined members of each room in the hierarchy of the private space, including the space itself.
+    :param public_space_id: The id of the public space.
+    :param private_space_id: The id of the private space.
+    :param users: For each :class:`.MatrixUser`, whether it is linked to an account and whether it is marked as joined.
+    :param bot_id: The id of the bot itself, which is never touched.
+    :return: The corrections to apply.
+    """
+
+    public_members = public_rooms.get(public_space_id, set()) - {bot_id}
+    private_members = private_rooms.get(private_space_id, set()) - {bot_id}
+    known = set(users)
+    linked = {user_id for user_id, (is_linked, _) in users.items() if is_linked}
+    joined = {user_id for user_id, (_, is_joined) in users.items() if is_joined}
+
+    create = public_members - known
+    destroy = known - public_members
+    unlink = (joined - private_members) - destroy
+    mark_joined = (private_members & linked) - joined - destroy
+
+    # Like the handlers of the leavers, only remove the users whose leave was missed, leaving alone anybody the bot doesn't track, such as moderators or federated users
+    removed_private = (destroy | unlink) - {bot_id}
+    removed_public = destroy - {bot_id}
+
+    kicks = []
+    for room_id, members in private_rooms.items():
+        kicks += [(room_id, user_id) for user_id in sorted(members & removed_private)]
+    for room_id, members in public_rooms.items():
+        kicks += [(room_id, user_id) for user_id in sorted(members & removed_public)]
+
+    return ReconciliationPlan(create=create, destroy=destroy, mark_joined=mark_joined, unlink=unlink, kicks=kicks)
+
+
+def _chunks(items: t.Iterable[str], size: int) -> t.Iterator[list[str]]:
+    items = sorted(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class Reconciler:
+    """
+    Reconciles the database with the members of the spaces of each community, fetching them in bulk and applying the corrections in batches.
+    """
+
+    def __init__(self, client: LokiClient, batch_size: int = 1000):
+        """
+        :param client: The logged in client to fetch the members and kick users with, and whose communities should be reconciled.
+        :param batch_size: The maximum number of users updated by a single statement.
+        """
+
+        self.client: LokiClient = client
+        self.batch_size: int = batch_size
+        self.kick_limiter: RateLimiter = RateLimiter(rate=2, burst=10)
+        self.welcome_limiter: RateLimiter = RateLimiter(rate=2, burst=10)
+
+    async def fetch_members(self, space_id: str) -> dict[str, set[str]]:
+        """
+        :param space_id: The id of the space.
+        :return: The joined members of each room in the hierarchy of the space, including the space itself.
+        """
+
+        hierarchy = await self.client.room_hierarchy(space_id, max_depth=9, suggested_only=False)
+        room_ids = {space_id, *(room["room_id"] for room in hierarchy)}
+
+        rooms = {}
+        for room_id in room_ids:
+            response = await self.client.joined_members(room_id)
+            if isinstance(response, nio.JoinedMembersError):
+                if room_id == space_id:
+                    raise RuntimeError(f"Could not fetch the members of {space_id}: {response!r}")
+                log.warning("Could not fetch the members of %s, skipping it: %r", room_id, response)
+                continue
+            rooms[room_id] = {member.user_id for member in response.members}
+
+        log.debug("Fetched the members of %d rooms of %s", len(rooms), space_id)
+        return rooms
+
+    def _load_users(self, community_id: str) -> dict[str, tuple[bool, bool]]:
+        with self.client._sqla_session() as session:
+            session: sqlalchemy.orm.Session
+            rows = session.execute(
+                sqlalchemy.select(MatrixUser.id, MatrixUser.account_email, MatrixUser.joined_private_space)
+                .where(MatrixUser.community_id == community_id)
+            )
+            return {user_id: (account_email is not None, joined) for user_id, account_email, joined in rows}
+
+    def _apply(self, community_id: str, plan: ReconciliationPlan) -> None:
+        """
+        Apply the database corrections of the plan of a community in a single transaction, except the creations, which are left to :meth:`._welcome`.
+        """
+
+        users = MatrixUser.community_id == community_id
+        bulk_invites = MatrixBulkInvite.community_id == community_id
+
+        with self.client._sqla_session() as session:
+            session: sqlalchemy.orm.Session
+
+            for chunk in _chunks(plan.destroy, self.batch_size):
+                session.execute(sqlalchemy.delete(MatrixBulkInvite).where(bulk_invites).where(MatrixBulkInvite.matrix_user_id.in_(chunk)))
+                session.execute(sqlalchemy.delete(MatrixUser).where(users).where(MatrixUser.id.in_(chunk)))
+            for chunk in _chunks(plan.mark_joined, self.batch_size):
+                session.execute(sqlalchemy.update(MatrixUser).where(users).where(MatrixUser.id.in_(chunk)).values(joined_private_space=True))
+            for chunk in _chunks(plan.unlink, self.batch_size):
+                session.execute(sqlalchemy.update(MatrixUser).where(users).where(MatrixUser.id.in_(chunk)).values(account_email=None, joined_private_space=False))
+                session.execute(sqlalchemy.delete(MatrixBulkInvite).where(bulk_invites).where(MatrixBulkInvite.matrix_user_id.in_(chunk)))
+
+            if plan.destroy or plan.unlink:
+                # Like MatrixUser.destroy and MatrixUser.unlink, delete the accounts left without users
+                session.execute(
+                    sqlalchemy.delete(Account)
+                    .where(Account.email.not_in(sqlalchemy.select(MatrixUser.account_email).where(MatrixUser.account_email.is_not(None))))
+                    .where(Account.email.not_in(sqlalchemy.select(TelegramUser.account_email).where(TelegramUser.account_email.is_not(None))))
+                )
+
+            session.commit()
+
+    async def _kick(self, room_id: str, user_id: str) -> bool:
+        await self.kick_limiter.acquire()
+        response = await self.client.room_kick(room_id=room_id, user_id=user_id, reason="Loki account not linked")
+        if isinstance(response, nio.RoomKickError):
+            log.warning("Could not remove %s from %s: %r", user_id, room_id, response)
+            return False
+        return True
+
+    async def _welcome(self, community: Community, user_id: str) -> bool:
+        await self.welcome_limiter.acquire()
+        # Handled like a live join, so that the user is sent their profile URL along with the creation of their MatrixUser
+        try:
+            await self.client.dispatch_membership(room_id=community.public_space_id, user_id=user_id, membership="join")
+        except Exception:
+            # Such as if the live join of the same user has been handled meanwhile
+            log.exception("Could not handle the missed join of %s to %s", user_id, community.public_space_id)
+            return False
+        return True
+
+    async def reconcile_community(self, community: Community, dry_run: bool = False) -> ReconciliationPlan:
+        """
+        Perform a reconciliation of a single community.
+
+        :param community: The community to reconcile.
+        :param dry_run: If :data:`True`, only compute the corrections, without applying them.
+        :return: The corrections that were needed.
+        """
+
+        log.debug("Fetching the members of the spaces of %s...", community.id)
+        public_rooms = await self.fetch_members(community.public_space_id)
+        private_rooms = await self.fetch_members(community.private_space_id)
+        users = await asyncio.to_thread(self._load_users, community.id)
+
+        plan = plan_reconciliation(
+            public_rooms=public_rooms,
+            private_rooms=private_rooms,
+            public_space_id=community.public_space_id,
+            private_space_id=community.private_space_id,
+            users=users,
+            bot_id=self.client.user_id,
+        )
+        log.info("Reconciliation of %d users of %s needs: %s", len(users), community.id, plan)
+
+        if dry_run or not plan:
+            return plan
+
+        await asyncio.to_thread(self._apply, community.id, plan)
+        log.debug("Applied the database corrections")
+
+        welcomed = 0
+        for user_id in sorted(plan.create):
+            welcomed += await self._welcome(community, user_id)
+        log.debug("Handled the missed joins of %d users", welcomed)
+
+        kicked = 0
+        for room_id, user_id in plan.kicks:
+            kicked += await self._kick(room_id, user_id)
+        log.info("Reconciliation of %s complete, welcomed %d users and removed %d users from rooms", community.id, welcomed, kicked)
+
+        return plan
+
+    def _communities(self) -> list[Community]:
+        with self.client._sqla_session() as session:
+            return self.client.communities.all(session)
+
+    async def reconcile(self, dry_run: bool = False) -> dict[str, ReconciliationPlan]:
+        """
+        Perform a reconciliation of every community, one after the other.
+
+        A community whose reconciliation fails doesn't prevent the others from being reconciled.
+
+        :param dry_run: If :data:`True`, only compute the corrections, without applying them.
+        :return: The corrections that were needed by each successfully reconciled community, by community id.
+        """
+
+        plans = {}
+        for community in await asyncio.to_thread(self._communities):
+            try:
+                plans[community.id] = await self.reconcile_community(community, dry_run=dry_run)
+            except Exception:
+                log.exception("Reconciliation of %s failed", community.id)
+        return plans
+
+    async def run_forever(self, interval: float) -> t.NoReturn:
+        """
+        Perform a reconciliation every ``interval`` seconds, starting ``interval`` seconds from now.
+        """
+
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reconcile()
+            except Exception:
+                log.exception("Reconciliation failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile the database with the members of the Matrix spaces.")
+    parser.add_argument("--dry-run", action="store_true", help="only log the needed corrections, without applying them")
+    parser.add_argument("--community", help="the id of the only community to reconcile")
+    args = parser.parse_args()
+
+    install_log_handler()
+    create_app()
+    sqla_engine = shared_engine()
+
+    client = LokiClient(
+        homeserver=MATRIX_HOMESERVER.__wrapped__,
+        user=MATRIX_USER_ID.__wrapped__,
+        sqla_engine=sqla_engine
+    )
+    reconciler = Reconciler(client)
+
+    async def run():
+        if args.community is not None:
+            with client._sqla_session() as session:
+                community = client.communities.get(session, args.community)
+            if community is None:
+                raise SystemExit(f"No such community: {args.community}")
+
+        await client.login_with_shared_secret(MATRIX_USER_SECRET.__wrapped__)
+        try:
+            if args.community is None:
+                await reconciler.reconcile(dry_run=args.dry_run)
+            else:
+                await reconciler.reconcile_community(community, dry_run=args.dry_run)
+        finally:
+            await client.logout()
+            await client.close()
+
+    asyncio.run(run())
+
+
+__all__ = (
+    "ReconciliationPlan",
+    "plan_reconciliation",
+    "Reconciler",
+    "main",
+)
+
+
+if __name__ == "__main__":
+    get_snapshot()
+    main()
@@ -0,0 +1,234 @@
+"""
+This module defines the recording of the traffic between the Matrix bot and its homeserver, so that real load can be replayed locally with ``python -m benchmarks.replay``.
+
+A capture is a gzip-compressed file with a JSON object per line:
+
+- a ``header``, with the version of the format, the bot and the spaces it monitors;
+- a ``sync`` for each sync response, with its body;
+- a ``request`` for each other request, with its body and the status and body of its response.
+
+Each record after the header has a ``t``, the number of seconds since the recording started.
+
+Captures are redacted as they are written: user ids are replaced by pseudonyms, consistent within a capture but not across captures, and message bodies, display names, avatars and credentials are blanked out.
+"""
+
+import datetime
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+import typing as t
+import urllib.parse
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+CAPTURE_VERSION = 1
+"""
+The version of the format of the captures.
+"""
+
+REDACTED_KEYS = frozenset({
+    "body",
+    "formatted_body",
+    "displayname",
+    "avatar_url",
+    "reason",
+    "topic",
+    "password",
+    "token",
+    "access_token",
+    "refresh_token",
+    "mac",
+    "nonce",
+    "ciphertext",
+})
+"""
+The keys whose string values are blanked out wherever they appear in a capture.
+"""
+
+_user_id = re.compile(r"@[a-zA-Z0-9._=\-/+]+:[a-zA-Z0-9.\-]+(?::\d+)?")
+
+
+class Redactor:
+    """
+    Removes personal data and credentials from the traffic of the bot.
+    """
+
+    def __init__(self, key: bytes | None = None):
+        """
+        :param key: The secret the pseudonyms are derived from; a random one is generated if not given, so that pseudonyms can't be reversed.
+        """
+
+        self.key: bytes = key or secrets.token_bytes(32)
+
+    def user_id(self, user_id: str) -> str:
+        """
+        :return: The pseudonym of the given user id, on the same server.
+        """
+
+        server = user_id.split(":", 1)[1]
+        digest = hmac.new(self.key, user_id.encode("utf8"), digestmod=hashlib.sha256).hexdigest()
+        return f"@u{digest[:12]}:{server}"
+
+    def text(self, value: str) -> str:
+        """
+        :return: The given string, with every user id replaced by its pseudonym.
+        """
+
+        return _user_id.sub(lambda match: self.user_id(match.group()), value)
+
+    def json(self, value: t.Any) -> t.Any:
+        """
+        :return: A copy of the given JSON value, with all personal data and credentials redacted.
+        """
+
+        if isinstance(value, dict):
+            return {
+                self.text(key): "" if key in REDACTED_KEYS and isinstance(item, str) else self.json(item)
+                for key, item in value.items()
+            }
+        if isinstance(value, list):
+            return [self.json(item) for item in value]
+        if isinstance(value, str):
+            return self.text(value)
+        return value
+
+    def path(self, path: str) -> str:
+        """
+        :return: The given request path, decoded, without the access token, and with every user id replaced by its pseudonym.
+        """
+
+        parts = urllib.parse.urlsplit(path)
+        query = [(key, value) for key, value in urllib.parse.parse_qsl(parts.query) if key not in REDACTED_KEYS]
+        path = urllib.parse.unquote(parts.path)
+        if query:
+            path += "?" + urllib.parse.urlencode(query)
+        return self.text(path)
+
+
+def _parse_json(data: t.Any) -> t.Any:
+    if isinstance(data, bytes):
+        data = data.decode("utf8", errors="replace")
+    if not isinstance(data, str) or not data:
+        return None
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+class TrafficRecorder:
+    """
+    Writes the traffic of a client to a capture from a background thread, so that redacting and compressing it doesn't block the event loop.
+    """
+
+    def __init__(self, output_dir: str, user_id: str, public_space_id: str, private_space_id: str):
+        """
+        :param output_dir: The directory to write the capture to.
+        :param user_id: The id of the bot.
+        :param public_space_id: The id of the public space of the default community.
+        :param private_space_id: The id of the private space of the default community.
+        """
+
+        os.makedirs(output_dir, exist_ok=True)
+        self.path: str = os.path.join(output_dir, f"lokiunimore-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.capture.jsonl.gz")
+        self.redactor: Redactor = Redactor()
+        self._started_at: float = time.monotonic()
+        self._queue: queue.SimpleQueue[tuple[float, str, dict] | None] = queue.SimpleQueue()
+        self._file: t.TextIO = gzip.open(self.path, "wt", encoding="utf8")
+        self._write({
+            "kind": "header",
+            "version": CAPTURE_VERSION,
+            "recorded_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "user_id": self.redactor.user_id(user_id),
+            "public_space_id": public_space_id,
+            "private_space_id": private_space_id,
+        })
+        self._thread: threading.Thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+        log.info("Recording the traffic with the homeserver to %s", self.path)
+
+    def _write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n")
+
+    def _run(self) -> None:
+        while (item := self._queue.get()) is not None:
+            offset, kind, fields = item
+            try:
+                if kind == "sync":
+                    record = {"t": round(offset, 3), "kind": kind, "body": self.redactor.json(_parse_json(fields["body"]))}
+                else:
+                    record = {
+                        "t": round(offset, 3),
+                        "kind": kind,
+                        "method": fields["method"],
+                        "path": self.redactor.path(fields["path"]),
+                        "request": self.redactor.json(_parse_json(fields["request"])),
+                        "status": fields["status"],
+                        "response": self.redactor.json(_parse_json(fields["response"])),
+                    }
+                self._write(record)
+            except Exception:
+                log.warning("Could not record a %s", kind, exc_info=True)
+        self._file.close()
+
+    async def record_response(self, method: str, path: str, data: t.Any, response: aiohttp.ClientResponse) -> None:
+        """
+        Queue a request and its response to be recorded.
+
+        :param method: The method of the request.
+        :param path: The path of the request, including its query.
+        :param data: The body of the request, recorded only if it's JSON.
+        :param response: The response, whose body is read, and therefore cached, only if it's JSON.
+        """
+
+        body = await response.read() if response.content_type == "application/json" else None
+        offset = time.monotonic() - self._started_at
+        if response.status == 200 and urllib.parse.urlsplit(path).path.endswith("/sync"):
+            self._queue.put((offset, "sync", {"body": body}))
+        else:
+            self._queue.put((offset, "request", {"method": method, "path": path, "request": data, "status": response.status, "response": body}))
+
+    def close(self) -> None:
+        """
+        Write the queued records, and close the capture.
+        """
+
+        self._queue.put(None)
+        self._thread.join()
+        log.info("Recorded the traffic with the homeserver to %s", self.path)
+
+
+def read_capture(path: str) -> t.Iterator[dict]:
+    """
+    :param path: The path of a capture.
+    :return: The records of the capture, starting from its header.
+    :raises ValueError: If the file isn't a capture, or its format isn't supported.
+    """
+
+    with gzip.open(path, "rt", encoding="utf8") as file:
+        header = json.loads(file.readline() or "{}")
+        if header.get("kind") != "header":
+            raise ValueError(f"{path} is not a capture")
+        if header.get("version") != CAPTURE_VERSION:
+            raise ValueError(f"{path} is a capture of version {header.get('version')}, but only version {CAPTURE_VERSION} is supported")
+        yield header
+        for line in file:
+            yield json.loads(line)
+
+
+__all__ = (
+    "CAPTURE_VERSION",
+    "REDACTED_KEYS",
+    "Redactor",
+    "TrafficRecorder",
+    "read_capture",
+)
@@ -0,0 +1,231 @@
+"""
+This module defines the workers handling the membership changes queued by the Matrix bot when `MATRIX_MEMBERSHIP_QUEUE` is enabled.
+
+Run it as a script to start a worker; any number of them can be started, on any number of nodes::
+
+    python -m lokiunimore.matrix.worker [--concurrency N]
+
+.. note:: Running more than one worker, or a worker with more than one slot, requires PostgreSQL or MySQL, as other databases don't support ``SKIP LOCKED``.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+import typing as t
+import sqlalchemy
+import sqlalchemy.exc
+import sqlalchemy.orm
+
+from lokiunimore.config import LOKI_METRICS_BIND, LOKI_TRACE_EXPORT, LOKI_TRACE_SAMPLE_RATE, LOKI_PROFILE_DIR, LOKI_LOOP_LAG_THRESHOLD, MATRIX_USER_SECRET, MATRIX_HOMESERVER, MATRIX_USER_ID
+from lokiunimore.config.snapshot import get_snapshot
+from lokiunimore.sql.tables import MatrixMembershipJob, MatrixMembershipPartition
+from lokiunimore.utils.logs import install_log_handler
+from lokiunimore.utils.metrics import serve_metrics
+from lokiunimore.utils.tracing import tracer, exporter_for
+from lokiunimore.utils.profiling import install_profiling
+from lokiunimore.matrix.client import LokiClient
+from lokiunimore.matrix.queue import MEMBERSHIP_PARTITIONS
+from lokiunimore.web.app import create_app, shared_engine
+
+log = logging.getLogger(__name__)
+
+
+MAX_ATTEMPTS = 5
+"""
+The number of times a job is attempted before being dropped.
+"""
+
+
+class MembershipWorker:
+    """
+    Claims partitions of the membership queue with ``SELECT ... FOR UPDATE SKIP LOCKED``, and handles their jobs in order via :meth:`.LokiClient.dispatch_membership`.
+
+    Since each partition is handled by a single worker at a time, the changes of each user are handled in the order they were received, while changes of different users are spread across all workers.
+    """
+
+    def __init__(self, client: LokiClient, concurrency: int = 4, batch_size: int = 20, poll_interval: float = 1):
+        """
+        :param client: The logged in client to handle the jobs with.
+        :param concurrency: The number of partitions to handle at the same time.
+        :param batch_size: The maximum number of jobs to handle before releasing a partition.
+        :param poll_interval: The number of seconds to wait for new jobs when the queue is empty.
+        """
+
+        self.client: LokiClient = client
+        self.concurrency: int = concurrency
+        self.batch_size: int = batch_size
+        self.poll_interval: float = poll_interval
+
+    def ensure_partitions(self) -> None:
+        """
+        Create the rows of the partitions, if they don't exist yet.
+        """
+
+        with self.client._sqla_session() as session:
+            session: sqlalchemy.orm.Session
+            existing = set(session.scalars(sqlalchemy.select(MatrixMembershipPartition.partition)))
+            session.add_all([MatrixMembershipPartition(partition=partition) for partition in range(MEMBERSHIP_PARTITIONS) if partition not in existing])
+            try:
+                session.commit()
+            except sqlalchemy.exc.IntegrityError:
+                # Another worker created them first
+                session.rollback()
+
+    @staticmethod
+    def _lock(session: sqlalchemy.orm.Session, query: sqlalchemy.Select) -> MatrixMembershipPartition | None:
+        return session.scalars(query.limit(1).with_for_update(skip_locked=True, of=MatrixMembershipPartition)).first()
+
+    def _claim(self, session: sqlalchemy.orm.Session) -> MatrixMembershipPartition | None:
+        # Only the first job of each partition may be handled, so partitions whose first job is backing off have nothing to do
+        heads = sqlalchemy.select(sqlalchemy.func.min(MatrixMembershipJob.id)).group_by(MatrixMembershipJob.partition)
+        return self._lock(
+            session,
+            sqlalchemy.select(MatrixMembershipPartition)
+            .where(MatrixMembershipPartition.partition.in_(
+                sqlalchemy.select(MatrixMembershipJob.partition)
+                .where(MatrixMembershipJob.id.in_(heads))
+                .where(MatrixMembershipJob.available_at <= time.time())
+            ))
+            .order_by(MatrixMembershipPartition.handled_at)
+        )
+
+    @staticmethod
+    def _head(session: sqlalchemy.orm.Session, number: int) -> MatrixMembershipJob | None:
+        return session.query(MatrixMembershipJob).filter_by(partition=number).order_by(MatrixMembershipJob.id).first()
+
+    def _settle(self, session: sqlalchemy.orm.Session, partition: MatrixMembershipPartition, job: MatrixMembershipJob, failed: bool) -> MatrixMembershipPartition | None:
+        if not failed or job.attempts + 1 >= MAX_ATTEMPTS:
+            session.delete(job)
+        else:
+            job.attempts += 1
+            job.available_at = time.time() + min(5 * 2 ** job.attempts, 600)
+
+        # Commit each job, so that it isn't handled again if the worker dies, then claim the partition again
+        partition.handled_at = time.time()
+        session.commit()
+        return self._lock(session, sqlalchemy.select(MatrixMembershipPartition).where(MatrixMembershipPartition.partition == partition.partition))
+
+    @staticmethod
+    def _release(session: sqlalchemy.orm.Session, partition: MatrixMembershipPartition | None) -> None:
+        if partition is not None:
+            # Let the other partitions be claimed before this one again
+            partition.handled_at = time.time()
+        session.commit()
+
+    async def handle_partition(self) -> int:
+        """
+        Claim a partition whose first job is available, and handle up to :attr:`.batch_size` of its jobs.
+
+        The database is only accessed in worker threads, so that the event loop keeps syncing meanwhile.
+
+        :return: The number of jobs handled.
+        """
+
+        handled = 0
+
+        with self.client._sqla_session() as session:
+            session: sqlalchemy.orm.Session
+            partition = await asyncio.to_thread(self._claim, session)
+            if partition is None:
+                return 0
+            number = partition.partition
+
+            while partition is not None and handled < self.batch_size:
+                job = await asyncio.to_thread(self._head, session, number)
+                # Later jobs of the partition must wait for the first one, so that ordering is preserved
+                if job is None or job.available_at > time.time():
+                    break
+
+                try:
+                    with tracer.trace("membership job", **{"matrix.event_id": job.event_id, "matrix.room_id": job.room_id, "loki.partition": number, "loki.attempts": job.attempts}):
+                        await self.client.dispatch_membership(room_id=job.room_id, user_id=job.user_id, membership=job.membership)
+                except Exception:
+                    if job.attempts + 1 >= MAX_ATTEMPTS:
+                        log.exception("Dropping %r after %d failed attempts", job, job.attempts + 1)
+                    else:
+                        log.exception("Failed to handle %r, retrying later", job)
+                    partition = await asyncio.to_thread(self._settle, session, partition, job, True)
+                else:
+                    partition = await asyncio.to_thread(self._settle, session, partition, job, False)
+                    handled += 1
+
+            await asyncio.to_thread(self._release, session, partition)
+
+        if handled:
+            log.debug("Handled %d membership jobs of partition %d", handled, number)
+        return handled
+
+    async def _work(self) -> t.NoReturn:
+        while True:
+            try:
+                handled = await self.handle_partition()
+            except sqlalchemy.exc.DBAPIError:
+                log.exception("Failed to claim a partition of the membership queue")
+                handled = 0
+            if not handled:
+                await asyncio.sleep(self.poll_interval)
+
+    async def run(self) -> t.NoReturn:
+        """
+        Handle jobs forever.
+        """
+
+        if self.client.sqla_engine.dialect.name not in ("postgresql", "mysql") and self.concurrency > 1:
+            log.warning("%s doesn't support SKIP LOCKED, handling a single partition at a time", self.client.sqla_engine.dialect.name)
+            self.concurrency = 1
+
+        await asyncio.to_thread(self.ensure_partitions)
+        log.info("Handling membership jobs with %d concurrent slots", self.concurrency)
+        await asyncio.gather(*(self._work() for _ in range(self.concurrency)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Handle the membership changes queued by the Matrix bot.")
+    parser.add_argument("--concurrency", type=int, default=4, help="the number of partitions to handle at the same time")
+    args = parser.parse_args()
+
+    install_log_handler()
+    create_app()
+    sqla_engine = shared_engine()
+    if bind := LOKI_METRICS_BIND.__wrapped__:
+        # Workers may run side by side on the same node
+        serve_metrics(bind, attempts=16)
+    if target := LOKI_TRACE_EXPORT.__wrapped__:
+        tracer.configure(exporter_for(target), sample_rate=LOKI_TRACE_SAMPLE_RATE.__wrapped__)
+
+    # The worker doesn't handle events by itself, but it needs the state of the rooms to find the management rooms
+    client = LokiClient(
+        homeserver=MATRIX_HOMESERVER.__wrapped__,
+        user=MATRIX_USER_ID.__wrapped__,
+        sqla_engine=sqla_engine,
+        handle_events=False,
+    )
+    worker = MembershipWorker(client, concurrency=args.concurrency)
+
+    async def run():
+        install_profiling(output_dir=LOKI_PROFILE_DIR.__wrapped__, lag_threshold=LOKI_LOOP_LAG_THRESHOLD.__wrapped__)
+        await client.login_with_shared_secret(MATRIX_USER_SECRET.__wrapped__)
+        try:
+            await client.sync(full_state=True)
+            await asyncio.gather(
+                client.sync_forever(60_000),
+                worker.run(),
+            )
+        finally:
+            await client.logout()
+            await client.close()
+
+    asyncio.run(run())
+
+
+__all__ = (
+    "MAX_ATTEMPTS",
+    "MembershipWorker",
+    "main",
+)
+
+
+if __name__ == "__main__":
+    get_snapshot()
+    main()
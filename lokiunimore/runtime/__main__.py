@@ -0,0 +1,56 @@
+import asyncio
+import aiohttp
+
+from lokiunimore.config import LOKI_HEALTH_BIND, LOKI_METRICS_BIND, LOKI_TRACE_EXPORT, LOKI_TRACE_SAMPLE_RATE, LOKI_PROFILE_DIR, LOKI_LOOP_LAG_THRESHOLD, MATRIX_HOMESERVER, MATRIX_USER_ID, MATRIX_USER_SECRET, MATRIX_RECONCILE_INTERVAL, MATRIX_MEMBERSHIP_QUEUE, TELEGRAM_APP_ID, TELEGRAM_APP_HASH, TELEGRAM_BOT_TOKEN
+from lokiunimore.config.snapshot import get_snapshot
+from lokiunimore.utils.logs import install_log_handler
+from lokiunimore.utils.metrics import serve_metrics
+from lokiunimore.utils.tracing import tracer, exporter_for
+from lokiunimore.utils.profiling import install_profiling
+from lokiunimore.runtime.components import MatrixComponent, TelegramComponent
+from lokiunimore.runtime.runtime import LokiRuntime
+from lokiunimore.web.app import create_app, shared_engine
+
+
+def main():
+    install_log_handler()
+    create_app()
+    if bind := LOKI_METRICS_BIND.__wrapped__:
+        serve_metrics(bind)
+    if target := LOKI_TRACE_EXPORT.__wrapped__:
+        tracer.configure(exporter_for(target), sample_rate=LOKI_TRACE_SAMPLE_RATE.__wrapped__)
+
+    # Reuse the engine of the web app, so that everything in the process shares a single connection pool
+    sqla_engine = shared_engine()
+
+    async def run():
+        install_profiling(output_dir=LOKI_PROFILE_DIR.__wrapped__, lag_threshold=LOKI_LOOP_LAG_THRESHOLD.__wrapped__)
+        async with aiohttp.ClientSession() as http_session:
+            runtime = LokiRuntime(
+                components=[
+                    MatrixComponent(
+                        homeserver=MATRIX_HOMESERVER.__wrapped__,
+                        user_id=MATRIX_USER_ID.__wrapped__,
+                        user_secret=MATRIX_USER_SECRET.__wrapped__,
+                        sqla_engine=sqla_engine,
+                        http_session=http_session,
+                        reconcile_interval=MATRIX_RECONCILE_INTERVAL.__wrapped__,
+                        queue_membership=MATRIX_MEMBERSHIP_QUEUE.__wrapped__,
+                    ),
+                    TelegramComponent(
+                        app_id=TELEGRAM_APP_ID.__wrapped__,
+                        app_hash=TELEGRAM_APP_HASH.__wrapped__,
+                        bot_token=TELEGRAM_BOT_TOKEN.__wrapped__,
+                        sqla_engine=sqla_engine,
+                    ),
+                ],
+                health_bind=LOKI_HEALTH_BIND.__wrapped__,
+            )
+            await runtime.run()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    get_snapshot()
+    main()
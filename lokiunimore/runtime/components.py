@@ -0,0 +1,210 @@
+"""
+This module defines the components that can be run together by a :class:`~lokiunimore.runtime.runtime.LokiRuntime`.
+"""
+
+import time
+import asyncio
+import logging
+import typing as t
+import aiohttp
+import nio
+import sqlalchemy.engine
+
+from lokiunimore.matrix.client import LokiClient
+from lokiunimore.matrix.reconcile import Reconciler
+from lokiunimore.sql.leader import LeaderElection
+from lokiunimore.telegram.client import LokiTelegramClient
+
+log = logging.getLogger(__name__)
+
+
+class Component:
+    """
+    Something running on the event loop of a :class:`~lokiunimore.runtime.runtime.LokiRuntime`, whose health can be reported.
+    """
+
+    name: str = NotImplemented
+    """
+    The name the component is reported with.
+    """
+
+    def __init__(self):
+        self.status: str = "starting"
+        """
+        Either ``starting``, ``standby``, ``running``, ``stopped`` or ``failed``.
+        """
+
+        self.status_changed_at: float = time.time()
+        """
+        The UNIX timestamp of the last change of :attr:`.status`.
+        """
+
+        self.error: str | None = None
+        """
+        If the component failed, a description of the error.
+        """
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {self.status}>"
+
+    def set_status(self, status: str, error: str | None = None) -> None:
+        log.log(logging.WARNING if status == "failed" else logging.INFO, "Component %s is now %s", self.name, status)
+        self.status = status
+        self.status_changed_at = time.time()
+        self.error = error
+
+    async def run(self) -> None:
+        """
+        Run the component until it stops, calling :meth:`.set_status` with ``running`` once it's ready.
+        """
+
+        raise NotImplementedError()
+
+    async def close(self) -> None:
+        """
+        Release the resources held by the component after :meth:`.run` has returned or failed.
+        """
+
+    def is_healthy(self) -> bool:
+        return self.status in ("standby", "running")
+
+    def health(self) -> dict[str, t.Any]:
+        """
+        :return: A JSON-serializable report about the health of the component.
+        """
+
+        return {
+            "healthy": self.is_healthy(),
+            "status": self.status,
+            "status_changed_at": self.status_changed_at,
+            "error": self.error,
+        }
+
+
+class MatrixComponent(Component):
+    """
+    Runs a :class:`.LokiClient`.
+    """
+
+    name = "matrix"
+
+    SYNC_TIMEOUT = 60_000
+    """
+    The number of milliseconds each long-polling sync request may wait for new events.
+    """
+
+    def __init__(
+            self,
+            homeserver: str,
+            user_id: str,
+            user_secret: str,
+            sqla_engine: sqlalchemy.engine.Engine,
+            http_session: aiohttp.ClientSession,
+            reconcile_interval: float = 0,
+            queue_membership: bool = False,
+    ):
+        """
+        :param homeserver: The URL of the homeserver to connect to.
+        :param user_id: The id of the user to login as.
+        :param user_secret: The shared secret to login with.
+        :param sqla_engine: The engine to share with the other components.
+        :param http_session: The HTTP session to share with the other components.
+        :param reconcile_interval: The number of seconds between two reconciliations, or ``0`` to not reconcile.
+        :param queue_membership: Whether membership changes should be queued for the workers of :mod:`lokiunimore.matrix.worker`.
+        """
+
+        super().__init__()
+        self.user_secret: str = user_secret
+        self.client: LokiClient = LokiClient(homeserver=homeserver, user=user_id, sqla_engine=sqla_engine, queue_membership=queue_membership)
+        # nio only creates its own session if it wasn't given one
+        self.client.client_session = http_session
+        self.client.add_response_callback(self._on_sync, nio.SyncResponse)
+        self.last_sync_at: float | None = None
+        self.reconciler: Reconciler = Reconciler(self.client)
+        self.reconcile_interval: float = reconcile_interval
+        self._reconcile_task: asyncio.Task | None = None
+        self.election: LeaderElection = LeaderElection(sqla_engine, name="matrix")
+
+    async def _on_sync(self, response: nio.SyncResponse) -> None:
+        self.last_sync_at = time.time()
+        if self.status != "running":
+            self.set_status("running")
+
+    async def _lead(self) -> None:
+        if self.reconcile_interval:
+            self._reconcile_task = asyncio.create_task(self.reconciler.run_forever(self.reconcile_interval))
+        await self.client.sync_forever(self.SYNC_TIMEOUT, full_state=True, set_presence="online")
+
+    async def run(self) -> None:
+        await self.client.login_with_shared_secret(self.user_secret)
+        # Only one replica may act at a time, the others wait logged in to take over
+        self.set_status("standby")
+        await self.election.lead(self._lead)
+
+    async def close(self) -> None:
+        if self._reconcile_task is not None:
+            self._reconcile_task.cancel()
+        if self.client.logged_in:
+            await self.client.logout()
+        # Don't close the shared session
+        self.client.client_session = None
+
+    def is_healthy(self) -> bool:
+        if self.status != "running":
+            return super().is_healthy()
+        # A sync which takes much longer than its timeout means the homeserver isn't answering
+        return self.last_sync_at is not None and time.time() - self.last_sync_at < 3 * self.SYNC_TIMEOUT / 1000
+
+    def health(self) -> dict[str, t.Any]:
+        return {
+            **super().health(),
+            "leader": self.election.is_leader,
+            "last_sync_at": self.last_sync_at,
+        }
+
+
+class TelegramComponent(Component):
+    """
+    Runs a :class:`.LokiTelegramClient`.
+    """
+
+    name = "telegram"
+
+    def __init__(self, app_id: int, app_hash: str, bot_token: str, sqla_engine: sqlalchemy.engine.Engine):
+        """
+        :param app_id: The id of the Telegram app to connect with.
+        :param app_hash: The hash of the Telegram app to connect with.
+        :param bot_token: The token of the bot to login as.
+        :param sqla_engine: The engine to share with the other components.
+
+        .. note:: Must be created inside the event loop it is going to run in.
+        """
+
+        super().__init__()
+        self.bot_token: str = bot_token
+        self.client: LokiTelegramClient = LokiTelegramClient(session="bot", api_id=app_id, api_hash=app_hash, sqla_engine=sqla_engine)
+
+    async def run(self) -> None:
+        await self.client.login_bot(self.bot_token)
+        self.set_status("running")
+        await self.client.serve()
+
+    async def close(self) -> None:
+        await self.client.disconnect()
+
+    def is_healthy(self) -> bool:
+        return super().is_healthy() and self.client.is_connected()
+
+    def health(self) -> dict[str, t.Any]:
+        return {
+            **super().health(),
+            "connected": self.client.is_connected(),
+            "queued_membership_changes": self.client.membership_batcher.queue.qsize(),
+        }
+
+
+__all__ = (
+    "Component",
+    "MatrixComponent",
+    "TelegramComponent",
+)
@@ -0,0 +1,116 @@
+"""
+This module defines the runtime running the :mod:`lokiunimore` bots together on a single event loop.
+"""
+
+import asyncio
+import logging
+import traceback
+import aiohttp.web
+
+from lokiunimore.runtime.components import Component
+from lokiunimore.utils.metrics import REGISTRY, CONTENT_TYPE
+
+log = logging.getLogger(__name__)
+
+
+class ComponentFailedError(Exception):
+    """
+    A component of a :class:`.LokiRuntime` raised an error.
+    """
+
+
+class LokiRuntime:
+    """
+    Runs multiple :class:`.Component`\\ s on the same event loop, optionally reporting their health via HTTP.
+
+    If a component stops or fails, all the others are stopped as well, so that whatever supervises the process can restart it as a whole.
+    """
+
+    def __init__(self, components: list[Component], health_bind: tuple[str, int] | None = None):
+        """
+        :param components: The components to run.
+        :param health_bind: The address and port to serve the health report and the metrics at, or :data:`None` to not serve them.
+        """
+
+        self.components: list[Component] = components
+        self.health_bind: tuple[str, int] | None = health_bind
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} with {self.components!r}>"
+
+    def health(self) -> dict:
+        """
+        :return: A JSON-serializable report about the health of all components.
+        """
+
+        return {
+            "healthy": all(component.is_healthy() for component in self.components),
+            "components": {component.name: component.health() for component in self.components},
+        }
+
+    async def _handle_health(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        report = self.health()
+        return aiohttp.web.json_response(report, status=200 if report["healthy"] else 503)
+
+    @staticmethod
+    async def _handle_metrics(request: aiohttp.web.Request) -> aiohttp.web.Response:
+        return aiohttp.web.Response(body=REGISTRY.render().encode("utf8"), headers={"Content-Type": CONTENT_TYPE})
+
+    async def _start_health_server(self) -> aiohttp.web.AppRunner | None:
+        if self.health_bind is None:
+            return None
+
+        health_app = aiohttp.web.Application()
+        health_app.router.add_get("/health", self._handle_health)
+        health_app.router.add_get("/metrics", self._handle_metrics)
+        runner = aiohttp.web.AppRunner(health_app, access_log=None)
+        await runner.setup()
+        host, port = self.health_bind
+        await aiohttp.web.TCPSite(runner, host, port).start()
+        log.info("Reporting health at http://%s:%d/health and metrics at http://%s:%d/metrics", host, port, host, port)
+        return runner
+
+    @staticmethod
+    async def _run_component(component: Component) -> None:
+        try:
+            await component.run()
+        except asyncio.CancelledError:
+            component.set_status("stopped")
+            raise
+        except Exception as e:
+            component.set_status("failed", error="".join(traceback.format_exception_only(e)).strip())
+            raise ComponentFailedError(component.name) from e
+        else:
+            component.set_status("stopped")
+
+    async def run(self) -> None:
+        """
+        Run all components until one of them stops.
+
+        :raises ComponentFailedError: If the stop was caused by an error.
+        """
+
+        health_runner = await self._start_health_server()
+        tasks = [asyncio.create_task(self._run_component(component), name=component.name) for component in self.components]
+
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in done:
+                task.result()
+        finally:
+            for component in self.components:
+                try:
+                    await component.close()
+                except Exception:
+                    log.exception("Failed to close component %s", component.name)
+            if health_runner is not None:
+                await health_runner.cleanup()
+
+
+__all__ = (
+    "ComponentFailedError",
+    "LokiRuntime",
+)
@@ -1 +1,14 @@
-from .tables import *
+import importlib
+
+_submodules = (".tables", ".leader", ".communities", ".metrics", ".engine", ".routing")
+
+
+def __getattr__(name):
+    # Lazily re-export the contents of the submodules, so that importing one of them doesn't import all the others.
+    if f".{name}" in _submodules:
+        return importlib.import_module(f".{name}", __name__)
+    for submodule in _submodules:
+        module = importlib.import_module(submodule, __name__)
+        if name in module.__all__:
+            return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
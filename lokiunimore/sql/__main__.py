@@ -1,7 +1,18 @@
+"""
+Executable that upgrades the tables created by earlier versions, and creates the missing ones, in the database.
+"""
+
 from lokiunimore.sql.tables import Base
-import sqlalchemy
-from lokiunimore.config import SQLALCHEMY_DATABASE_URL
+from lokiunimore.sql.engine import create_engine
+from lokiunimore.sql.upgrade import upgrade_schema
+
+
+def main():
+    sqla_engine = create_engine()
+    upgrade_schema(sqla_engine)
+    Base.metadata.create_all(bind=sqla_engine)
+    sqla_engine.dispose()
 
 
-sqla_engine: sqlalchemy.engine.Engine = sqlalchemy.create_engine(SQLALCHEMY_DATABASE_URL.__wrapped__)
-Base.metadata.create_all(bind=sqla_engine)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+This module defines the lookup of the `.Community` a Matrix room or user belongs to.
+"""
+
+import logging
+import sqlalchemy
+import sqlalchemy.orm
+
+from lokiunimore.config import MATRIX_PUBLIC_SPACE_ID, MATRIX_PRIVATE_SPACE_ID, MATRIX_HELP_ROOM_ALIAS, OIDC_EMAIL_REGEX
+from lokiunimore.sql.tables import DEFAULT_COMMUNITY_ID, Community
+from lokiunimore.utils.caches import TTLCache
+
+log = logging.getLogger(__name__)
+
+
+def default_community() -> Community:
+    """
+    :return: The transient `.Community` configured via environment variables.
+    """
+
+    return Community(
+        id=DEFAULT_COMMUNITY_ID,
+        name=DEFAULT_COMMUNITY_ID,
+        public_space_id=MATRIX_PUBLIC_SPACE_ID.__wrapped__,
+        private_space_id=MATRIX_PRIVATE_SPACE_ID.__wrapped__,
+        help_room_alias=MATRIX_HELP_ROOM_ALIAS.__wrapped__,
+        email_regex=OIDC_EMAIL_REGEX.__wrapped__.pattern,
+        messages={},
+    )
+
+
+class CommunityRegistry:
+    """
+    Keeps all the `.Community`\\ s in memory, so that the community of every received event can be found without querying the database.
+
+    The communities are reloaded every ``ttl`` seconds, so that rows added to the table are picked up without restarting.
+    """
+
+    def __init__(self, ttl: float = 60):
+        """
+        :param ttl: The number of seconds after which the communities are loaded again from the database.
+        """
+
+        self._cache: TTLCache[None, tuple[dict[str, Community], dict[str, tuple[Community, bool]]]] = TTLCache(max_size=1, ttl=ttl)
+
+    def _load(self, session: sqlalchemy.orm.Session) -> tuple[dict[str, Community], dict[str, tuple[Community, bool]]]:
+        """
+        :return: The communities by id, and the communities by space id along with whether the space is the private one.
+        """
+
+        loaded = self._cache.get(None)
+        if loaded is not None:
+            return loaded
+
+        communities = {DEFAULT_COMMUNITY_ID: default_community()}
+        for community in session.scalars(sqlalchemy.select(Community)):
+            # Detach the rows, so that they can be used after the session is closed
+            session.expunge(community)
+            communities[community.id] = community
+
+        rooms = {}
+        for community in communities.values():
+            rooms[community.public_space_id] = (community, False)
+            rooms[community.private_space_id] = (community, True)
+
+        log.debug("Loaded %d communities", len(communities))
+        loaded = (communities, rooms)
+        self._cache.set(None, loaded)
+        return loaded
+
+    def all(self, session: sqlalchemy.orm.Session) -> list[Community]:
+        """
+        :param session: The session to load the communities with, if needed.
+        :return: All the communities, starting from the default one.
+        """
+
+        return list(self._load(session)[0].values())
+
+    def get(self, session: sqlalchemy.orm.Session, community_id: str) -> Community | None:
+        """
+        :param session: The session to load the communities with, if needed.
+        :param community_id: The id of the community.
+        :return: The community with the given id, or :data:`None` if it doesn't exist.
+        """
+
+        return self._load(session)[0].get(community_id)
+
+    def by_room(self, session: sqlalchemy.orm.Session, room_id: str) -> tuple[Community, bool] | None:
+        """
+        :param session: The session to load the communities with, if needed.
+        :param room_id: The id of a room.
+        :return: The community whose public or private space is the given room, and whether it is the private one, or :data:`None` if it isn't the space of any community.
+        """
+
+        return self._load(session)[1].get(room_id)
+
+    def invalidate(self) -> None:
+        """
+        Forget the loaded communities, so that they are loaded again from the database when next needed.
+        """
+
+        self._cache.clear()
+
+
+__all__ = (
+    "default_community",
+    "CommunityRegistry",
+)
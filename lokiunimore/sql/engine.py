@@ -0,0 +1,63 @@
+"""
+This module creates the :class:`~sqlalchemy.engine.Engine` of every component, so that all of them pool their connections to the database the same way.
+"""
+
+import typing as t
+import sqlalchemy
+import sqlalchemy.engine
+import sqlalchemy.pool
+
+from lokiunimore.config import SQLALCHEMY_DATABASE_URL, SQLALCHEMY_POOL_SIZE, SQLALCHEMY_MAX_OVERFLOW, SQLALCHEMY_POOL_RECYCLE, SQLALCHEMY_POOL_PRE_PING, SQLALCHEMY_STATEMENT_CACHE_SIZE, SQLALCHEMY_PGBOUNCER
+from lokiunimore.sql.metrics import install_pool_metrics
+
+
+def engine_options(url: str | sqlalchemy.engine.URL | None = None) -> dict[str, t.Any]:
+    """
+    :param url: The URL of the database, defaulting to :data:`lokiunimore.config.SQLALCHEMY_DATABASE_URL`.
+    :return: The keyword arguments to pass to :func:`sqlalchemy.create_engine` for the database, such as to set ``SQLALCHEMY_ENGINE_OPTIONS`` of :mod:`flask_sqlalchemy` to.
+    """
+
+    url = sqlalchemy.engine.make_url(url if url is not None else SQLALCHEMY_DATABASE_URL.__wrapped__)
+    options: dict[str, t.Any] = {
+        "query_cache_size": SQLALCHEMY_STATEMENT_CACHE_SIZE.__wrapped__,
+    }
+
+    if url.get_backend_name() == "sqlite":
+        # Connections to SQLite are files, which are cheap to open and never drop
+        return options
+
+    if SQLALCHEMY_PGBOUNCER.__wrapped__:
+        # PgBouncer already keeps the connections to the database open, and keeping more in each process would only hold its slots
+        options["poolclass"] = sqlalchemy.pool.NullPool
+        return options
+
+    options.update({
+        "pool_size": SQLALCHEMY_POOL_SIZE.__wrapped__,
+        "max_overflow": SQLALCHEMY_MAX_OVERFLOW.__wrapped__,
+        "pool_recycle": SQLALCHEMY_POOL_RECYCLE.__wrapped__,
+        "pool_pre_ping": SQLALCHEMY_POOL_PRE_PING.__wrapped__,
+        # Reuse the connection returned most recently, so that the ones in excess go idle and get recycled
+        "pool_use_lifo": True,
+    })
+    return options
+
+
+def create_engine(url: str | sqlalchemy.engine.URL | None = None, **kwargs) -> sqlalchemy.engine.Engine:
+    """
+    Create an engine pooling its connections as configured, and record the metrics of its pool.
+
+    Processes running more than a component should create a single engine and share it among them, so that they share its pool too.
+
+    :param url: The URL of the database, defaulting to :data:`lokiunimore.config.SQLALCHEMY_DATABASE_URL`.
+    :param kwargs: Keyword arguments overriding the ones of :func:`.engine_options`.
+    """
+
+    install_pool_metrics()
+    url = url if url is not None else SQLALCHEMY_DATABASE_URL.__wrapped__
+    return sqlalchemy.create_engine(url, **{**engine_options(url), **kwargs})
+
+
+__all__ = (
+    "engine_options",
+    "create_engine",
+)
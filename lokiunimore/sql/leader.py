@@ -0,0 +1,214 @@
+"""
+This module defines the election of a leader among replicas of the same process, so that only one of them acts at a time.
+"""
+
+import os
+import time
+import uuid
+import socket
+import asyncio
+import hashlib
+import logging
+import typing as t
+import sqlalchemy
+import sqlalchemy.exc
+import sqlalchemy.orm
+
+from lokiunimore.sql.tables import LeaderLease
+
+T = t.TypeVar("T")
+log = logging.getLogger(__name__)
+
+
+class LeadershipLostError(Exception):
+    """
+    The leadership was lost while acting as leader, such as because the database connection dropped or the lease could not be renewed in time.
+    """
+
+
+class LeaderElection:
+    """
+    Elects a single leader among the replicas sharing the same database and ``name``.
+
+    On PostgreSQL, leadership is a session-level advisory lock, which is released by the database as soon as the connection of the leader drops.
+    On other databases, it is a :class:`.LeaderLease` row, which the leader renews and other replicas can take over once it expires.
+    """
+
+    def __init__(self, sqla_engine: sqlalchemy.engine.Engine, name: str, lease_ttl: float = 15, poll_interval: float = 2):
+        """
+        :param sqla_engine: The engine of the database shared by the replicas.
+        :param name: The name of the group of replicas.
+        :param lease_ttl: The number of seconds after which the leadership of a replica which stopped renewing it can be taken over.
+        :param poll_interval: The number of seconds between two attempts to become leader, or to renew the leadership.
+        """
+
+        self.sqla_engine: sqlalchemy.engine.Engine = sqla_engine
+        self.name: str = name
+        self.lease_ttl: float = lease_ttl
+        self.poll_interval: float = min(poll_interval, lease_ttl / 3)
+        self.holder: str = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader: bool = False
+        self._lock_connection: sqlalchemy.engine.Connection | None = None
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {self.name!r} as {self.holder!r}{' (leader)' if self.is_leader else ''}>"
+
+    @property
+    def uses_advisory_lock(self) -> bool:
+        return self.sqla_engine.dialect.name == "postgresql"
+
+    @property
+    def lock_key(self) -> int:
+        """
+        The key of the PostgreSQL advisory lock, derived from :attr:`.name`.
+        """
+
+        return int.from_bytes(hashlib.sha256(self.name.encode("utf8")).digest()[:8], "big", signed=True)
+
+    def _try_lock(self) -> bool:
+        if self._lock_connection is None:
+            # Advisory locks belong to the connection, which must not be left idle in a transaction
+            self._lock_connection = self.sqla_engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            return self._lock_connection.execute(sqlalchemy.text("SELECT pg_try_advisory_lock(:key)"), {"key": self.lock_key}).scalar()
+        except sqlalchemy.exc.DBAPIError:
+            log.warning("Could not try to acquire the leadership of %s", self.name, exc_info=True)
+            self._unlock()
+            return False
+
+    def _check_lock(self) -> bool:
+        try:
+            self._lock_connection.execute(sqlalchemy.text("SELECT 1"))
+        except sqlalchemy.exc.DBAPIError:
+            log.warning("Lost the connection holding the leadership of %s", self.name, exc_info=True)
+            return False
+        return True
+
+    def _unlock(self) -> None:
+        if self._lock_connection is None:
+            return
+        try:
+            self._lock_connection.execute(sqlalchemy.text("SELECT pg_advisory_unlock(:key)"), {"key": self.lock_key})
+        except sqlalchemy.exc.DBAPIError:
+            pass
+        finally:
+            self._lock_connection.close()
+            self._lock_connection = None
+
+    def _try_lease(self) -> bool:
+        """
+        Acquire the lease if it is free or expired, or renew it if it is already held.
+        """
+
+        now = time.time()
+        with sqlalchemy.orm.Session(bind=self.sqla_engine) as session:
+            taken = session.execute(
+                sqlalchemy.update(LeaderLease)
+                .where(LeaderLease.name == self.name)
+                .where(sqlalchemy.or_(LeaderLease.holder == self.holder, LeaderLease.expires_at < now))
+                .values(holder=self.holder, expires_at=now + self.lease_ttl)
+            ).rowcount
+            if not taken:
+                if session.get(LeaderLease, self.name) is not None:
+                    return False
+                session.add(LeaderLease(name=self.name, holder=self.holder, expires_at=now + self.lease_ttl))
+            try:
+                session.commit()
+            except sqlalchemy.exc.IntegrityError:
+                # Another replica created the lease first
+                return False
+        return True
+
+    def _release_lease(self) -> None:
+        with sqlalchemy.orm.Session(bind=self.sqla_engine) as session:
+            session.execute(sqlalchemy.delete(LeaderLease).where(LeaderLease.name == self.name).where(LeaderLease.holder == self.holder))
+            session.commit()
+
+    def try_acquire(self) -> bool:
+        """
+        Try to become leader, or confirm that this replica still is.
+
+        .. warning:: Blocks; call it via :func:`asyncio.to_thread` from coroutines.
+
+        :return: Whether this replica is the leader.
+        """
+
+        if self.uses_advisory_lock:
+            self.is_leader = self._check_lock() if self.is_leader else self._try_lock()
+        else:
+            self.is_leader = self._try_lease()
+        return self.is_leader
+
+    def release(self) -> None:
+        """
+        Give up the leadership, allowing another replica to take over immediately.
+
+        .. warning:: Blocks; call it via :func:`asyncio.to_thread` from coroutines.
+        """
+
+        if self.uses_advisory_lock:
+            self._unlock()
+        elif self.is_leader:
+            self._release_lease()
+        self.is_leader = False
+
+    async def acquire(self) -> None:
+        """
+        Wait until this replica becomes leader.
+        """
+
+        log.info("Waiting for the leadership of %s as %s...", self.name, self.holder)
+        while not await asyncio.to_thread(self.try_acquire):
+            await asyncio.sleep(self.poll_interval)
+        log.info("Became leader of %s as %s", self.name, self.holder)
+
+    async def _keep(self) -> t.NoReturn:
+        """
+        Renew the leadership until it is lost.
+        """
+
+        renewed_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if await asyncio.to_thread(self.try_acquire):
+                    renewed_at = time.monotonic()
+                    continue
+            except sqlalchemy.exc.DBAPIError:
+                log.warning("Could not renew the leadership of %s", self.name, exc_info=True)
+                # Other replicas can't take over the lease until it expires, so keep acting until right before then
+                if not self.uses_advisory_lock and time.monotonic() - renewed_at < self.lease_ttl - self.poll_interval:
+                    continue
+
+            self.is_leader = False
+            raise LeadershipLostError(self.name)
+
+    async def lead(self, f: t.Callable[[], t.Awaitable[T]]) -> T:
+        """
+        Wait until this replica becomes leader, then run ``f`` while keeping the leadership.
+
+        :param f: The coroutine function to run as leader.
+        :return: Whatever ``f`` returned.
+        :raises LeadershipLostError: If the leadership was lost while running ``f``, in which case ``f`` is cancelled.
+        """
+
+        await self.acquire()
+        task = asyncio.create_task(f())
+        keeper = asyncio.create_task(self._keep())
+        try:
+            await asyncio.wait([task, keeper], return_when=asyncio.FIRST_COMPLETED)
+            if task.done():
+                return task.result()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return keeper.result()
+        finally:
+            task.cancel()
+            keeper.cancel()
+            await asyncio.to_thread(self.release)
+
+
+__all__ = (
+    "LeadershipLostError",
+    "LeaderElection",
+)
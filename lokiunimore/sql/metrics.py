@@ -0,0 +1,101 @@
+"""
+This module defines the metrics and the tracing of the queries sent to the database, and the metrics of the pools of connections to it.
+"""
+
+import time
+import sqlalchemy
+import sqlalchemy.event
+import sqlalchemy.pool
+
+from lokiunimore.utils.metrics import counter, gauge, histogram
+from lokiunimore.utils.tracing import tracer
+
+QUERY_SECONDS = histogram("loki_db_query_seconds", "Duration of the statements executed on the database, by their kind.", labels=("statement",))
+CONNECTIONS_OPENED_TOTAL = counter("loki_db_connections_opened_total", "Connections to the database opened by the pools of the process.")
+CONNECTIONS_CLOSED_TOTAL = counter("loki_db_connections_closed_total", "Connections to the database closed by the pools of the process.")
+CONNECTIONS_INVALIDATED_TOTAL = counter("loki_db_connections_invalidated_total", "Connections to the database found to be broken, such as by the ping before their checkout.")
+CONNECTIONS_CHECKED_OUT = gauge("loki_db_connections_checked_out", "Connections to the database currently checked out of the pools of the process.")
+CHECKOUTS_TOTAL = counter("loki_db_checkouts_total", "Checkouts of connections to the database from the pools of the process.")
+
+
+def _statement_kind(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "EMPTY"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # The context belongs to a single execution, so nothing is left behind if the statement fails
+    context.loki_started_at = time.perf_counter()
+    context.loki_span = tracer.start_span("db " + _statement_kind(statement))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = getattr(context, "loki_started_at", None)
+    if started_at is None:
+        return
+    QUERY_SECONDS.observe(time.perf_counter() - started_at, statement=_statement_kind(statement))
+    if (span := getattr(context, "loki_span", None)) is not None:
+        span.set_attribute("db.statement", statement)
+        span.end()
+
+
+def install_query_metrics() -> None:
+    """
+    Record the duration of the statements executed by every :class:`~sqlalchemy.engine.Engine` of the process in :data:`.QUERY_SECONDS`, and trace them as part of the current trace, if any.
+
+    Can be called multiple times.
+    """
+
+    if sqlalchemy.event.contains(sqlalchemy.engine.Engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    sqlalchemy.event.listen(sqlalchemy.engine.Engine, "before_cursor_execute", _before_cursor_execute)
+    sqlalchemy.event.listen(sqlalchemy.engine.Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _connect(dbapi_connection, connection_record):
+    CONNECTIONS_OPENED_TOTAL.inc()
+
+
+def _close(dbapi_connection, connection_record=None):
+    CONNECTIONS_CLOSED_TOTAL.inc()
+
+
+def _invalidate(dbapi_connection, connection_record, exception):
+    CONNECTIONS_INVALIDATED_TOTAL.inc()
+
+
+def _checkout(dbapi_connection, connection_record, connection_proxy):
+    CHECKOUTS_TOTAL.inc()
+    CONNECTIONS_CHECKED_OUT.inc()
+
+
+def _checkin(dbapi_connection, connection_record):
+    CONNECTIONS_CHECKED_OUT.inc(-1)
+
+
+def install_pool_metrics() -> None:
+    """
+    Record how the connection pools of every :class:`~sqlalchemy.engine.Engine` of the process open, close and lend their connections, so that connection churn can be told apart from queries.
+
+    Can be called multiple times.
+    """
+
+    if sqlalchemy.event.contains(sqlalchemy.pool.Pool, "connect", _connect):
+        return
+    sqlalchemy.event.listen(sqlalchemy.pool.Pool, "connect", _connect)
+    sqlalchemy.event.listen(sqlalchemy.pool.Pool, "close", _close)
+    sqlalchemy.event.listen(sqlalchemy.pool.Pool, "close_detached", _close)
+    sqlalchemy.event.listen(sqlalchemy.pool.Pool, "invalidate", _invalidate)
+    sqlalchemy.event.listen(sqlalchemy.pool.Pool, "checkout", _checkout)
+    sqlalchemy.event.listen(sqlalchemy.pool.Pool, "checkin", _checkin)
+
+
+__all__ = (
+    "QUERY_SECONDS",
+    "CONNECTIONS_OPENED_TOTAL",
+    "CONNECTIONS_CLOSED_TOTAL",
+    "CONNECTIONS_INVALIDATED_TOTAL",
+    "CONNECTIONS_CHECKED_OUT",
+    "CHECKOUTS_TOTAL",
+    "install_query_metrics",
+    "install_pool_metrics",
+)
@@ -0,0 +1,113 @@
+"""
+This module defines the routing of read-only queries to read replicas of the database, so that reads can scale independently of the writes.
+"""
+
+import random
+import logging
+import typing as t
+import sqlalchemy
+import sqlalchemy.engine
+import sqlalchemy.orm
+import sqlalchemy.sql
+
+from lokiunimore.sql.engine import create_engine
+
+log = logging.getLogger(__name__)
+
+
+class ReplicaSet:
+    """
+    The engines of the read replicas of the database, which are created only once configured.
+    """
+
+    def __init__(self):
+        self.engines: list[sqlalchemy.engine.Engine] = []
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} of {len(self.engines)} replicas>"
+
+    def __bool__(self):
+        return bool(self.engines)
+
+    def configure(self, urls: t.Iterable[str | sqlalchemy.engine.URL]) -> None:
+        """
+        Create an engine for each replica, replacing the existing ones.
+
+        :param urls: The URLs of the replicas.
+        """
+
+        self.dispose()
+        self.engines = [create_engine(url) for url in urls]
+        log.debug("Configured %s", self)
+
+    def pick(self) -> sqlalchemy.engine.Engine | None:
+        """
+        :return: The engine of a random replica, spreading the reads evenly among them, or :data:`None` if there are no replicas.
+        """
+
+        return random.choice(self.engines) if self.engines else None
+
+    def dispose(self, close: bool = True) -> None:
+        """
+        Dispose the pools of all replicas.
+
+        :param close: Whether to close the connections in the pools, or to only discard them, such as after a fork.
+        """
+
+        for engine in self.engines:
+            engine.dispose(close=close)
+
+
+class RoutingSession(sqlalchemy.orm.Session):
+    """
+    A :class:`~sqlalchemy.orm.Session` sending its read-only queries to a replica while :attr:`.read_from_replicas` is set, and everything else to the primary database.
+
+    Once the session writes anything, all its following queries are sent to the primary as well, so that it reads its own writes.
+    """
+
+    def __init__(self, *args, replicas: ReplicaSet | None = None, **kwargs):
+        """
+        :param replicas: The replicas to send the read-only queries to.
+        """
+
+        super().__init__(*args, **kwargs)
+
+        self.replicas: ReplicaSet = replicas if replicas is not None else ReplicaSet()
+        """
+        The replicas to send the read-only queries to.
+        """
+
+        self.read_from_replicas: bool = False
+        """
+        Whether read-only queries should be sent to a replica; off by default, as only the caller knows whether reading slightly stale data is acceptable.
+        """
+
+        self.wrote: bool = False
+        """
+        Whether the session has sent anything but a read-only query to the primary.
+        """
+
+        self.used_replica: bool = False
+        """
+        Whether any query of the session has been sent to a replica.
+        """
+
+    @staticmethod
+    def _is_read_only(clause) -> bool:
+        # Locking rows only works on the primary, and would be pointless anywhere else
+        return isinstance(clause, sqlalchemy.sql.Select) and clause._for_update_arg is None
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or (clause is not None and not self._is_read_only(clause)):
+                self.wrote = True
+            elif clause is not None and self.read_from_replicas and not self.wrote and (replica := self.replicas.pick()) is not None:
+                self.used_replica = True
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+__all__ = (
+    "ReplicaSet",
+    "RoutingSession",
+)
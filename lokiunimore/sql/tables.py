@@ -1,8 +1,8 @@
 import sqlalchemy as s
 import sqlalchemy.orm as o
+import time
 import secrets
 import logging
-import flask
 
 log = logging.getLogger(__name__)
 
@@ -12,6 +12,59 @@ Base = o.declarative_base()
 The declarative base of all the SQL tables.
 """
 
+DEFAULT_COMMUNITY_ID = "default"
+"""
+The id of the `.Community` configured via environment variables, which doesn't need a row in the database.
+"""
+
+
+class Community(Base):
+    """
+    A pair of Matrix spaces gated by Loki: anybody can join the public one, but only users who verified their identity can join the private one.
+
+    Besides the one configured via environment variables, which has `.DEFAULT_COMMUNITY_ID` as id, any number of communities can be added to this table.
+    """
+
+    __tablename__ = "communities"
+
+    id = s.Column(s.String, primary_key=True)
+    """
+    A short identifier of the community, such as ``unimore``.
+    """
+
+    name = s.Column(s.String, nullable=False)
+    """
+    The name of the community, displayed to the users.
+    """
+
+    public_space_id = s.Column(s.String, nullable=False, unique=True)
+    """
+    The id of the public space of the community.
+    """
+
+    private_space_id = s.Column(s.String, nullable=False, unique=True)
+    """
+    The id of the private space of the community.
+    """
+
+    help_room_alias = s.Column(s.String, nullable=False)
+    """
+    The alias of the room users of the community can request assistance in.
+    """
+
+    email_regex = s.Column(s.String, nullable=False)
+    """
+    The regex the email of an account must match to be linked to a `.MatrixUser` of this community.
+    """
+
+    messages = s.Column(s.JSON, nullable=False, default=dict)
+    """
+    The Matrix messages of :mod:`lokiunimore.matrix.templates.messages` to replace for this community, by name, such as ``{"WELCOME_MESSAGE_TEXT": "..."}``.
+    """
+
+    def __repr__(self):
+        return f"{self.__class__.__qualname__}(id={self.id!r}, public_space_id={self.public_space_id!r}, private_space_id={self.private_space_id!r})"
+
 
 class Account(Base):
     """
@@ -69,6 +122,11 @@ class MatrixUser(Base):
     The Matrix id of the user, such as ``@steffo:ryg.one``.
     """
 
+    community_id = s.Column(s.String, primary_key=True, default=DEFAULT_COMMUNITY_ID, server_default=DEFAULT_COMMUNITY_ID)
+    """
+    The id of the `.Community` whose spaces the user is a member of; the same Matrix user has a separate `.MatrixUser` for each community.
+    """
+
     token = s.Column(s.String, nullable=False, default=secrets.token_urlsafe)
     """
     A secure token that the user can use to access their account.
@@ -89,21 +147,27 @@ class MatrixUser(Base):
     The account linked with this Matrix user.
     """
 
+    bulk_invite = o.relationship("MatrixBulkInvite", back_populates="matrix_user", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
+    """
+    The result of the last attempt to invite this Matrix user to the private space via :mod:`lokiunimore.matrix.invite`.
+    """
+
     def __repr__(self):
-        return f"{self.__class__.__qualname__}(id={self.id!r}, token={self.token!r}, account_email={self.account_email!r}, joined_private_space={self.joined_private_space!r})"
+        return f"{self.__class__.__qualname__}(id={self.id!r}, community_id={self.community_id!r}, token={self.token!r}, account_email={self.account_email!r}, joined_private_space={self.joined_private_space!r})"
 
     @classmethod
-    def create(cls, session: o.Session, id: str) -> "MatrixUser":
+    def create(cls, session: o.Session, id: str, community_id: str = DEFAULT_COMMUNITY_ID) -> "MatrixUser":
         """
         Create a `.MatrixUser` in the database for the given Matrix user ID.
 
         :param session: The `sqlalchemy.orm.Session` to use.
         :param id: The user ID to create an account for.
+        :param community_id: The id of the `.Community` the user joined.
         :return: The created `.MatrixUser`.
         """
 
         log.debug("Creating MatrixUser for %s", id)
-        matrix_user = MatrixUser(id=id)
+        matrix_user = MatrixUser(id=id, community_id=community_id)
         matrix_user = session.merge(matrix_user)
         log.debug("Created MatrixUser for %s", id)
         return matrix_user
@@ -147,6 +211,8 @@ class MatrixUser(Base):
             session.delete(self.account)
         self.account = None
         self.joined_private_space = False
+        # If the user links again, they should be invited again
+        self.bulk_invite = None
         log.debug("Unlinked MatrixUser %s from Account %s", self.id, account_email)
 
     def profile_url(self) -> str:
@@ -159,9 +225,53 @@ class MatrixUser(Base):
         :return: The URL to this `.MatrixUser`'s profile.
         """
 
+        # Imported here, so that the tables can be used without importing the web stack
+        import flask
+
         return flask.url_for("page_matrix_profile", token=self.token)
 
 
+class MatrixBulkInvite(Base):
+    """
+    The result of an attempt to invite a linked `.MatrixUser` to the private space, performed by :mod:`lokiunimore.matrix.invite`.
+
+    Successful attempts are not repeated when the bulk invite is resumed.
+    """
+
+    __tablename__ = "matrix_bulk_invites"
+    __table_args__ = (
+        s.ForeignKeyConstraint(["matrix_user_id", "community_id"], ["matrix_users.id", "matrix_users.community_id"], ondelete="CASCADE"),
+    )
+
+    matrix_user_id = s.Column(s.String, primary_key=True)
+    """
+    The id of the invited `.MatrixUser`.
+    """
+
+    community_id = s.Column(s.String, primary_key=True, default=DEFAULT_COMMUNITY_ID, server_default=DEFAULT_COMMUNITY_ID)
+    """
+    The community of the invited `.MatrixUser`.
+    """
+
+    attempted_at = s.Column(s.Float, nullable=False)
+    """
+    The UNIX timestamp of the moment the invite was attempted at.
+    """
+
+    error = s.Column(s.String)
+    """
+    If the invite failed, a description of the error.
+    """
+
+    matrix_user = o.relationship("MatrixUser", back_populates="bulk_invite")
+    """
+    The invited `.MatrixUser`.
+    """
+
+    def __repr__(self):
+        return f"{self.__class__.__qualname__}(matrix_user_id={self.matrix_user_id!r}, community_id={self.community_id!r}, attempted_at={self.attempted_at!r}, error={self.error!r})"
+
+
 class TelegramUser(Base):
     """
     A Telegram user, which may or may not be linked to an account.
@@ -186,11 +296,26 @@ class TelegramUser(Base):
     If the user linked a OpenID Connect account, its email.
     """
 
+    joined_private_group = s.Column(s.Boolean, nullable=False, default=False)
+    """
+    Whether this specific Telegram user has joined any of the private Telegram groups monitored by Loki; see `.private_memberships` for which ones.
+    """
+
     account = o.relationship("Account", back_populates="telegram_users")
     """
     The account linked with this Telegram user.
     """
 
+    invite_links = o.relationship("TelegramInviteLink", back_populates="telegram_user")
+    """
+    The invite links to the private Telegram groups handed out to this Telegram user.
+    """
+
+    private_memberships = o.relationship("TelegramPrivateMembership", back_populates="telegram_user", cascade="all, delete-orphan")
+    """
+    The private Telegram groups this Telegram user is a member of.
+    """
+
     def __repr__(self):
         return f"{self.__class__.__qualname__}(id={self.id!r}, token={self.token!r}, account_email={self.account_email!r}, joined_private_group={self.joined_private_group!r})"
 
@@ -248,6 +373,7 @@ class TelegramUser(Base):
         if self.account is not None and self.account.users_count() == 1:
             session.delete(self.account)
         self.account = None
+        self.joined_private_group = False
         log.debug("Unlinked TelegramUser %s from Account %s", self.id, account_email)
 
     def profile_url(self) -> str:
@@ -260,8 +386,142 @@ class TelegramUser(Base):
         :return: The URL to this `.MatrixUser`'s profile.
         """
 
+        import flask
+
         return flask.url_for("page_telegram_profile", token=self.token)
 
+    def join_private_group(self, chat_id: int) -> None:
+        """
+        Record that the `.TelegramUser` has joined a private group.
+
+        :param chat_id: The marked id of the group.
+        """
+
+        if all(membership.chat_id != chat_id for membership in self.private_memberships):
+            self.private_memberships.append(TelegramPrivateMembership(chat_id=chat_id))
+        self.joined_private_group = True
+
+    def leave_private_group(self, chat_id: int) -> None:
+        """
+        Record that the `.TelegramUser` has left a private group, marking it as not joined only if it isn't a member of any other.
+
+        :param chat_id: The marked id of the group.
+        """
+
+        self.private_memberships = [membership for membership in self.private_memberships if membership.chat_id != chat_id]
+        self.joined_private_group = bool(self.private_memberships)
+
+    def claim_invite_links(self, session: o.Session, chat_ids: list[int]) -> list["TelegramInviteLink"]:
+        """
+        Get the invite links handed out to this `.TelegramUser` for the given chats, handing out new ones from the pool if necessary.
+
+        :param session: The `sqlalchemy.orm.Session` to use.
+        :param chat_ids: The marked ids of the chats to get links for.
+        :return: The links, or an empty list if the pool didn't have links available for all the chats, in which case no new link is handed out.
+        """
+
+        now = time.time()
+        links = {link.chat_id: link for link in self.invite_links if link.expires_at > now}
+
+        claimed = {}
+        for chat_id in chat_ids:
+            if chat_id in links:
+                continue
+
+            link: TelegramInviteLink | None = (
+                session.query(TelegramInviteLink)
+                .filter_by(chat_id=chat_id, assigned_at=None)
+                .filter(TelegramInviteLink.expires_at > now)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if link is None:
+                # Handing out the links of the other chats would only take them out of the pool, as they are never shown
+                log.warning("Invite link pool of chat %s is empty", chat_id)
+                return []
+            claimed[chat_id] = link
+
+        for chat_id, link in claimed.items():
+            log.debug("Handing out invite link of chat %s to TelegramUser %s", chat_id, self.id)
+            link.telegram_user = self
+            link.assigned_at = now
+            links[chat_id] = link
+
+        return [links[chat_id] for chat_id in chat_ids]
+
+
+class TelegramInviteLink(Base):
+    """
+    A single-use invite link to a private Telegram group, pre-generated by the bot and handed out to a `.TelegramUser` when needed.
+    """
+
+    __tablename__ = "telegram_invite_links"
+
+    link = s.Column(s.String, primary_key=True)
+    """
+    The invite link itself, such as ``https://t.me/+AbCdEfGhIjKlMnOp``.
+    """
+
+    chat_id = s.Column(s.BigInteger, nullable=False, index=True)
+    """
+    The marked id of the chat the link is for.
+    """
+
+    chat_title = s.Column(s.String, nullable=False)
+    """
+    The title of the chat the link is for.
+    """
+
+    expires_at = s.Column(s.Float, nullable=False)
+    """
+    The UNIX timestamp of the moment the link stops working at.
+    """
+
+    telegram_user_id = s.Column(s.BigInteger, s.ForeignKey("telegram_users.id", ondelete="SET NULL"))
+    """
+    If the link was handed out, the id of the `.TelegramUser` it was handed out to.
+    """
+
+    assigned_at = s.Column(s.Float)
+    """
+    If the link was handed out, the UNIX timestamp of the moment it was handed out at.
+    """
+
+    telegram_user = o.relationship("TelegramUser", back_populates="invite_links")
+    """
+    The `.TelegramUser` the link was handed out to.
+    """
+
+    def __repr__(self):
+        return f"{self.__class__.__qualname__}(link={self.link!r}, chat_id={self.chat_id!r}, telegram_user_id={self.telegram_user_id!r}, assigned_at={self.assigned_at!r})"
+
+
+class TelegramPrivateMembership(Base):
+    """
+    The membership of a `.TelegramUser` in one of the private Telegram groups monitored by Loki.
+    """
+
+    __tablename__ = "telegram_private_memberships"
+
+    telegram_user_id = s.Column(s.BigInteger, s.ForeignKey("telegram_users.id", ondelete="CASCADE"), primary_key=True)
+    """
+    The id of the `.TelegramUser` member of the group.
+    """
+
+    chat_id = s.Column(s.BigInteger, primary_key=True)
+    """
+    The marked id of the group.
+    """
+
+    telegram_user = o.relationship("TelegramUser", back_populates="private_memberships")
+    """
+    The `.TelegramUser` member of the group.
+    """
+
+    def __repr__(self):
+        return f"{self.__class__.__qualname__}(telegram_user_id={self.telegram_user_id!r}, chat_id={self.chat_id!r})"
+
 
 class MatrixProcessedEvent(Base):
     """
@@ -276,10 +536,150 @@ class MatrixProcessedEvent(Base):
     """
 
 
+class MatrixMembershipJob(Base):
+    """
+    A membership change of a Matrix space, written by the Matrix bot when queueing is enabled, and waiting to be handled by a worker of :mod:`lokiunimore.matrix.worker`.
+    """
+
+    __tablename__ = "matrix_membership_jobs"
+
+    id = s.Column(s.BigInteger().with_variant(s.Integer, "sqlite"), primary_key=True, autoincrement=True)
+    """
+    The position of the job in the queue.
+    """
+
+    event_id = s.Column(s.String, nullable=False, unique=True)
+    """
+    The id of the membership event the job was created from.
+    """
+
+    room_id = s.Column(s.String, nullable=False)
+    """
+    The id of the room whose membership changed.
+    """
+
+    user_id = s.Column(s.String, nullable=False)
+    """
+    The id of the user whose membership changed.
+    """
+
+    membership = s.Column(s.String, nullable=False)
+    """
+    The new membership of the user, such as ``join``.
+    """
+
+    prev_membership = s.Column(s.String)
+    """
+    The previous membership of the user, if any.
+    """
+
+    partition = s.Column(s.Integer, nullable=False, index=True)
+    """
+    The partition of the job, derived from `.user_id`, so that the jobs of each user are handled in order by a single worker at a time.
+    """
+
+    attempts = s.Column(s.Integer, nullable=False, default=0)
+    """
+    The number of failed attempts to handle the job.
+    """
+
+    available_at = s.Column(s.Float, nullable=False)
+    """
+    The UNIX timestamp of the moment the job may be attempted at.
+    """
+
+    def __repr__(self):
+        return f"{self.__class__.__qualname__}(id={self.id!r}, room_id={self.room_id!r}, user_id={self.user_id!r}, membership={self.membership!r}, attempts={self.attempts!r})"
+
+
+class MatrixMembershipPartition(Base):
+    """
+    A partition of the `.MatrixMembershipJob`\\ s, whose row is locked by the worker handling its jobs.
+    """
+
+    __tablename__ = "matrix_membership_partitions"
+
+    partition = s.Column(s.Integer, primary_key=True, autoincrement=False)
+    """
+    The number of the partition.
+    """
+
+    handled_at = s.Column(s.Float, nullable=False, default=0)
+    """
+    The UNIX timestamp of the last time a worker handled jobs of this partition, to claim partitions in a round-robin.
+    """
+
+    def __repr__(self):
+        return f"{self.__class__.__qualname__}(partition={self.partition!r}, handled_at={self.handled_at!r})"
+
+
+class OIDCCachedDocument(Base):
+    """
+    A JSON document fetched from the OpenID Connect identity provider, such as its discovery document or its signing keys.
+
+    Cached in the database so that it can be shared by all the processes serving the web app.
+    """
+
+    __tablename__ = "oidc_cached_documents"
+
+    url = s.Column(s.String, primary_key=True)
+    """
+    The URL the document was fetched from.
+    """
+
+    content = s.Column(s.JSON, nullable=False)
+    """
+    The parsed contents of the document.
+    """
+
+    fetched_at = s.Column(s.Float, nullable=False)
+    """
+    The UNIX timestamp of the moment the document was fetched at.
+    """
+
+    def __repr__(self):
+        return f"{self.__class__.__qualname__}(url={self.url!r}, fetched_at={self.fetched_at!r})"
+
+
+class LeaderLease(Base):
+    """
+    A lease on the leadership of a group of replicas, used by :class:`~lokiunimore.sql.leader.LeaderElection` on databases without advisory locks.
+    """
+
+    __tablename__ = "leader_leases"
+
+    name = s.Column(s.String, primary_key=True)
+    """
+    The name of the group of replicas, such as ``matrix``.
+    """
+
+    holder = s.Column(s.String, nullable=False)
+    """
+    The identifier of the replica holding the lease.
+    """
+
+    expires_at = s.Column(s.Float, nullable=False)
+    """
+    The UNIX timestamp of the moment the lease expires at, unless renewed by its holder.
+    """
+
+    def __repr__(self):
+        return f"{self.__class__.__qualname__}(name={self.name!r}, holder={self.holder!r}, expires_at={self.expires_at!r})"
+
+
 __all__ = (
     "Base",
+    "DEFAULT_COMMUNITY_ID",
+    "Community",
     "Account",
     "MatrixUser",
+    "MatrixBulkInvite",
     "TelegramUser",
+    "TelegramInviteLink",
+    "TelegramPrivateMembership",
     "MatrixProcessedEvent",
+    "MatrixMembershipJob",
+    "MatrixMembershipPartition",
+    "OIDCCachedDocument",
+    "LeaderLease",
 )
@@ -0,0 +1,131 @@
+"""
+This module upgrades the tables created by earlier versions of :mod:`lokiunimore`, which :meth:`~sqlalchemy.schema.MetaData.create_all` leaves as they are.
+
+Run :mod:`lokiunimore.sql` to upgrade the outdated tables and create the missing ones::
+
+    python -m lokiunimore.sql
+"""
+
+import logging
+import sqlalchemy
+import sqlalchemy.engine
+
+from lokiunimore.sql.tables import MatrixUser, MatrixBulkInvite, DEFAULT_COMMUNITY_ID
+
+log = logging.getLogger(__name__)
+
+
+SCOPED_TABLES = (MatrixUser.__table__, MatrixBulkInvite.__table__)
+"""
+The tables whose primary key includes the ``community_id`` column since communities were introduced.
+"""
+
+
+class OutdatedSchemaError(RuntimeError):
+    """
+    The database contains tables created by an earlier version of :mod:`lokiunimore`, which need to be upgraded with :func:`.upgrade_schema`.
+    """
+
+
+def outdated_tables(connection: sqlalchemy.engine.Connection) -> list[str]:
+    """
+    :param connection: The connection to the database to inspect.
+    :return: The names of the tables of :data:`.SCOPED_TABLES` which exist but don't have a ``community_id`` column yet.
+    """
+
+    inspector = sqlalchemy.inspect(connection)
+    outdated = []
+    for table in SCOPED_TABLES:
+        if not inspector.has_table(table.name):
+            continue
+        if "community_id" not in {column["name"] for column in inspector.get_columns(table.name)}:
+            outdated.append(table.name)
+    return outdated
+
+
+def check_schema(engine: sqlalchemy.engine.Engine) -> None:
+    """
+    Make sure that the tables of the database can be used by this version of :mod:`lokiunimore`.
+
+    :param engine: The engine of the database to check.
+    :raises OutdatedSchemaError: If any table needs to be upgraded.
+    """
+
+    with engine.connect() as connection:
+        if outdated := outdated_tables(connection):
+            raise OutdatedSchemaError(f"The tables {', '.join(outdated)} were created by an earlier version of lokiunimore, upgrade them by running: python -m lokiunimore.sql")
+
+
+def _upgrade_by_altering(connection: sqlalchemy.engine.Connection, outdated: list[str]) -> None:
+    inspector = sqlalchemy.inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    default = f"'{DEFAULT_COMMUNITY_ID}'"
+
+    # The foreign key of the bulk invites must be dropped first, as it depends on the primary key of the users
+    invites = MatrixBulkInvite.__table__.name
+    if invites in outdated:
+        for foreign_key in inspector.get_foreign_keys(invites):
+            connection.execute(sqlalchemy.text(f"ALTER TABLE {invites} DROP CONSTRAINT {preparer.quote(foreign_key['name'])}"))
+
+    for table in SCOPED_TABLES:
+        if table.name not in outdated:
+            continue
+        primary_key = inspector.get_pk_constraint(table.name)
+        columns = ", ".join(column.name for column in table.primary_key.columns)
+        connection.execute(sqlalchemy.text(f"ALTER TABLE {table.name} ADD COLUMN community_id VARCHAR DEFAULT {default} NOT NULL"))
+        connection.execute(sqlalchemy.text(f"ALTER TABLE {table.name} DROP CONSTRAINT {preparer.quote(primary_key['name'])}"))
+        connection.execute(sqlalchemy.text(f"ALTER TABLE {table.name} ADD PRIMARY KEY ({columns})"))
+
+    if invites in outdated:
+        connection.execute(sqlalchemy.text(
+            f"ALTER TABLE {invites} ADD FOREIGN KEY (matrix_user_id, community_id) "
+            f"REFERENCES {MatrixUser.__table__.name} (id, community_id) ON DELETE CASCADE"
+        ))
+
+
+def _upgrade_by_copying(connection: sqlalchemy.engine.Connection, outdated: list[str]) -> None:
+    # SQLite can't change the primary key of a table, so the tables are created anew and their rows copied over
+    tables = [table for table in SCOPED_TABLES if table.name in outdated]
+    inspector = sqlalchemy.inspect(connection)
+    copied_columns = {table.name: [column["name"] for column in inspector.get_columns(table.name)] for table in tables}
+
+    for table in tables:
+        connection.execute(sqlalchemy.text(f"ALTER TABLE {table.name} RENAME TO {table.name}_outdated"))
+    MatrixUser.metadata.create_all(bind=connection, tables=tables)
+    for table in tables:
+        columns = ", ".join(copied_columns[table.name])
+        connection.execute(sqlalchemy.text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_outdated"))
+    # Bulk invites first, as they refer to the users
+    for table in reversed(tables):
+        connection.execute(sqlalchemy.text(f"DROP TABLE {table.name}_outdated"))
+
+
+def upgrade_schema(engine: sqlalchemy.engine.Engine) -> list[str]:
+    """
+    Upgrade the outdated tables in a single transaction, assigning their rows to the default community.
+
+    :param engine: The engine of the database to upgrade.
+    :return: The names of the upgraded tables.
+    """
+
+    with engine.begin() as connection:
+        if not (outdated := outdated_tables(connection)):
+            return []
+
+        log.info("Upgrading the tables %s", ", ".join(outdated))
+        if connection.dialect.name == "sqlite":
+            _upgrade_by_copying(connection, outdated)
+        else:
+            _upgrade_by_altering(connection, outdated)
+        log.info("Upgraded the tables %s", ", ".join(outdated))
+
+    return outdated
+
+
+__all__ = (
+    "SCOPED_TABLES",
+    "OutdatedSchemaError",
+    "outdated_tables",
+    "check_schema",
+    "upgrade_schema",
+)
@@ -1,66 +1,39 @@
-import logging
-import telethon.sync
-import sqlalchemy.orm
+import asyncio
 
-from lokiunimore.config import config, TELEGRAM_APP_ID, TELEGRAM_APP_HASH, TELEGRAM_BOT_TOKEN, SQLALCHEMY_DATABASE_URL
+from lokiunimore.config import LOKI_METRICS_BIND, LOKI_PROFILE_DIR, LOKI_LOOP_LAG_THRESHOLD, TELEGRAM_APP_ID, TELEGRAM_APP_HASH, TELEGRAM_BOT_TOKEN
+from lokiunimore.config.snapshot import get_snapshot
 from lokiunimore.utils.logs import install_log_handler
-from lokiunimore.sql.tables import TelegramUser
-from lokiunimore.web.app import app
-from .templates import messages
-
-log = logging.getLogger(__name__)
+from lokiunimore.utils.metrics import serve_metrics
+from lokiunimore.utils.profiling import install_profiling
+from lokiunimore.telegram.client import LokiTelegramClient
+from lokiunimore.web.app import create_app, shared_engine
 
 
 def main():
     install_log_handler()
-    client: telethon.sync.TelegramClient = telethon.sync.TelegramClient(
-        session="bot",
-        api_id=TELEGRAM_APP_ID.__wrapped__,
-        api_hash=TELEGRAM_APP_HASH.__wrapped__,
-    ).start(
-        bot_token=TELEGRAM_BOT_TOKEN.__wrapped__,
-    )
-
-    sqla_engine = sqlalchemy.create_engine(SQLALCHEMY_DATABASE_URL.__wrapped__)
-
-    def sqla_session():
-        return sqlalchemy.orm.Session(bind=sqla_engine)
-
-    @client.on(telethon.events.NewMessage(pattern="^[/]start"))
-    async def on_start(event: telethon.events.NewMessage.Event):
-        if not event.is_private:
-            await client.send_message(
-                entity=event.chat_id,
-                reply_to=event.message.id,
-                message=messages.START_ONLY_PRIVATE_CHAT
-            )
-            return
-
-        user_id = event.chat_id
-        with sqla_session() as session:
-            telegram_user: TelegramUser = TelegramUser.create(session=session, id=user_id)
-            session.commit()
-
-            with app.app_context():
-                user = await client.get_me()
-                formatting = dict(
-                    username=user.username,
-                    profile_url=telegram_user.profile_url(),
-                )
-
-        await client.send_message(
-            entity=event.chat_id,
-            reply_to=event.message.id,
-            message=messages.START_SUCCESSFUL.format(**formatting)
+    create_app()
+    sqla_engine = shared_engine()
+    if bind := LOKI_METRICS_BIND.__wrapped__:
+        serve_metrics(bind)
+
+    async def run():
+        install_profiling(output_dir=LOKI_PROFILE_DIR.__wrapped__, lag_threshold=LOKI_LOOP_LAG_THRESHOLD.__wrapped__)
+        # The client must be created inside the event loop it is going to run in
+        client = LokiTelegramClient(
+            session="bot",
+            api_id=TELEGRAM_APP_ID.__wrapped__,
+            api_hash=TELEGRAM_APP_HASH.__wrapped__,
+            sqla_engine=sqla_engine,
         )
 
-    @client.on(telethon.events.ChatAction())
-    async def on_join(event: telethon.events.ChatAction.Event):
-        breakpoint()
+        try:
+            await client.run_bot(TELEGRAM_BOT_TOKEN.__wrapped__)
+        finally:
+            await client.disconnect()
 
-    client.run_until_disconnected()
+    asyncio.run(run())
 
 
 if __name__ == "__main__":
-    config.proxies.resolve()
+    get_snapshot()
     main()
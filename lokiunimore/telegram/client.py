@@ -0,0 +1,278 @@
+"""
+This module defines a custom :mod:`telethon` client with the functions we need to run :mod:`lokiunimore`.
+"""
+
+import asyncio
+import contextlib
+import logging
+import typing as t
+import telethon
+import telethon.errors
+import telethon.tl.types
+import sqlalchemy
+import sqlalchemy.orm
+
+from lokiunimore.sql.tables import TelegramUser, TelegramInviteLink
+from lokiunimore.sql.engine import create_engine
+from lokiunimore.config import TELEGRAM_PUBLIC_CHAT_ID, TELEGRAM_PRIVATE_CHAT_IDS, TELEGRAM_INVITE_POOL_SIZE
+from lokiunimore.utils.ratelimit import RateLimiter
+from lokiunimore.web.app import app
+from lokiunimore.telegram.templates import messages
+from lokiunimore.telegram.membership import MembershipChange, MembershipBatcher
+from lokiunimore.telegram.invites import InviteLinkPool
+
+T = t.TypeVar("T")
+log = logging.getLogger(__name__)
+
+
+class LokiTelegramClient(telethon.TelegramClient):
+    """
+    A :class:`telethon.TelegramClient` running the :mod:`lokiunimore` Telegram bot.
+
+    Database access is blocking, so it is always performed in a worker thread via :meth:`._run_in_thread`, never on the event loop.
+    """
+
+    def __init__(self, *args, database_url: str | None = None, sqla_engine: sqlalchemy.engine.Engine | None = None, **kwargs):
+        """
+        :param database_url: The URL of the database to create an engine for, if ``sqla_engine`` isn't given.
+        :param sqla_engine: An existing engine to use, so that its connection pool can be shared with other components running in the same process.
+        """
+
+        super().__init__(*args, **kwargs)
+
+        self.sqla_engine: sqlalchemy.engine.Engine = sqla_engine if sqla_engine is not None else create_engine(database_url)
+        """
+        The :mod:`sqlalchemy` :class:`~sqlalchemy.engine.Engine` associated with this client.
+        """
+
+        self.me: telethon.tl.types.User | None = None
+        """
+        The user of the bot itself, retrieved once by :meth:`.login_bot`.
+        """
+
+        self.membership_batcher: MembershipBatcher = MembershipBatcher(process=self._process_membership_changes)
+        """
+        The :class:`.MembershipBatcher` buffering the joins and leaves of the monitored groups.
+        """
+
+        self.kick_limiter: RateLimiter = RateLimiter(rate=5, burst=10)
+        """
+        The :class:`.RateLimiter` spacing out the kicks, to avoid running into flood waits.
+        """
+
+        self.invite_pool: InviteLinkPool = InviteLinkPool(
+            client=self,
+            chat_ids=TELEGRAM_PRIVATE_CHAT_IDS.__wrapped__,
+            size=TELEGRAM_INVITE_POOL_SIZE.__wrapped__,
+        )
+        """
+        The :class:`.InviteLinkPool` of the single-use invite links to the private groups.
+        """
+
+        self.add_event_handler(self.__handle_start, telethon.events.NewMessage(pattern="^[/]start"))
+        self.add_event_handler(self.__handle_chat_action, telethon.events.ChatAction())
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} for {self.me.username if self.me else None}>"
+
+    async def login_bot(self, bot_token: str) -> None:
+        """
+        Login as a bot, and cache its own user.
+
+        :param bot_token: The token of the bot to login as.
+        """
+
+        log.debug("Logging in to Telegram as a bot...")
+        await self.start(bot_token=bot_token)
+        self.me = await self.get_me()
+        log.debug("Login successful as: %s", self.me.username)
+
+    async def run_bot(self, bot_token: str) -> None:
+        """
+        Login as a bot, then process updates until disconnected.
+
+        :param bot_token: The token of the bot to login as.
+        """
+
+        await self.login_bot(bot_token)
+        await self.serve()
+
+    async def serve(self) -> None:
+        """
+        Process updates and run the background jobs until disconnected.
+
+        Requires :meth:`.login_bot` to have been called.
+        """
+
+        tasks = [asyncio.create_task(self.membership_batcher.run())]
+        if self.invite_pool.chat_ids and self.invite_pool.size > 0:
+            tasks.append(asyncio.create_task(self.invite_pool.run()))
+        try:
+            await self.run_until_disconnected()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @contextlib.contextmanager
+    def _sqla_session(self) -> t.Generator[sqlalchemy.orm.Session, None, None]:
+        """
+        Open a new :mod:`sqlalchemy` :class:`~sqlalchemy.orm.Session` using this object's :attr:`.sqla_engine` via a context manager interface.
+
+        .. warning:: Blocks; use it only inside :meth:`._run_in_thread`.
+        """
+
+        with sqlalchemy.orm.Session(bind=self.sqla_engine) as session:
+            yield session
+
+    @staticmethod
+    async def _run_in_thread(f: t.Callable[..., T], *args, **kwargs) -> T:
+        """
+        Run a blocking function in a worker thread, so that the event loop can keep processing updates in the meantime.
+        """
+
+        return await asyncio.to_thread(f, *args, **kwargs)
+
+    def _create_user(self, user_id: int) -> str:
+        """
+        Create a :class:`.TelegramUser` for the given user id, if it doesn't exist yet.
+
+        :param user_id: The Telegram id of the user.
+        :return: The URL of the profile of the user.
+        """
+
+        with self._sqla_session() as session:
+            telegram_user: TelegramUser = TelegramUser.create(session=session, id=user_id)
+            session.commit()
+
+            with app.app_context():
+                return telegram_user.profile_url()
+
+    async def __handle_start(self, event: telethon.events.NewMessage.Event):
+        if not event.is_private:
+            await self.send_message(
+                entity=event.chat_id,
+                reply_to=event.message.id,
+                message=messages.START_ONLY_PRIVATE_CHAT
+            )
+            return
+
+        user_id = event.chat_id
+        log.debug("Received /start from: %s", user_id)
+        profile_url = await self._run_in_thread(self._create_user, user_id)
+
+        formatting = dict(
+            username=self.me.username,
+            profile_url=profile_url,
+        )
+
+        await self.send_message(
+            entity=event.chat_id,
+            reply_to=event.message.id,
+            message=messages.START_SUCCESSFUL.format(**formatting)
+        )
+        log.info("Handled /start from: %s", user_id)
+
+    async def __handle_chat_action(self, event: telethon.events.ChatAction.Event):
+        if event.user_joined or event.user_added:
+            joined = True
+        elif event.user_left or event.user_kicked:
+            joined = False
+        else:
+            return
+
+        for user_id in event.user_ids:
+            if user_id != self.me.id:
+                self.membership_batcher.put(MembershipChange(chat_id=event.chat_id, user_id=user_id, joined=joined))
+
+    def _apply_membership_changes(self, changes: list[MembershipChange]) -> list[tuple[int, int]]:
+        """
+        Update the database according to a batch of membership changes, in a single transaction.
+
+        :param changes: The changes to apply, at most one per user and chat.
+        :return: The chat and user id pairs of the users to remove from the private groups.
+        """
+
+        public_chat_id = TELEGRAM_PUBLIC_CHAT_ID.__wrapped__
+        private_chat_ids = TELEGRAM_PRIVATE_CHAT_IDS.__wrapped__
+        kicks = []
+
+        with self._sqla_session() as session:
+            session: sqlalchemy.orm.Session
+            user_ids = {change.user_id for change in changes}
+            users: dict[int, TelegramUser] = {
+                user.id: user
+                for user in (
+                    session.query(TelegramUser)
+                    .options(sqlalchemy.orm.joinedload(TelegramUser.account), sqlalchemy.orm.selectinload(TelegramUser.private_memberships))
+                    .filter(TelegramUser.id.in_(user_ids))
+                )
+            }
+
+            for change in changes:
+                user = users.get(change.user_id)
+
+                if change.chat_id == public_chat_id:
+                    # If somebody joins the public group, create their user so that they can verify themselves
+                    if change.joined:
+                        if user is None:
+                            users[change.user_id] = TelegramUser.create(session=session, id=change.user_id)
+                    # If somebody leaves the public group, delete their user, and remove them from the private groups
+                    elif user is not None:
+                        if user.joined_private_group:
+                            kicks += [(chat_id, change.user_id) for chat_id in private_chat_ids]
+                        user.destroy(session=session)
+                        del users[change.user_id]
+
+                elif change.chat_id in private_chat_ids:
+                    # If somebody joins a private group, let them stay only if they have verified themselves
+                    if change.joined:
+                        if user is None or user.account is None:
+                            kicks.append((change.chat_id, change.user_id))
+                        else:
+                            user.join_private_group(change.chat_id)
+                            # The link they joined with is single-use, so it's not worth keeping around
+                            session.query(TelegramInviteLink).filter_by(chat_id=change.chat_id, telegram_user_id=change.user_id).delete()
+                    # Users may be members of many private groups, and are only marked as not joined once they have left all of them
+                    elif user is not None:
+                        user.leave_private_group(change.chat_id)
+
+            session.commit()
+
+        return kicks
+
+    async def _process_membership_changes(self, changes: list[MembershipChange]) -> None:
+        """
+        Process a batch of membership changes of the monitored groups.
+        """
+
+        kicks = await self._run_in_thread(self._apply_membership_changes, changes)
+        log.debug("Applied %d membership changes, removing %d users from private groups", len(changes), len(kicks))
+
+        for chat_id, user_id in kicks:
+            await self._kick(chat_id, user_id)
+
+        log.info("Handled %d membership changes", len(changes))
+
+    async def _kick(self, chat_id: int, user_id: int) -> None:
+        """
+        Remove a user from a chat without banning them, waiting out any flood wait.
+        """
+
+        while True:
+            await self.kick_limiter.acquire()
+            try:
+                await self.kick_participant(chat_id, user_id)
+            except telethon.errors.FloodWaitError as e:
+                log.warning("Flood wait of %d seconds while removing %s from %s", e.seconds, user_id, chat_id)
+                await asyncio.sleep(e.seconds)
+            except telethon.errors.RPCError as e:
+                log.warning("Could not remove %s from %s: %r", user_id, chat_id, e)
+                return
+            else:
+                log.debug("Removed %s from %s", user_id, chat_id)
+                return
+
+
+__all__ = (
+    "LokiTelegramClient",
+)
@@ -0,0 +1,196 @@
+"""
+This module defines the pool of single-use invite links to the private Telegram groups monitored by :mod:`lokiunimore`.
+"""
+
+import asyncio
+import datetime
+import logging
+import time
+import typing as t
+import sqlalchemy
+import sqlalchemy.orm
+import telethon.errors
+import telethon.tl.functions.messages
+
+from lokiunimore.sql.tables import TelegramInviteLink
+from lokiunimore.utils.ratelimit import RateLimiter
+
+if t.TYPE_CHECKING:
+    from lokiunimore.telegram.client import LokiTelegramClient
+
+log = logging.getLogger(__name__)
+
+
+LINK_LIFETIME = 7 * 24 * 60 * 60
+"""
+The number of seconds a generated invite link works for.
+"""
+
+ASSIGNED_LINK_LIFETIME = 24 * 60 * 60
+"""
+The number of seconds after which an invite link handed out to a user and not used yet is revoked.
+"""
+
+REFRESH_INTERVAL = 60
+"""
+The number of seconds between two maintenance rounds of the pool.
+"""
+
+
+class InviteLinkPool:
+    """
+    Background job keeping a pool of unassigned single-use invite links in the database for each private group, so that handing one out to a user doesn't require contacting Telegram, and revoking the links that go unused.
+    """
+
+    def __init__(self, client: "LokiTelegramClient", chat_ids: list[int], size: int):
+        """
+        :param client: The client to generate and revoke links with.
+        :param chat_ids: The marked ids of the chats to keep a pool of links for.
+        :param size: The number of unassigned links to keep for each chat.
+        """
+
+        self.client: "LokiTelegramClient" = client
+        self.chat_ids: list[int] = chat_ids
+        self.size: int = size
+        self.limiter: RateLimiter = RateLimiter(rate=1, burst=5)
+        self._chat_titles: dict[int, str] = {}
+
+    def _find_stale_links(self) -> list[tuple[int, str]]:
+        """
+        Delete the expired links from the database, and find the handed out links which should be revoked.
+
+        :return: The chat id and link pairs of the links to revoke.
+        """
+
+        now = time.time()
+        with self.client._sqla_session() as session:
+            session: sqlalchemy.orm.Session
+            session.query(TelegramInviteLink).filter(TelegramInviteLink.expires_at <= now).delete()
+            stale = (
+                session.query(TelegramInviteLink.chat_id, TelegramInviteLink.link)
+                .filter(TelegramInviteLink.assigned_at.is_not(None))
+                .filter(sqlalchemy.or_(
+                    TelegramInviteLink.assigned_at < now - ASSIGNED_LINK_LIFETIME,
+                    TelegramInviteLink.telegram_user_id.is_(None),
+                ))
+                .all()
+            )
+            session.commit()
+        return [(chat_id, link) for chat_id, link in stale]
+
+    def _delete_links(self, links: list[str]) -> None:
+        with self.client._sqla_session() as session:
+            session: sqlalchemy.orm.Session
+            session.query(TelegramInviteLink).filter(TelegramInviteLink.link.in_(links)).delete()
+            session.commit()
+
+    def _count_available_links(self) -> dict[int, int]:
+        """
+        :return: A mapping of chat ids to the number of unassigned links available for them.
+        """
+
+        with self.client._sqla_session() as session:
+            session: sqlalchemy.orm.Session
+            counts = (
+                session.query(TelegramInviteLink.chat_id, sqlalchemy.func.count())
+                .filter(TelegramInviteLink.assigned_at.is_(None))
+                .filter(TelegramInviteLink.expires_at > time.time())
+                .group_by(TelegramInviteLink.chat_id)
+                .all()
+            )
+        return {chat_id: count for chat_id, count in counts}
+
+    def _add_links(self, links: list[TelegramInviteLink]) -> None:
+        with self.client._sqla_session() as session:
+            session: sqlalchemy.orm.Session
+            session.add_all(links)
+            session.commit()
+
+    async def _call(self, request) -> t.Any:
+        """
+        Perform a request to Telegram, waiting out any flood wait.
+        """
+
+        while True:
+            await self.limiter.acquire()
+            try:
+                return await self.client(request)
+            except telethon.errors.FloodWaitError as e:
+                log.warning("Flood wait of %d seconds while maintaining the invite link pool", e.seconds)
+                await asyncio.sleep(e.seconds)
+
+    async def _chat_title(self, chat_id: int) -> str:
+        if chat_id not in self._chat_titles:
+            entity = await self.client.get_entity(chat_id)
+            self._chat_titles[chat_id] = entity.title
+        return self._chat_titles[chat_id]
+
+    async def revoke_stale_links(self) -> None:
+        """
+        Revoke the links handed out to users who didn't use them in time, or who were deleted.
+        """
+
+        stale = await self.client._run_in_thread(self._find_stale_links)
+        if not stale:
+            return
+
+        log.debug("Revoking %d unused invite links", len(stale))
+        revoked = []
+        for chat_id, link in stale:
+            try:
+                await self._call(telethon.tl.functions.messages.EditExportedChatInviteRequest(peer=chat_id, link=link, revoked=True))
+            except telethon.errors.RPCError as e:
+                log.warning("Could not revoke invite link of chat %s: %r", chat_id, e)
+            revoked.append(link)
+
+        await self.client._run_in_thread(self._delete_links, revoked)
+        log.info("Revoked %d unused invite links", len(revoked))
+
+    async def replenish(self) -> None:
+        """
+        Generate new links until each chat has :attr:`.size` unassigned ones.
+        """
+
+        counts = await self.client._run_in_thread(self._count_available_links)
+
+        for chat_id in self.chat_ids:
+            missing = self.size - counts.get(chat_id, 0)
+            if missing <= 0:
+                continue
+
+            log.debug("Generating %d invite links for chat %s", missing, chat_id)
+            title = await self._chat_title(chat_id)
+            expires_at = time.time() + LINK_LIFETIME
+            links = []
+            for _ in range(missing):
+                exported = await self._call(telethon.tl.functions.messages.ExportChatInviteRequest(
+                    peer=chat_id,
+                    expire_date=datetime.datetime.fromtimestamp(expires_at, tz=datetime.timezone.utc),
+                    usage_limit=1,
+                    title="Loki",
+                ))
+                links.append(TelegramInviteLink(link=exported.link, chat_id=chat_id, chat_title=title, expires_at=expires_at))
+
+            await self.client._run_in_thread(self._add_links, links)
+            log.info("Generated %d invite links for chat %s", len(links), chat_id)
+
+    async def run(self) -> t.NoReturn:
+        """
+        Maintain the pool forever.
+        """
+
+        while True:
+            try:
+                await self.revoke_stale_links()
+                await self.replenish()
+            except Exception:
+                log.exception("Failed to maintain the invite link pool")
+            await asyncio.sleep(REFRESH_INTERVAL)
+
+
+__all__ = (
+    "LINK_LIFETIME",
+    "ASSIGNED_LINK_LIFETIME",
+    "REFRESH_INTERVAL",
+    "InviteLinkPool",
+)
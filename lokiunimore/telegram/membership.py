@@ -0,0 +1,123 @@
+"""
+This module defines the batching of the membership changes of the Telegram groups monitored by :mod:`lokiunimore`.
+"""
+
+import asyncio
+import logging
+import typing as t
+
+from lokiunimore.utils.caches import TTLCache
+
+log = logging.getLogger(__name__)
+
+
+class MembershipChange(t.NamedTuple):
+    """
+    A user joining or leaving a Telegram chat.
+    """
+
+    chat_id: int
+    """
+    The marked id of the chat.
+    """
+
+    user_id: int
+    """
+    The id of the user.
+    """
+
+    joined: bool
+    """
+    :data:`True` if the user joined the chat, :data:`False` if they left it or were removed from it.
+    """
+
+
+class MembershipBatcher:
+    """
+    Buffer of :class:`.MembershipChange`\\ s, which are processed in batches so that database writes and bans can be grouped together.
+
+    Changes superseded by later ones in the same batch are dropped, and so are changes which would not alter the last processed state of the user in the chat, such as updates replayed by Telegram after a reconnection.
+    """
+
+    def __init__(
+            self,
+            process: t.Callable[[list[MembershipChange]], t.Awaitable[None]],
+            max_size: int = 500,
+            max_delay: float = 1.0,
+    ):
+        """
+        :param process: The coroutine function processing a batch of changes.
+        :param max_size: The maximum number of changes in a batch.
+        :param max_delay: The maximum number of seconds a change may be buffered for before its batch is processed.
+        """
+
+        self.process: t.Callable[[list[MembershipChange]], t.Awaitable[None]] = process
+        self.max_size: int = max_size
+        self.max_delay: float = max_delay
+        self.queue: asyncio.Queue[MembershipChange] = asyncio.Queue()
+        self._last_states: TTLCache[tuple[int, int], bool] = TTLCache(max_size=65536, ttl=3600)
+
+    def put(self, change: MembershipChange) -> None:
+        """
+        Buffer a change for processing.
+        """
+
+        self.queue.put_nowait(change)
+
+    def collapse(self, batch: list[MembershipChange]) -> list[MembershipChange]:
+        """
+        :param batch: The buffered changes, in the order they were received.
+        :return: The changes that have to be processed, at most one per user and chat.
+        """
+
+        latest = {}
+        for change in batch:
+            latest[(change.chat_id, change.user_id)] = change
+
+        return [change for key, change in latest.items() if self._last_states.get(key) != change.joined]
+
+    async def _next_batch(self) -> list[MembershipChange]:
+        """
+        Wait for a change, then keep buffering until the batch is full or its time runs out.
+        """
+
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_delay
+
+        while len(batch) < self.max_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def run(self) -> t.NoReturn:
+        """
+        Process batches of changes forever.
+        """
+
+        while True:
+            batch = await self._next_batch()
+            changes = self.collapse(batch)
+            log.debug("Processing %d membership changes out of %d received", len(changes), len(batch))
+            if not changes:
+                continue
+
+            try:
+                await self.process(changes)
+            except Exception:
+                log.exception("Failed to process a batch of %d membership changes", len(changes))
+            else:
+                for change in changes:
+                    self._last_states.set((change.chat_id, change.user_id), change.joined)
+
+
+__all__ = (
+    "MembershipChange",
+    "MembershipBatcher",
+)
@@ -0,0 +1,82 @@
+import time
+import threading
+import collections
+import typing as t
+
+K = t.TypeVar("K")
+V = t.TypeVar("V")
+
+
+class TTLCache(t.Generic[K, V]):
+    """
+    A thread-safe, size-bounded, in-process cache whose entries expire after a while.
+
+    When full, the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        :param max_size: The maximum number of entries to keep.
+        :param ttl: The number of seconds after which an entry expires.
+        """
+
+        self.max_size: int = max_size
+        self.ttl: float = ttl
+        self._entries: collections.OrderedDict[K, tuple[float, V]] = collections.OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        """
+        :param key: The key to get the value of.
+        :param default: The value to return if the key is missing or expired.
+        :return: The value associated with the key, or ``default``.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: K, value: V) -> None:
+        """
+        :param key: The key to associate the value with.
+        :param value: The value to store, replacing the previous one.
+        """
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        """
+        :param key: The key to remove from the cache, if present.
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Remove all entries from the cache.
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+
+__all__ = (
+    "TTLCache",
+)
@@ -1,35 +1,190 @@
+import atexit
+import datetime
+import json
 import logging
-import coloredlogs
+import logging.handlers
+import os
+import queue
+import signal
+import sys
+import threading
+
+from lokiunimore.config import LOKI_LOG_LEVEL, LOKI_LOG_LEVEL_FILE, LOKI_LOG_FORMAT
+from lokiunimore.config.config import parse_log_levels
+from lokiunimore.utils.tracing import tracer
 
 log = logging.getLogger(__name__)
 
 
+class JSONFormatter(logging.Formatter):
+    """
+    Formats each record as a single line of JSON, including the ids of the trace it was logged in, if any.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+        }
+        if trace_id := getattr(record, "trace_id", None):
+            entry["trace_id"] = trace_id
+            entry["span_id"] = record.span_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    A :class:`~logging.handlers.QueueHandler` leaving all formatting to the writer thread, so that logging only costs the caller a :meth:`~queue.Queue.put`.
+
+    .. warning:: Arguments are formatted later, so objects passed as arguments must not be modified after being logged.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue never leaves the process, so the record doesn't need to be made picklable; only the context of the caller must be captured now
+        if (span := tracer.current_span()) is not None:
+            record.trace_id = span.trace_id
+            record.span_id = span.span_id
+        return record
+
+
+def create_stream_handler(fmt: str) -> logging.Handler:
+    """
+    :param fmt: Either ``color`` or ``json``; see :data:`lokiunimore.config.LOKI_LOG_FORMAT`.
+    :return: The handler writing the records to the standard error.
+    """
+
+    handler = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        # Imported here, as it takes a while to import and JSON logs don't need it
+        import coloredlogs
+
+        handler.setFormatter(coloredlogs.ColoredFormatter(
+            fmt="{asctime} | {name:<32} | {levelname:>8} | {message}",
+            style="{",
+            level_styles=dict(
+                debug=dict(color="white"),
+                info=dict(color="cyan"),
+                warning=dict(color="yellow"),
+                error=dict(color="red"),
+                critical=dict(color="red", bold=True),
+            ),
+            field_styles=dict(
+                asctime=dict(color='magenta'),
+                levelname=dict(color='blue', bold=True),
+                name=dict(color='blue'),
+            ),
+        ))
+    return handler
+
+
+_listener: logging.handlers.QueueListener | None = None
+_queue_handlers: list[DeferredQueueHandler] = []
+_leveled_loggers: set[str] = set()
+
+
+def _start_listener() -> None:
+    global _listener
+    _listener = logging.handlers.QueueListener(queue.SimpleQueue(), create_stream_handler(LOKI_LOG_FORMAT.__wrapped__))
+    for handler in _queue_handlers:
+        handler.queue = _listener.queue
+    _listener.start()
+
+
+def _restart_listener_after_fork() -> None:
+    # The writer thread doesn't survive forks, and the queue may have been left locked by it
+    if _listener is not None:
+        _start_listener()
+
+
+def set_log_levels(levels: dict[str, int], logger: logging.Logger = None) -> None:
+    """
+    Change the levels of the loggers at runtime.
+
+    :param levels: The level of each logger by name, where the empty name stands for ``logger``; see :data:`lokiunimore.config.LOKI_LOG_LEVEL`.
+    :param logger: The logger the handler was installed on.
+    """
+
+    if logger is None:
+        logger = logging.getLogger("lokiunimore")
+
+    # Loggers left out of the new levels inherit them again, as if they had never been set
+    for name in _leveled_loggers - {name for name in levels if name}:
+        logging.getLogger(name).setLevel(logging.NOTSET)
+    _leveled_loggers.clear()
+
+    for name, level in levels.items():
+        (logging.getLogger(name) if name else logger).setLevel(level)
+        if name:
+            _leveled_loggers.add(name)
+
+
+def reload_log_levels(path: str, logger: logging.Logger = None) -> bool:
+    """
+    Change the levels of the loggers to the ones written in a file, leaving them unchanged if it can't be read.
+
+    :param path: The path of the file; see :data:`lokiunimore.config.LOKI_LOG_LEVEL_FILE`.
+    :param logger: The logger the handler was installed on.
+    :return: Whether the levels were changed.
+    """
+
+    try:
+        with open(path) as file:
+            levels = parse_log_levels(file.read().strip())
+    except (OSError, ValueError) as e:
+        log.warning("Could not reload the log levels from %s: %s", path, e)
+        return False
+
+    set_log_levels(levels, logger)
+    log.info("Reloaded the log levels from %s", path)
+    return True
+
+
 def install_log_handler(logger: logging.Logger = None):
+    """
+    Log the records of ``logger`` and of its children to the standard error, formatting and writing them from a background thread.
+
+    The levels and the format are taken from :data:`lokiunimore.config.LOKI_LOG_LEVEL` and :data:`lokiunimore.config.LOKI_LOG_FORMAT`; if :data:`lokiunimore.config.LOKI_LOG_LEVEL_FILE` is set, the levels are reloaded from it whenever the process receives :data:`signal.SIGHUP`.
+
+    :param logger: The logger to install the handler on; defaults to the ``lokiunimore`` logger.
+    """
+
     if logger is None:
         logger = logging.getLogger("lokiunimore")
 
-    coloredlogs.install(
-        logger=logger,
-        level="DEBUG",
-        fmt="{asctime} | {name:<32} | {levelname:>8} | {message}",
-        style="{",
-        level_styles=dict(
-            debug=dict(color="white"),
-            info=dict(color="cyan"),
-            warning=dict(color="yellow"),
-            error=dict(color="red"),
-            critical=dict(color="red", bold=True),
-        ),
-        field_styles=dict(
-            asctime=dict(color='magenta'),
-            levelname=dict(color='blue', bold=True),
-            name=dict(color='blue'),
-        ),
-        isatty=True,
-    )
+    if _listener is None:
+        _start_listener()
+        atexit.register(lambda: _listener.stop())
+        os.register_at_fork(after_in_child=_restart_listener_after_fork)
+
+    if not any(isinstance(handler, DeferredQueueHandler) for handler in logger.handlers):
+        handler = DeferredQueueHandler(_listener.queue)
+        _queue_handlers.append(handler)
+        logger.addHandler(handler)
+
+    set_log_levels(LOKI_LOG_LEVEL.__wrapped__, logger)
+
+    # Signal handlers can only be set from the main thread
+    if (path := LOKI_LOG_LEVEL_FILE.__wrapped__) and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGHUP, lambda signum, frame: reload_log_levels(path, logger))
+        log.debug("Send SIGHUP to process %d to reload the log levels from %s", os.getpid(), path)
+
     log.info("Installed custom log handler!")
 
 
 __all__ = (
+    "JSONFormatter",
+    "DeferredQueueHandler",
+    "create_stream_handler",
+    "set_log_levels",
+    "reload_log_levels",
     "install_log_handler",
-)
\ No newline at end of file
+)
@@ -0,0 +1,347 @@
+"""
+This module defines a minimal, thread-safe metrics subsystem, exposed in the `Prometheus text format <https://prometheus.io/docs/instrumenting/exposition_formats/>`_.
+
+Metrics live in the process that records them; each process serves its own via :func:`.serve_metrics`.
+"""
+
+import bisect
+import contextlib
+import http.server
+import logging
+import math
+import threading
+import time
+import typing as t
+
+log = logging.getLogger(__name__)
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+"""
+The content type of the output of :meth:`.MetricsRegistry.render`.
+"""
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+"""
+The default upper bounds of the buckets of a :class:`.Histogram`, in seconds.
+"""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: t.Iterable[tuple[str, str]]) -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in labels]
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    Base class of the metrics, keeping a separate value for each combination of label values.
+    """
+
+    type: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: t.Sequence[str] = ()):
+        """
+        :param name: The name of the metric, such as ``loki_matrix_requests_total``.
+        :param documentation: A one-line description of the metric.
+        :param labels: The names of the labels the values of the metric are partitioned by.
+        """
+
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labels: tuple[str, ...] = tuple(labels)
+        self._values: dict[tuple[str, ...], t.Any] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {self.name}>"
+
+    def _key(self, labels: dict[str, t.Any]) -> tuple[str, ...]:
+        if labels.keys() != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels!r}, got {tuple(labels)!r}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> t.Iterator[tuple[str, tuple[tuple[str, str], ...], float]]:
+        """
+        :return: The name, labels and value of each sample of the metric.
+        """
+
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        """
+        :return: The metric in the Prometheus text format.
+        """
+
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """
+    A value which only ever increases, such as the number of processed events.
+    """
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Increase the value for the given labels.
+        """
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """
+        :return: The current value for the given labels.
+        """
+
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in sorted(values):
+            yield self.name, tuple(zip(self.labels, key)), value
+
+
+class Gauge(Metric):
+    """
+    A value which may go up and down, such as the number of connections in use.
+    """
+
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        """
+        Set the value for the given labels.
+        """
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Increase the value for the given labels; decrease it if ``amount`` is negative.
+        """
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """
+        :return: The current value for the given labels.
+        """
+
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in sorted(values):
+            yield self.name, tuple(zip(self.labels, key)), value
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values, such as the durations of requests, counted in cumulative buckets.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: t.Sequence[str] = (), buckets: t.Sequence[float] = DEFAULT_BUCKETS):
+        """
+        :param buckets: The upper bounds of the buckets, in increasing order.
+        """
+
+        super().__init__(name=name, documentation=documentation, labels=labels)
+        self.buckets: tuple[float, ...] = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Record an observed value for the given labels.
+        """
+
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> t.Generator[None, None, None]:
+        """
+        Observe the number of seconds the body of the ``with`` statement takes, even if it raises.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        """
+        :return: The number of values observed for the given labels.
+        """
+
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels)) or ([0], 0.0)
+            return sum(counts)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+        for key, (counts, total) in sorted(values):
+            labels = tuple(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", (*labels, ("le", _format_value(bound))), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class MetricsRegistry:
+    """
+    A collection of metrics rendered together.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Add a metric to the registry, or return the existing one with the same name.
+
+        :raises ValueError: If a different kind of metric with the same name already exists.
+        """
+
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is None:
+                self._metrics[metric.name] = metric
+                return metric
+        if type(existing) is not type(metric) or existing.labels != metric.labels:
+            raise ValueError(f"A different metric named {metric.name} is already registered")
+        return existing
+
+    def render(self) -> str:
+        """
+        :return: All the metrics in the Prometheus text format.
+        """
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+
+REGISTRY = MetricsRegistry()
+"""
+The registry of the metrics of :mod:`lokiunimore`.
+"""
+
+
+def counter(name: str, documentation: str, labels: t.Sequence[str] = ()) -> Counter:
+    """
+    Create a :class:`.Counter` in :data:`.REGISTRY`, or get it if it already exists.
+    """
+
+    # noinspection PyTypeChecker
+    return REGISTRY.register(Counter(name=name, documentation=documentation, labels=labels))
+
+
+def gauge(name: str, documentation: str, labels: t.Sequence[str] = ()) -> Gauge:
+    """
+    Create a :class:`.Gauge` in :data:`.REGISTRY`, or get it if it already exists.
+    """
+
+    # noinspection PyTypeChecker
+    return REGISTRY.register(Gauge(name=name, documentation=documentation, labels=labels))
+
+
+def histogram(name: str, documentation: str, labels: t.Sequence[str] = (), buckets: t.Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    """
+    Create a :class:`.Histogram` in :data:`.REGISTRY`, or get it if it already exists.
+    """
+
+    # noinspection PyTypeChecker
+    return REGISTRY.register(Histogram(name=name, documentation=documentation, labels=labels, buckets=buckets))
+
+
+class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("Metrics request from %s: " + format, self.address_string(), *args)
+
+
+def serve_metrics(bind: tuple[str, int], attempts: int = 1) -> http.server.ThreadingHTTPServer | None:
+    """
+    Serve the metrics of :data:`.REGISTRY` at ``/metrics`` from a daemon thread.
+
+    :param bind: The address and port to serve the metrics at.
+    :param attempts: The number of consecutive ports to try, so that multiple processes of the same kind can share the same configuration.
+    :return: The started server, or :data:`None` if none of the ports were available.
+    """
+
+    host, port = bind
+    for offset in range(attempts):
+        try:
+            server = http.server.ThreadingHTTPServer((host, port + offset), _MetricsRequestHandler)
+        except OSError:
+            continue
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        log.info("Serving metrics at http://%s:%d/metrics", host, port + offset)
+        return server
+
+    log.warning("Could not serve metrics: all ports from %s:%d to %d are in use", host, port, port + attempts - 1)
+    return None
+
+
+__all__ = (
+    "CONTENT_TYPE",
+    "DEFAULT_BUCKETS",
+    "Metric",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MetricsRegistry",
+    "REGISTRY",
+    "counter",
+    "gauge",
+    "histogram",
+    "serve_metrics",
+)
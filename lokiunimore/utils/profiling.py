@@ -0,0 +1,244 @@
+"""
+This module defines tools to find out where a running event loop spends its time, without restarting the process:
+
+- a sampling profiler, toggled by ``SIGUSR1``, writing the sampled stacks in the collapsed format read by `flamegraph.pl <https://github.com/brendangregg/FlameGraph>`_ and `speedscope <https://www.speedscope.app/>`_;
+- a watchdog logging whatever blocks the event loop for too long.
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+import types
+
+from lokiunimore.utils.metrics import histogram
+
+log = logging.getLogger(__name__)
+
+LOOP_LAG_SECONDS = histogram("loki_loop_lag_seconds", "Delay between when a callback of the event loop was scheduled to run and when it ran.", buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 5))
+
+_package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _frame_label(frame: types.FrameType) -> str:
+    code = frame.f_code
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stack(frame: types.FrameType | None) -> list[types.FrameType]:
+    """
+    :return: The frames of the stack, from the outermost to the innermost.
+    """
+
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the stack of a thread from a background thread, counting how often each stack is seen.
+    """
+
+    def __init__(self, thread_id: int, output_dir: str, interval: float = 0.005):
+        """
+        :param thread_id: The :func:`threading.get_ident` of the thread to profile.
+        :param output_dir: The directory to write the profiles to.
+        :param interval: The number of seconds between two samples.
+        """
+
+        self.thread_id: int = thread_id
+        self.output_dir: str = output_dir
+        self.interval: float = interval
+        self.samples: collections.Counter[str] = collections.Counter()
+        self.started_at: float | None = None
+        self._stop: threading.Event = threading.Event()
+        self._thread: threading.Thread | None = None
+        # Toggles run in the threads of an executor, and may overlap if signals are sent in quick succession
+        self._lock: threading.RLock = threading.RLock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def _sample(self) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        self.samples[";".join(_frame_label(f) for f in _stack(frame))] += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        """
+        Start sampling, discarding the samples of the previous run.
+        """
+
+        with self._lock:
+            if self.running:
+                return
+            self.samples.clear()
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+        log.info("Started profiling, sampling every %.0f ms", self.interval * 1000)
+
+    def stop(self) -> str | None:
+        """
+        Stop sampling, and write the collected samples to a new file in :attr:`.output_dir`.
+
+        :return: The path of the written file, or :data:`None` if the profiler wasn't running.
+        """
+
+        with self._lock:
+            if not self.running:
+                return None
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, f"lokiunimore-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at))}.folded")
+            with open(path, "w", encoding="utf8") as file:
+                for stack, count in self.samples.most_common():
+                    file.write(f"{stack} {count}\n")
+            total = sum(self.samples.values())
+
+        log.info("Stopped profiling after %d samples, written to %s", total, path)
+        return path
+
+    def toggle(self) -> str | None:
+        """
+        Start the profiler if it's stopped, or stop it if it's running.
+
+        :return: The path of the written file, if the profiler was stopped.
+        """
+
+        with self._lock:
+            if self.running:
+                return self.stop()
+            self.start()
+            return None
+
+
+def _find_event_id(frames: list[types.FrameType]) -> str | None:
+    # Handlers receive either the event itself, or the job it was queued as
+    for frame in reversed(frames):
+        for name in ("event", "job"):
+            if event_id := getattr(frame.f_locals.get(name), "event_id", None):
+                return event_id
+    return None
+
+
+class LoopWatchdog:
+    """
+    Watches an event loop from a background thread, logging the stack of the loop thread whenever a callback blocks it for longer than a threshold.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, thread_id: int, threshold: float = 0.25):
+        """
+        :param loop: The loop to watch.
+        :param thread_id: The :func:`threading.get_ident` of the thread running the loop.
+        :param threshold: The number of seconds the loop may be blocked for before the blocking callback is logged.
+        """
+
+        self.loop: asyncio.AbstractEventLoop = loop
+        self.thread_id: int = thread_id
+        self.threshold: float = threshold
+        self.interval: float = threshold / 2
+        self._ticked_at: float = time.monotonic()
+        self._stop: threading.Event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _tick(self, expected_at: float) -> None:
+        now = time.monotonic()
+        LOOP_LAG_SECONDS.observe(max(now - expected_at, 0))
+        self._ticked_at = now
+        if not self._stop.is_set():
+            self.loop.call_later(self.interval, self._tick, now + self.interval)
+
+    def _report(self, blocked_for: float) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        frames = _stack(frame)
+        own = [f for f in frames if f.f_code.co_filename.startswith(_package_dir)]
+        culprit = _frame_label(own[-1]) if own else _frame_label(frames[-1])
+        log.warning(
+            "Event loop blocked for %.0f ms by %s (event %s), at:\n%s",
+            blocked_for * 1000, culprit, _find_event_id(frames), "".join(traceback.format_stack(frame)),
+        )
+
+    def _watch(self) -> None:
+        reported_at: float | None = None
+        while not self._stop.wait(self.interval):
+            if self.loop.is_closed():
+                return
+            if not self.loop.is_running():
+                continue
+            ticked_at = self._ticked_at
+            blocked_for = time.monotonic() - ticked_at - self.interval
+            if blocked_for > self.threshold and reported_at != ticked_at:
+                # Report each stall once, with the stack of the callback causing it
+                reported_at = ticked_at
+                self._report(blocked_for)
+            elif reported_at is not None and reported_at != ticked_at:
+                reported_at = None
+                log.info("Event loop unblocked")
+
+    def start(self) -> None:
+        self._ticked_at = time.monotonic()
+        self.loop.call_soon_threadsafe(self._tick, self._ticked_at)
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        log.debug("Watching the event loop for callbacks blocking it for more than %.0f ms", self.threshold * 1000)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def install_profiling(output_dir: str, lag_threshold: float, signum: int = signal.SIGUSR1) -> tuple[SamplingProfiler, LoopWatchdog | None]:
+    """
+    Make the running event loop profilable on demand, and watch it for blocking callbacks.
+
+    Must be called from a coroutine running in the loop to profile.
+
+    :param output_dir: The directory to write the profiles to.
+    :param lag_threshold: The number of seconds the loop may be blocked for before the blocking callback is logged, or ``0`` to not watch the loop.
+    :param signum: The signal toggling the profiler.
+    :return: The profiler and the watchdog.
+    """
+
+    loop = asyncio.get_running_loop()
+    thread_id = threading.get_ident()
+
+    profiler = SamplingProfiler(thread_id=thread_id, output_dir=output_dir)
+    # Writing the profile takes a while, so it happens off the loop
+    loop.add_signal_handler(signum, lambda: loop.run_in_executor(None, profiler.toggle))
+    log.info("Send %s to process %d to start or stop profiling", signal.Signals(signum).name, os.getpid())
+
+    watchdog = None
+    if lag_threshold:
+        watchdog = LoopWatchdog(loop, thread_id=thread_id, threshold=lag_threshold)
+        watchdog.start()
+
+    return profiler, watchdog
+
+
+__all__ = (
+    "LOOP_LAG_SECONDS",
+    "SamplingProfiler",
+    "LoopWatchdog",
+    "install_profiling",
+)
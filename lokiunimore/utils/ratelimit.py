@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    """
+    An :mod:`asyncio` token bucket, limiting how often an action can be performed.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        :param rate: The number of actions allowed per second, on average.
+        :param burst: The number of actions that can be performed at once after a period of inactivity.
+        """
+
+        self.rate: float = rate
+        self.burst: int = burst
+        self._tokens: float = burst
+        self._updated_at: float = time.monotonic()
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        Wait until an action can be performed, then consume a token.
+        """
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+__all__ = (
+    "RateLimiter",
+)
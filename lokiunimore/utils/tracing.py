@@ -0,0 +1,335 @@
+"""
+This module defines a lightweight tracing subsystem, following a sampled fraction of the work of :mod:`lokiunimore` through the nested operations it is made of.
+
+Finished spans are exported in batches in the `OTLP JSON format <https://opentelemetry.io/docs/specs/otlp/#json-protobuf-encoding>`_, either as lines of a file or to the HTTP endpoint of a collector.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import secrets
+import threading
+import time
+import typing as t
+
+log = logging.getLogger(__name__)
+
+
+class Span:
+    """
+    A timed operation, part of the tree of operations of a trace.
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: str | None, attributes: dict[str, t.Any]):
+        self.tracer: "Tracer" = tracer
+        self.name: str = name
+        self.trace_id: str = trace_id
+        self.span_id: str = secrets.token_hex(8)
+        self.parent_id: str | None = parent_id
+        self.attributes: dict[str, t.Any] = attributes
+        self.error: str | None = None
+        self.start_ns: int = time.time_ns()
+        self.end_ns: int | None = None
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {self.name!r} {self.trace_id}/{self.span_id}>"
+
+    def set_attribute(self, key: str, value: t.Any) -> None:
+        self.attributes[key] = value
+
+    def end(self, error: BaseException | None = None) -> None:
+        """
+        Mark the span as finished, and queue it for export.
+
+        :param error: The exception which interrupted the operation, if any.
+        """
+
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{error.__class__.__qualname__}: {error}"
+        self.tracer.finish(self)
+
+    def to_otlp(self) -> dict:
+        """
+        :return: The span as an OTLP JSON ``Span`` object.
+        """
+
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value: t.Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict[str, t.Any]) -> list[dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class SpanExporter:
+    """
+    Base class of the destinations of finished spans.
+    """
+
+    def export(self, payload: dict) -> None:
+        """
+        :param payload: An OTLP JSON ``ExportTraceServiceRequest`` containing the spans to export.
+        """
+
+        raise NotImplementedError()
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Appends each batch of spans to a file, as a line of JSON.
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} to {self.path!r}>"
+
+    def export(self, payload: dict) -> None:
+        with open(self.path, "a", encoding="utf8") as file:
+            file.write(json.dumps(payload, separators=(",", ":")) + "\n")
+
+
+class OTLPSpanExporter(SpanExporter):
+    """
+    Sends each batch of spans to a collector supporting OTLP over HTTP with JSON encoding.
+    """
+
+    def __init__(self, url: str, timeout: float = 10):
+        """
+        :param url: The URL of the collector, such as ``http://127.0.0.1:4318``; ``/v1/traces`` is appended unless already present.
+        :param timeout: The number of seconds to wait for the collector to respond.
+        """
+
+        self.url: str = url if url.rstrip("/").endswith("/v1/traces") else url.rstrip("/") + "/v1/traces"
+        # Imported here, as most processes never export to a collector
+        import requests
+
+        self.timeout: float = timeout
+        self.session: "requests.Session" = requests.Session()
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} to {self.url!r}>"
+
+    def export(self, payload: dict) -> None:
+        response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+
+
+def exporter_for(target: str) -> SpanExporter:
+    """
+    :param target: The URL of a collector, or the path of a file.
+    :return: The exporter sending spans to the given target.
+    """
+
+    if target.startswith(("http://", "https://")):
+        return OTLPSpanExporter(target)
+    return FileSpanExporter(target)
+
+
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """
+    Creates spans for sampled traces, and exports them in batches from a background thread.
+
+    Until it is configured, no trace is sampled and tracing costs next to nothing.
+    """
+
+    def __init__(self, service_name: str = "lokiunimore", batch_size: int = 512, flush_interval: float = 2):
+        """
+        :param service_name: The name of the service reported with the spans.
+        :param batch_size: The number of finished spans after which they are exported without waiting for the interval.
+        :param flush_interval: The maximum number of seconds finished spans wait before being exported.
+        """
+
+        self.service_name: str = service_name
+        self.batch_size: int = batch_size
+        self.flush_interval: float = flush_interval
+        self.exporter: SpanExporter | None = None
+        self.sample_rate: float = 0
+        self._finished: list[Span] = []
+        self._lock: threading.Lock = threading.Lock()
+        self._wakeup: threading.Event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} sampling {self.sample_rate:.0%} to {self.exporter!r}>"
+
+    def configure(self, exporter: SpanExporter, sample_rate: float = 1) -> None:
+        """
+        Start sampling traces and exporting their spans.
+
+        :param exporter: Where to export the spans to.
+        :param sample_rate: The fraction of traces to sample, between ``0`` and ``1``.
+        """
+
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="tracing", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+        log.info("Tracing %.0f%% of the traces to %r", sample_rate * 100, exporter)
+
+    @staticmethod
+    def current_span() -> Span | None:
+        """
+        :return: The innermost span of the current context, if its trace is sampled.
+        """
+
+        return _current_span.get()
+
+    def start_span(self, name: str, **attributes) -> Span | None:
+        """
+        Start a span as child of the current one, without making it the current one; useful when the operation ends in a different callback.
+
+        :return: The started span, or :data:`None` if the current trace isn't sampled.
+        """
+
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        return Span(self, name=name, trace_id=parent.trace_id, parent_id=parent.span_id, attributes=attributes)
+
+    @contextlib.contextmanager
+    def _activate(self, span: Span | None) -> t.Generator[Span | None, None, None]:
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(error=e)
+            raise
+        else:
+            span.end()
+        finally:
+            _current_span.reset(token)
+
+    def trace(self, name: str, **attributes) -> t.ContextManager[Span | None]:
+        """
+        Start a new trace, if it is sampled, whose root span lasts for the body of the ``with`` statement.
+
+        If a sampled trace is already in progress, start a child span of it instead.
+        """
+
+        if _current_span.get() is not None:
+            return self.span(name, **attributes)
+        if self.exporter is None or random.random() >= self.sample_rate:
+            return self._activate(None)
+        return self._activate(Span(self, name=name, trace_id=secrets.token_hex(16), parent_id=None, attributes=attributes))
+
+    def span(self, name: str, **attributes) -> t.ContextManager[Span | None]:
+        """
+        Start a child span of the current one, lasting for the body of the ``with`` statement.
+
+        Does nothing if the current trace isn't sampled.
+        """
+
+        return self._activate(self.start_span(name, **attributes))
+
+    def finish(self, span: Span) -> None:
+        """
+        Queue a finished span for export.
+        """
+
+        with self._lock:
+            self._finished.append(span)
+            full = len(self._finished) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> None:
+        """
+        Export all the finished spans immediately.
+        """
+
+        with self._lock:
+            spans, self._finished = self._finished, []
+        if not spans or self.exporter is None:
+            return
+
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({"service.name": self.service_name, "process.pid": os.getpid()})},
+                "scopeSpans": [{
+                    "scope": {"name": "lokiunimore"},
+                    "spans": [span.to_otlp() for span in spans],
+                }],
+            }],
+        }
+        try:
+            self.exporter.export(payload)
+        except Exception:
+            log.warning("Could not export %d spans, dropping them", len(spans), exc_info=True)
+
+    def _run(self) -> t.NoReturn:
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+tracer = Tracer()
+"""
+The tracer of :mod:`lokiunimore`, configured by the entry points of the bots.
+"""
+
+
+def traced(f):
+    """
+    Decorator running a coroutine function in a span of :data:`.tracer` named after it.
+    """
+
+    name = f.__qualname__
+
+    @functools.wraps(f)
+    async def wrapped(*args, **kwargs):
+        with tracer.span(name):
+            return await f(*args, **kwargs)
+
+    return wrapped
+
+
+__all__ = (
+    "Span",
+    "SpanExporter",
+    "FileSpanExporter",
+    "OTLPSpanExporter",
+    "exporter_for",
+    "Tracer",
+    "tracer",
+    "traced",
+)
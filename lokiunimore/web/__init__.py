@@ -1 +1,10 @@
-from .app import *
+import importlib
+
+
+def __getattr__(name):
+    # Lazily re-export the contents of .app, so that importing a submodule doesn't import the whole web stack.
+    module = importlib.import_module(".app", __name__)
+    try:
+        return getattr(module, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
@@ -1,11 +1,13 @@
 import flask.logging
 import lokiunimore.utils.logs
-from lokiunimore.config import config
+from lokiunimore.config.snapshot import get_snapshot
 
-from .app import app
+from .app import app, create_app, static_assets_extension
 
 
 def main():
+    create_app()
+    static_assets_extension.build()
     lokiunimore.utils.logs.install_log_handler(app.logger)
     app.logger.removeHandler(flask.logging.default_handler)
 
@@ -13,5 +15,5 @@ def main():
 
 
 if __name__ == "__main__":
-    config.proxies.resolve()
+    get_snapshot()
     main()
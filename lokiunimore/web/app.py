@@ -1,21 +1,37 @@
 import re
+import time
+import hashlib
+import functools
 import flask
 import flask_sqlalchemy
+import flask_sqlalchemy.session
 import werkzeug.middleware.proxy_fix
 import werkzeug.exceptions
 import authlib.integrations.flask_client
 import authlib.integrations.base_client
 import requests
+import sqlalchemy.orm
 
-from lokiunimore.config import config, FLASK_SECRET_KEY, SQLALCHEMY_DATABASE_URL, FLASK_SERVER_NAME, FLASK_APPLICATION_ROOT, FLASK_PREFERRED_URL_SCHEME
+from lokiunimore.config.snapshot import get_snapshot
 from lokiunimore.sql.tables import Base as TableDeclarativeBase
-from lokiunimore.sql.tables import Account, MatrixUser, TelegramUser
+from lokiunimore.sql.tables import Account, Community, MatrixUser, TelegramUser
+from lokiunimore.sql.communities import CommunityRegistry
+from lokiunimore.sql.engine import engine_options
+from lokiunimore.sql.upgrade import check_schema
+from lokiunimore.sql.routing import ReplicaSet, RoutingSession
+from lokiunimore.sql.metrics import install_query_metrics, install_pool_metrics
 from lokiunimore.web.extensions.matrix_client import MatrixClientExtension
+from lokiunimore.web.extensions.oidc_client import CachedOIDCApp, pooled_adapter
+from lokiunimore.web.extensions.static_assets import StaticAssetsExtension
+from lokiunimore.utils.caches import TTLCache
+from lokiunimore.utils.metrics import histogram
 
 
 app = flask.Flask(__name__)
 """
 The main :mod:`flask` application object.
+
+Is not usable until configured by :func:`.create_app`.
 """
 
 rp_app = werkzeug.middleware.proxy_fix.ProxyFix(app=app, x_for=1, x_proto=1, x_host=1, x_port=0, x_prefix=0)
@@ -23,46 +39,237 @@ rp_app = werkzeug.middleware.proxy_fix.ProxyFix(app=app, x_for=1, x_proto=1, x_h
 Reverse proxied instance of :data:`.app`, to use in production with a Caddy server.
 """
 
-app.config.update({
-    **config.proxies.resolve(),
-    "SERVER_NAME": FLASK_SERVER_NAME.__wrapped__,
-    "APPLICATION_ROOT": FLASK_APPLICATION_ROOT.__wrapped__,
-    "PREFERRED_URL_SCHEME": FLASK_PREFERRED_URL_SCHEME.__wrapped__,
-    "SECRET_KEY": FLASK_SECRET_KEY.__wrapped__,
-    "SQLALCHEMY_DATABASE_URI": SQLALCHEMY_DATABASE_URL.__wrapped__,
-    "SQLALCHEMY_TRACK_MODIFICATIONS": False,
-})
+
+class WebSession(RoutingSession, flask_sqlalchemy.session.Session):
+    """
+    The session of :data:`.sqla_extension`, sending the read-only queries of the pages decorated with :func:`.replica_reads` to :data:`.replica_set`.
+    """
 
 
-sqla_extension = flask_sqlalchemy.SQLAlchemy(app=app, metadata=TableDeclarativeBase.metadata)
+replica_set = ReplicaSet()
 """
-:mod:`sqlalchemy` database engine, usable by the whole :data:`.app`.
+The read replicas of the database, configured by :func:`.create_app`.
 """
 
+sqla_extension = flask_sqlalchemy.SQLAlchemy(metadata=TableDeclarativeBase.metadata, session_options={"class_": WebSession, "replicas": replica_set})
+"""
+:mod:`sqlalchemy` database engine, usable by the whole :data:`.app`.
+"""
 
-oauth_extension = authlib.integrations.flask_client.OAuth(app=app)
+oauth_extension = authlib.integrations.flask_client.OAuth()
 """
 OAuth2 :mod:`flask` extension installed on :data:`.app`.
 """
 
-oauth_extension.register(
-    name="oidc",
-    server_metadata_url=app.config["OIDC_CONFIGURATION_URL"],
-    api_base_url=app.config["OIDC_API_BASE_URL"],
-    client_kwargs={
-        "scope": app.config["OIDC_SCOPES"]
-    },
-)
+matrix_extension = MatrixClientExtension()
+"""
+Synchronous Matrix client for use with Flask.
+"""
 
+static_assets_extension = StaticAssetsExtension()
+"""
+Fingerprinted and precompressed static assets, served with long-lived cache headers.
+"""
 
-matrix_extension = MatrixClientExtension(app=app)
+community_registry = CommunityRegistry()
 """
-Synchronous Matrix client for use with Flask.
+The communities the Matrix users of the profile pages belong to.
+"""
+
+REQUEST_SECONDS = histogram("loki_web_request_seconds", "Duration of the requests to the web app, by route.", labels=("endpoint", "method", "status"))
+
+profile_cache: TTLCache[tuple[str, str], tuple[str, str]] = TTLCache(max_size=1024, ttl=300)
 """
+Cache of the rendered profile pages, mapping the endpoint and the token of a user to the ETag and the body of their page.
+"""
+
+
+def create_app() -> flask.Flask:
+    """
+    Resolve the configuration and use it to initialize :data:`.app` and its extensions, if that hasn't already happened.
+
+    Does not open any connection, so that it's safe to call before the web server forks its workers; see :func:`.init_worker`.
+
+    :return: The initialized :data:`.app`.
+    """
+
+    if "sqlalchemy" in app.extensions:
+        return app
+
+    snapshot = get_snapshot()
+    app.config.update({
+        **snapshot.as_dict(),
+        "SERVER_NAME": snapshot.FLASK_SERVER_NAME,
+        "APPLICATION_ROOT": snapshot.FLASK_APPLICATION_ROOT,
+        "PREFERRED_URL_SCHEME": snapshot.FLASK_PREFERRED_URL_SCHEME,
+        "SECRET_KEY": snapshot.FLASK_SECRET_KEY,
+        "SQLALCHEMY_DATABASE_URI": snapshot.SQLALCHEMY_DATABASE_URL,
+        "SQLALCHEMY_ENGINE_OPTIONS": engine_options(snapshot.SQLALCHEMY_DATABASE_URL),
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+    })
+
+    install_query_metrics()
+    install_pool_metrics()
+    sqla_extension.init_app(app)
+    replica_set.configure(snapshot.SQLALCHEMY_REPLICA_URLS)
+    oauth_extension.init_app(app)
+    matrix_extension.init_app(app)
+    static_assets_extension.init_app(app)
+
+    with app.app_context():
+        oauth_extension.register(
+            name="oidc",
+            client_cls=CachedOIDCApp,
+            server_metadata_url=app.config["OIDC_CONFIGURATION_URL"],
+            api_base_url=app.config["OIDC_API_BASE_URL"],
+            client_kwargs={
+                "scope": app.config["OIDC_SCOPES"]
+            },
+            cache_ttl=app.config["OIDC_CACHE_TTL"],
+            sqla_engine=sqla_extension.engine,
+        )
+
+    return app
+
+
+@functools.cache
+def _check_schema_once(engine: sqlalchemy.engine.Engine) -> None:
+    check_schema(engine)
+
+
+def shared_engine() -> sqlalchemy.engine.Engine:
+    """
+    :return: The engine of :data:`.app`, for the bots running in the same process to use, so that the process keeps a single pool of connections to the database; :func:`.create_app` must have been called.
+    :raises lokiunimore.sql.upgrade.OutdatedSchemaError: If the tables of the database need to be upgraded, which is checked the first time this is called.
+    """
+
+    with app.app_context():
+        engine = sqla_extension.engine
+    _check_schema_once(engine)
+    return engine
+
+
+def init_worker() -> None:
+    """
+    Discard all connections inherited from the parent process.
+
+    Must be called in each worker process after a fork.
+    """
+
+    with app.app_context():
+        for engine in sqla_extension.engines.values():
+            engine.dispose(close=False)
+    replica_set.dispose(close=False)
+
+    pooled_adapter.reset()
+    matrix_extension.reset()
+
+
+def replica_reads(f):
+    """
+    Decorator for the pages which only read from the database, sending their queries to a replica, unless the user has written to the database in the last ``SQLALCHEMY_REPLICA_MAX_LAG`` seconds.
+
+    If the page is not found on the replica, it is looked up again on the primary, as the replica may not have caught up with it yet.
+    """
+
+    @functools.wraps(f)
+    def wrapped(*args, **kwargs):
+        session: WebSession = sqla_extension.session()
+        session.read_from_replicas = time.time() >= flask.session.get("read_primary_until", 0)
+        try:
+            return f(*args, **kwargs)
+        except werkzeug.exceptions.NotFound:
+            if not session.used_replica:
+                raise
+            app.logger.debug("Not found on a replica, looking up again on the primary")
+            # The new session reads from the primary
+            sqla_extension.session.remove()
+            return f(*args, **kwargs)
+
+    return wrapped
+
+
+def community_of(user: MatrixUser) -> Community:
+    """
+    Find the community of a Matrix user, aborting with ``404 Not Found`` if it has been removed.
+    """
+
+    community = community_registry.get(sqla_extension.session, user.community_id)
+    if community is None:
+        flask.abort(404)
+    return community
+
+
+def community_templates(community: Community, template: str) -> list[str]:
+    """
+    :return: The templates to render for the given community, in order of preference: the one overridden in ``communities/<id>/`` if it exists, then the default one.
+    """
+
+    return [f"communities/{community.id}/{template}", template]
+
+
+def render_profile(template: str | list[str], user: MatrixUser | TelegramUser, token: str, state: tuple, **context) -> flask.Response:
+    """
+    Render the profile page of a user, or reuse a previous rendering if the state of the user hasn't changed since then.
+
+    Responds with ``304 Not Modified`` if the client already has the current page.
+
+    :param template: The template to render, or a list of templates to render the first existing one of.
+    :param user: The user the page is about.
+    :param token: The token the page was requested with.
+    :param state: Everything about the user that is displayed in the page.
+    :param context: Additional variables to pass to the template, which must be reflected in ``state``.
+    :return: The response to send.
+    """
+
+    etag = hashlib.sha256(repr((template, token, state)).encode("utf8")).hexdigest()
+
+    if etag in flask.request.if_none_match:
+        response = flask.Response(status=304)
+    else:
+        key = (flask.request.endpoint, token)
+        cached = profile_cache.get(key)
+        if cached is not None and cached[0] == etag:
+            body = cached[1]
+        else:
+            body = flask.render_template(template, user=user, token=token, **context)
+            profile_cache.set(key, (etag, body))
+        response = flask.make_response(body)
+
+    response.set_etag(etag)
+    # The page contains personal data, and changes when the user completes a step elsewhere
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 
 ### Setup the app routes
 
+@app.before_request
+def start_request_timer():
+    flask.g.request_started_at = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response: flask.Response) -> flask.Response:
+    if (started_at := flask.g.pop("request_started_at", None)) is not None:
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started_at,
+            endpoint=flask.request.endpoint or "none",
+            method=flask.request.method,
+            status=response.status_code,
+        )
+    return response
+
+
+@app.after_request
+def remember_writes(response: flask.Response) -> flask.Response:
+    # Have the user read from the primary until the replicas have caught up with what they have just written
+    if replica_set and sqla_extension.session.registry.has() and sqla_extension.session().wrote:
+        flask.session["read_primary_until"] = time.time() + app.config["SQLALCHEMY_REPLICA_MAX_LAG"]
+    return response
+
+
 @app.route("/")
 def page_root():
     return flask.render_template("root.html")
@@ -74,26 +281,41 @@ def page_privacy():
 
 
 @app.route("/matrix/<token>/")
+@replica_reads
 def page_matrix_profile(token):
-    user: MatrixUser = sqla_extension.session.query(MatrixUser).filter_by(token=token).first_or_404()
+    user: MatrixUser = sqla_extension.session.query(MatrixUser).options(sqlalchemy.orm.joinedload(MatrixUser.account)).filter_by(token=token).first_or_404()
+    community = community_of(user)
+    community_state = (community.private_space_id, community.help_room_alias)
     if user.account is None:
-        return flask.render_template("matrix/verify.html", user=user, token=token)
-    elif not user.joined_private_space:
-        return flask.render_template("matrix/join.html", user=user, token=token)
+        return render_profile(community_templates(community, "matrix/verify.html"), user=user, token=token, state=(user.id, community_state), community=community)
+    state = (user.id, user.account.email, user.account.first_name, user.account.last_name, community_state)
+    if not user.joined_private_space:
+        return render_profile(community_templates(community, "matrix/join.html"), user=user, token=token, state=state, community=community)
     else:
-        return flask.render_template("matrix/complete.html", user=user, token=token)
+        return render_profile(community_templates(community, "matrix/complete.html"), user=user, token=token, state=state, community=community)
 
 
+# Not reading from replicas, as it may hand out invite links, locking them on the primary
 @app.route("/telegram/<token>/")
 def page_telegram_profile(token):
-    user: TelegramUser = sqla_extension.session.query(TelegramUser).filter_by(token=token).first_or_404()
+    user: TelegramUser = sqla_extension.session.query(TelegramUser).options(sqlalchemy.orm.joinedload(TelegramUser.account)).filter_by(token=token).first_or_404()
     if user.account is None:
-        return flask.render_template("telegram/verify.html", user=user, token=token)
-    else:
-        return flask.render_template("telegram/complete.html", user=user, token=token)
+        return render_profile("telegram/verify.html", user=user, token=token, state=(user.id,))
+    invite_links = []
+    # Links are deleted as they are used, so handing them out again after the user joined would drain the pool
+    if app.config["TELEGRAM_INVITE_POOL_SIZE"] > 0 and not user.joined_private_group:
+        invite_links = user.claim_invite_links(session=sqla_extension.session, chat_ids=app.config["TELEGRAM_PRIVATE_CHAT_IDS"])
+        if invite_links:
+            sqla_extension.session.commit()
+        else:
+            # Release the locks on the links found for the other chats
+            sqla_extension.session.rollback()
+    state = (user.id, user.account.email, user.account.first_name, user.account.last_name, tuple(link.link for link in invite_links))
+    return render_profile("telegram/complete.html", user=user, token=token, state=state, invite_links=invite_links)
 
 
 @app.route("/matrix/<token>/link")
+@replica_reads
 def page_matrix_link(token):
     sqla_extension.session.query(MatrixUser).filter_by(token=token).first_or_404()
     flask.session["matrix_token"] = token
@@ -101,6 +323,7 @@ def page_matrix_link(token):
 
 
 @app.route("/telegram/<token>/link")
+@replica_reads
 def page_telegram_link(token):
     sqla_extension.session.query(TelegramUser).filter_by(token=token).first_or_404()
     flask.session["telegram_token"] = token
@@ -108,24 +331,41 @@ def page_telegram_link(token):
 
 
 @app.route("/matrix/<token>/invite")
+@replica_reads
 def page_matrix_invite(token):
     matrix_user: MatrixUser = sqla_extension.session.query(MatrixUser).filter_by(token=token).first_or_404()
+    community = community_of(matrix_user)
 
-    app.logger.debug(f"Sending private space invite to: {matrix_user.id}")
+    app.logger.debug("Sending private space invite to: %s", matrix_user.id)
     try:
-        matrix_extension.room_invite(room_id=app.config["MATRIX_PRIVATE_SPACE_ID"], user_id=matrix_user.id)
+        matrix_extension.room_invite(room_id=community.private_space_id, user_id=matrix_user.id)
     except requests.exceptions.HTTPError as e:
-        app.logger.warning(f"Failed to send private space invite to {matrix_user.id}: {e}")
+        app.logger.warning("Failed to send private space invite to %s: %s", matrix_user.id, e)
         if e.response.status_code == 403:
             return flask.render_template("errors/failed-invite.html"), 500
         if e.response.status_code == 429:
             return flask.render_template("errors/rate-invite.html"), 500
 
-    app.logger.info(f"Sent private space invite to: {matrix_user.id}")
+    app.logger.info("Sent private space invite to: %s", matrix_user.id)
 
     return flask.redirect(flask.url_for("page_matrix_profile", token=token))
 
 
+def merge_account(userinfo) -> Account:
+    """
+    Create or update the `.Account` of the user who signed in via OpenID Connect.
+
+    :param userinfo: The claims of the id token of the user.
+    :return: The merged `.Account`.
+    """
+
+    return sqla_extension.session.merge(Account(
+        email=userinfo.email,
+        first_name=userinfo.given_name,
+        last_name=userinfo.family_name,
+    ))
+
+
 @app.route("/authorize")
 def page_oidc_authorize():
     try:
@@ -133,35 +373,38 @@ def page_oidc_authorize():
     except (authlib.integrations.base_client.errors.OAuthError, werkzeug.exceptions.BadRequestKeyError):
         return flask.render_template("errors/oidc.html"), 400
 
-    # Not sure of why the nonce is now required or if I'm using it correctly
-    account = oauth_extension.oidc.parse_id_token(token=token, nonce=token["userinfo"]["nonce"])
+    # The id token has already been parsed and verified by authorize_access_token
+    account = token["userinfo"]
 
     if not account.email_verified:
         return flask.render_template("errors/not-verified.html"), 403
 
-    # noinspection PyTypeChecker
-    if not re.match(app.config["OIDC_EMAIL_REGEX"], account.email):
-        return flask.render_template("errors/not-student.html"), 403
-
-    local_account = sqla_extension.session.merge(Account(
-        email=account.email,
-        first_name=account.given_name,
-        last_name=account.family_name,
-    ))
-
     if matrix_token := flask.session.pop("matrix_token", None):
         matrix_user = sqla_extension.session.query(MatrixUser).filter_by(token=matrix_token).first_or_404()
+        # Each community decides who may join its private space
+        community = community_of(matrix_user)
+        if not re.match(community.email_regex, account.email):
+            return flask.render_template(community_templates(community, "errors/not-student.html"), community=community), 403
+
+        local_account = merge_account(account)
         matrix_user.link(session=sqla_extension.session, account=local_account)
         sqla_extension.session.commit()
+        profile_cache.pop(("page_matrix_profile", matrix_token))
 
         return flask.redirect(flask.url_for("page_matrix_invite", token=matrix_token))
 
     elif telegram_token := flask.session.pop("telegram_token", None):
+        # noinspection PyTypeChecker
+        if not re.match(app.config["OIDC_EMAIL_REGEX"], account.email):
+            return flask.render_template("errors/not-student.html"), 403
+
         telegram_user = sqla_extension.session.query(TelegramUser).filter_by(token=telegram_token).first_or_404()
+        local_account = merge_account(account)
         telegram_user.link(session=sqla_extension.session, account=local_account)
         sqla_extension.session.commit()
+        profile_cache.pop(("page_telegram_profile", telegram_token))
 
-        return flask.redirect(flask.url_for("page_telegram_link", token=telegram_token))
+        return flask.redirect(flask.url_for("page_telegram_profile", token=telegram_token))
 
     else:
         return flask.render_template("errors/no-link.html"), 403
@@ -179,6 +422,19 @@ __all__ = (
     "oauth_extension",
     "oauth_extension",
     "matrix_extension",
+    "static_assets_extension",
+    "WebSession",
+    "replica_set",
+    "create_app",
+    "shared_engine",
+    "init_worker",
+    "community_registry",
+    "profile_cache",
+    "replica_reads",
+    "community_of",
+    "community_templates",
+    "render_profile",
+    "merge_account",
     "page_root",
     "page_privacy",
     "page_matrix_profile",
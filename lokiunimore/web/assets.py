@@ -0,0 +1,22 @@
+"""
+Executable that builds the static assets of the web app, so that the web server doesn't have to at startup.
+"""
+
+import os
+
+from lokiunimore.config import FLASK_STATIC_BUILD_DIR
+from lokiunimore.utils.logs import install_log_handler
+from .extensions.static_assets import build_assets
+
+
+def main():
+    install_log_handler()
+    build_assets(
+        source_dir=os.path.join(os.path.dirname(__file__), "static"),
+        build_dir=FLASK_STATIC_BUILD_DIR.__wrapped__,
+    )
+
+
+if __name__ == "__main__":
+    # The rest of the configuration is not needed, and usually not available at build time
+    main()
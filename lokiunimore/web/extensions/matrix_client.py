@@ -1,6 +1,7 @@
 import flask
 import hmac
 import hashlib
+import threading
 import requests
 
 from lokiunimore.utils.device_names import generate_device_name
@@ -9,35 +10,65 @@ from lokiunimore.utils.device_names import generate_device_name
 class MatrixClientExtension:
     """
     Flask extension providing a extremely simple, :mod:`requests`-based, synchronous Matrix client.
+
+    Logs in lazily the first time it is used, so that it can be created before the web server forks its workers.
     """
 
     def __init__(self, app: flask.Flask = None):
+        self.access_token: str | None = None
+        self.device_id: str | None = None
+        self.http: requests.Session = requests.Session()
+        self._login_lock: threading.Lock = threading.Lock()
+
         if app is not None:
             self.init_app(app)
 
-        token = hmac.new(
-            key=app.config["MATRIX_USER_SECRET"].encode("utf8"),
-            msg=app.config["MATRIX_USER_ID"].encode("utf8"),
-            digestmod=hashlib.sha512
-        ).hexdigest()
-
-        response = requests.post(f"{app.config['MATRIX_HOMESERVER']}/_matrix/client/v3/login", json={
-            "type": "com.devture.shared_secret_auth",
-            "identifier": {
-                "type": "m.id.user",
-                "user": app.config["MATRIX_USER_ID"],
-            },
-            "token": token,
-            "initial_device_display_name": generate_device_name(__name__),
-        })
-        response.raise_for_status()
-        response = response.json()
+    def init_app(self, app: flask.Flask):
+        app.extensions["lokiunimore.matrix_client"] = self
 
-        self.access_token = response["access_token"]
-        self.device_id = response["device_id"]
+    def reset(self):
+        """
+        Discard the keep-alive connections to the homeserver and the current login.
 
-    def init_app(self, app: flask.Flask):
-        pass
+        Must be called in each worker process after a fork, as sockets cannot be shared between processes.
+        """
+
+        self.http.close()
+        self.http = requests.Session()
+        self.access_token = None
+        self.device_id = None
+
+    def login(self):
+        """
+        Login to the homeserver via `com.devture.shared_secret_auth <https://github.com/devture/matrix-synapse-shared-secret-auth>`_, if not already logged in.
+        """
+
+        with self._login_lock:
+            if self.access_token is not None:
+                return
+
+            config = flask.current_app.config
+
+            token = hmac.new(
+                key=config["MATRIX_USER_SECRET"].encode("utf8"),
+                msg=config["MATRIX_USER_ID"].encode("utf8"),
+                digestmod=hashlib.sha512
+            ).hexdigest()
+
+            response = self.http.post(f"{config['MATRIX_HOMESERVER']}/_matrix/client/v3/login", json={
+                "type": "com.devture.shared_secret_auth",
+                "identifier": {
+                    "type": "m.id.user",
+                    "user": config["MATRIX_USER_ID"],
+                },
+                "token": token,
+                "initial_device_display_name": generate_device_name(__name__),
+            })
+            response.raise_for_status()
+            response = response.json()
+
+            self.access_token = response["access_token"]
+            self.device_id = response["device_id"]
 
     def room_invite(self, room_id: str, user_id: str):
         """
@@ -47,8 +78,10 @@ class MatrixClientExtension:
         :param user_id: The user to invite.
         """
 
-        response = requests.post(
-            f"{flask.current_app.config['MATRIX_HOMESERVER']}/_matrix/client/v3/rooms/{flask.current_app.config['MATRIX_PRIVATE_SPACE_ID']}/invite",
+        self.login()
+
+        response = self.http.post(
+            f"{flask.current_app.config['MATRIX_HOMESERVER']}/_matrix/client/v3/rooms/{room_id}/invite",
             json={
                 "reason": "Account linked",
                 "user_id": user_id,
@@ -0,0 +1,155 @@
+import time
+import logging
+import threading
+import requests.adapters
+import sqlalchemy.exc
+import sqlalchemy.orm
+import authlib.integrations.flask_client
+import authlib.integrations.requests_client
+
+from lokiunimore.sql.tables import OIDCCachedDocument
+
+log = logging.getLogger(__name__)
+
+
+JWKS_MIN_REFRESH_INTERVAL = 60
+"""
+The minimum number of seconds between two forced refreshes of the signing keys, to prevent tokens with bogus key ids from hammering the identity provider.
+"""
+
+
+class PooledHTTPAdapter(requests.adapters.HTTPAdapter):
+    """
+    A :class:`requests.adapters.HTTPAdapter` whose connection pool survives the closing of the :class:`requests.Session`\\ s it is mounted on, so that it can be shared by all of them.
+    """
+
+    def close(self):
+        # Sessions are closed after every request performed by authlib, but the pool should be kept alive.
+        pass
+
+    def reset(self):
+        """
+        Actually close all the pooled connections.
+
+        Must be called in each worker process after a fork, as sockets cannot be shared between processes.
+        """
+        super().close()
+
+
+pooled_adapter = PooledHTTPAdapter(pool_connections=4, pool_maxsize=16)
+"""
+The :class:`.PooledHTTPAdapter` keeping alive the connections to the identity provider.
+"""
+
+
+class PooledOAuth2Session(authlib.integrations.requests_client.OAuth2Session):
+    """
+    An :class:`~authlib.integrations.requests_client.OAuth2Session` using the keep-alive connections of :data:`.pooled_adapter`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mount("https://", pooled_adapter)
+        self.mount("http://", pooled_adapter)
+
+
+class CachedOIDCApp(authlib.integrations.flask_client.FlaskOAuth2App):
+    """
+    A :class:`~authlib.integrations.flask_client.FlaskOAuth2App` caching the discovery document and the signing keys of the identity provider in the database, and reusing connections to it.
+
+    To use it, pass it as ``client_cls`` to :meth:`authlib.integrations.flask_client.OAuth.register`, along with the ``cache_ttl`` and ``sqla_engine`` to use.
+    """
+
+    client_cls = PooledOAuth2Session
+
+    def __init__(self, *args, cache_ttl: int, sqla_engine: sqlalchemy.engine.Engine, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_ttl: int = cache_ttl
+        self.sqla_engine: sqlalchemy.engine.Engine = sqla_engine
+        self._cache_lock: threading.Lock = threading.Lock()
+        self._metadata_fetched_at: float = 0.0
+        self._jwks_fetched_at: float = 0.0
+
+    def _fetch_document(self, url: str, force: bool, min_age: float = 0.0) -> tuple[dict, float]:
+        """
+        Get the JSON document at the given URL, from the database if a recent enough copy is available, or from the identity provider otherwise.
+
+        :param url: The URL of the document.
+        :param force: Whether the copy in the database should be ignored.
+        :param min_age: If ``force`` is set, the number of seconds a copy in the database has to be older than to be ignored.
+        :return: A tuple of the document and of the UNIX timestamp it was fetched at.
+        """
+
+        now = time.time()
+
+        with sqlalchemy.orm.Session(bind=self.sqla_engine) as session:
+            cached: OIDCCachedDocument | None = session.get(OIDCCachedDocument, url)
+            if cached is not None:
+                age = now - cached.fetched_at
+                if (not force and age < self.cache_ttl) or (force and age < min_age):
+                    log.debug("Using cached OIDC document for %s, fetched %d seconds ago", url, age)
+                    return cached.content, cached.fetched_at
+
+            log.debug("Fetching OIDC document: %s", url)
+            with self.client_cls(**self.client_kwargs) as client:
+                response = client.request("GET", url, withhold_token=True)
+                response.raise_for_status()
+                content = response.json()
+
+            session.merge(OIDCCachedDocument(url=url, content=content, fetched_at=now))
+            try:
+                session.commit()
+            except sqlalchemy.exc.IntegrityError:
+                # Another process cached the document at the same time, and its copy is just as fresh
+                session.rollback()
+                log.debug("OIDC document was cached concurrently by another process: %s", url)
+            else:
+                log.info("Fetched and cached OIDC document: %s", url)
+
+        return content, now
+
+    def load_server_metadata(self):
+        if not self._server_metadata_url:
+            return self.server_metadata
+
+        if time.time() - self._metadata_fetched_at < self.cache_ttl:
+            return self.server_metadata
+
+        with self._cache_lock:
+            if time.time() - self._metadata_fetched_at >= self.cache_ttl:
+                metadata, self._metadata_fetched_at = self._fetch_document(self._server_metadata_url, force=False)
+                self.server_metadata.update(metadata)
+                self.server_metadata["_loaded_at"] = self._metadata_fetched_at
+
+        return self.server_metadata
+
+    def fetch_jwk_set(self, force=False):
+        metadata = self.load_server_metadata()
+
+        if not force and time.time() - self._jwks_fetched_at < self.cache_ttl:
+            return metadata["jwks"]
+
+        uri = metadata.get("jwks_uri")
+        if not uri:
+            raise RuntimeError('Missing "jwks_uri" in metadata')
+
+        with self._cache_lock:
+            # Another thread may have refreshed the keys while this one was waiting for the lock
+            if force and time.time() - self._jwks_fetched_at < JWKS_MIN_REFRESH_INTERVAL:
+                return self.server_metadata["jwks"]
+            if not force and time.time() - self._jwks_fetched_at < self.cache_ttl:
+                return self.server_metadata["jwks"]
+
+            jwks, self._jwks_fetched_at = self._fetch_document(uri, force=force, min_age=JWKS_MIN_REFRESH_INTERVAL)
+            self.server_metadata["jwks"] = jwks
+
+        return jwks
+
+
+__all__ = (
+    "JWKS_MIN_REFRESH_INTERVAL",
+    "PooledHTTPAdapter",
+    "pooled_adapter",
+    "PooledOAuth2Session",
+    "CachedOIDCApp",
+)
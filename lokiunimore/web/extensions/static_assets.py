@@ -0,0 +1,241 @@
+import os
+import io
+import gzip
+import json
+import hashlib
+import logging
+import tempfile
+import mimetypes
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import PIL.Image
+except ImportError:
+    PIL = None
+
+log = logging.getLogger(__name__)
+
+
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".ico", ".txt", ".html", ".json"}
+"""
+The extensions of the assets worth precompressing.
+Images in other formats are already compressed.
+"""
+
+RECOMPRESSIBLE_EXTENSIONS = {".png"}
+"""
+The extensions of the images that can be losslessly recompressed with :mod:`PIL`.
+"""
+
+MANIFEST_NAME = "manifest.json"
+"""
+The name of the file mapping the names of the source assets to the names of the built ones.
+"""
+
+CACHE_MAX_AGE = 365 * 24 * 60 * 60
+"""
+The number of seconds browsers are allowed to cache built assets for.
+"""
+
+
+def fingerprint_name(filename: str, content: bytes) -> str:
+    """
+    Add a hash of the content of a file to its name, before the extension.
+
+    :param filename: The name of the file, such as ``unimore.css``.
+    :param content: The content of the file.
+    :return: The new name, such as ``unimore.3f2a1b4c5d6e.css``.
+    """
+
+    root, ext = os.path.splitext(filename)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return f"{root}.{digest}{ext}"
+
+
+def recompress_image(content: bytes) -> bytes:
+    """
+    Losslessly recompress a PNG image, if :mod:`PIL` is available.
+
+    :param content: The image to recompress.
+    :return: The recompressed image, or the original one if it wasn't any smaller.
+    """
+
+    if PIL is None:
+        return content
+
+    with PIL.Image.open(io.BytesIO(content)) as image:
+        output = io.BytesIO()
+        image.save(output, format="PNG", optimize=True)
+
+    recompressed = output.getvalue()
+    return recompressed if len(recompressed) < len(content) else content
+
+
+def write_atomically(path: str, content: bytes) -> None:
+    """
+    Write a file through a temporary file of its own in the same directory, replacing it all at once, so that processes building the same assets at the same time never read or overwrite each other's partial files.
+
+    :param path: The path of the file to write.
+    :param content: The content to write to it.
+    """
+
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with open(descriptor, "wb") as file:
+            file.write(content)
+        # mkstemp creates the file readable only by its owner, while assets are public
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def build_assets(source_dir: str, build_dir: str) -> dict[str, str]:
+    """
+    Fingerprint all files in ``source_dir`` and write them to ``build_dir``, along with their precompressed variants and with a manifest.
+
+    Files which have already been built are skipped, so that calling this again with unchanged sources is cheap, and every file is written atomically, so that it is safe for many processes to call this at the same time.
+
+    :param source_dir: The directory containing the source assets.
+    :param build_dir: The directory to write the built assets to.
+    :return: The manifest, mapping the source names to the built names.
+    """
+
+    os.makedirs(build_dir, exist_ok=True)
+    manifest = {}
+
+    for dirpath, _, filenames in os.walk(source_dir):
+        for filename in filenames:
+            source_path = os.path.join(dirpath, filename)
+            source_name = os.path.relpath(source_path, source_dir).replace(os.sep, "/")
+
+            with open(source_path, "rb") as file:
+                content = file.read()
+
+            built_name = fingerprint_name(source_name, content)
+            manifest[source_name] = built_name
+            built_path = os.path.join(build_dir, built_name)
+
+            if os.path.exists(built_path):
+                continue
+
+            log.debug("Building asset %s as %s", source_name, built_name)
+            os.makedirs(os.path.dirname(built_path), exist_ok=True)
+            ext = os.path.splitext(filename)[1].lower()
+
+            if ext in RECOMPRESSIBLE_EXTENSIONS:
+                content = recompress_image(content)
+
+            if ext in COMPRESSIBLE_EXTENSIONS:
+                write_atomically(f"{built_path}.gz", gzip.compress(content, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    write_atomically(f"{built_path}.br", brotli.compress(content, quality=11))
+
+            # Written last, so that an interrupted build is resumed on the next call
+            write_atomically(built_path, content)
+
+    write_atomically(os.path.join(build_dir, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode())
+
+    log.info("Built %d assets in %s", len(manifest), build_dir)
+    return manifest
+
+
+def load_manifest(build_dir: str) -> dict[str, str]:
+    """
+    :param build_dir: The directory the assets were built to.
+    :return: The manifest written by :func:`.build_assets`, or an empty one if the assets haven't been built.
+    """
+
+    try:
+        with open(os.path.join(build_dir, MANIFEST_NAME)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        log.debug("No built assets in %s", build_dir)
+        return {}
+
+
+class StaticAssetsExtension:
+    """
+    Flask extension serving the fingerprinted and precompressed static assets built by :func:`.build_assets`, with long-lived cache headers.
+
+    The assets are only loaded when the app is initialized, as processes which don't serve them, such as the bots, shouldn't spend time building them; they are built by :mod:`lokiunimore.web.assets`, or by the web server via :meth:`.build`.
+
+    Templates can get the URL of an asset via the ``asset_url`` global.
+    """
+
+    def __init__(self, app: flask.Flask = None):
+        self.source_dir: str | None = None
+        self.build_dir: str | None = None
+        self.manifest: dict[str, str] = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: flask.Flask):
+        self.source_dir = app.static_folder
+        self.build_dir = app.config["FLASK_STATIC_BUILD_DIR"]
+        self.manifest = load_manifest(self.build_dir)
+
+        app.extensions["lokiunimore.static_assets"] = self
+        app.add_url_rule("/assets/<path:filename>", "static_asset", self.send_asset)
+        app.add_template_global(self.asset_url, "asset_url")
+
+    def build(self) -> None:
+        """
+        Build the assets which haven't been built yet, and start serving them.
+        """
+
+        self.manifest = build_assets(self.source_dir, self.build_dir)
+
+    def asset_url(self, filename: str, **kwargs) -> str:
+        """
+        Like `~flask.url_for`, but for the built version of a static asset.
+
+        :param filename: The name of the asset in the static folder, such as ``unimore.css``.
+        :return: The URL of the built asset, or of the source asset if it hasn't been built.
+        """
+
+        if built_name := self.manifest.get(filename):
+            return flask.url_for("static_asset", filename=built_name, **kwargs)
+        return flask.url_for("static", filename=filename, **kwargs)
+
+    def send_asset(self, filename: str) -> flask.Response:
+        """
+        Send a built asset, picking the smallest precompressed variant the client accepts.
+        """
+
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        encodings = flask.request.accept_encodings
+
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if encodings[encoding] and os.path.exists(os.path.join(self.build_dir, filename + suffix)):
+                response = flask.send_from_directory(self.build_dir, filename + suffix, mimetype=mimetype, max_age=CACHE_MAX_AGE)
+                response.content_encoding = encoding
+                break
+        else:
+            response = flask.send_from_directory(self.build_dir, filename, mimetype=mimetype, max_age=CACHE_MAX_AGE)
+
+        response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+__all__ = (
+    "COMPRESSIBLE_EXTENSIONS",
+    "RECOMPRESSIBLE_EXTENSIONS",
+    "MANIFEST_NAME",
+    "CACHE_MAX_AGE",
+    "fingerprint_name",
+    "recompress_image",
+    "write_atomically",
+    "build_assets",
+    "load_manifest",
+    "StaticAssetsExtension",
+)
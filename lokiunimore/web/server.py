@@ -0,0 +1,81 @@
+"""
+Executable that runs the production web server.
+"""
+
+import gunicorn.app.base
+import gunicorn.arbiter
+import gunicorn.workers.base
+
+from lokiunimore.config import LOKI_METRICS_BIND, GUNICORN_BIND, GUNICORN_WORKERS, GUNICORN_ASYNC, GUNICORN_WORKER_CONNECTIONS
+from lokiunimore.config.snapshot import get_snapshot
+from lokiunimore.utils.logs import install_log_handler
+
+
+def patch_for_gevent() -> None:
+    """
+    Make the standard library, :mod:`requests` and :mod:`psycopg2` cooperate with :mod:`gevent`, so that waiting on them lets other requests be served.
+
+    Must be called before the web app is imported.
+    """
+
+    import gevent.monkey
+    import psycogreen.gevent
+
+    gevent.monkey.patch_all()
+    psycogreen.gevent.patch_psycopg()
+
+
+def post_fork(server: gunicorn.arbiter.Arbiter, worker: gunicorn.workers.base.Worker) -> None:
+    """
+    :mod:`gunicorn` hook initializing the per-worker state after the fork.
+    """
+
+    from .app import init_worker
+    from lokiunimore.utils.metrics import serve_metrics
+
+    init_worker()
+    if bind := LOKI_METRICS_BIND.__wrapped__:
+        # Each worker records its own metrics, so each serves them on its own port
+        serve_metrics(bind, attempts=GUNICORN_WORKERS.__wrapped__)
+    server.log.info("Initialized worker %s", worker.pid)
+
+
+class LokiWebServer(gunicorn.app.base.BaseApplication):
+    """
+    :mod:`gunicorn` application serving :data:`lokiunimore.web.app.rp_app`.
+
+    The app is created in the master process before forking, so that workers share its memory copy-on-write and spawn quickly.
+    """
+
+    def load_config(self):
+        self.cfg.set("bind", GUNICORN_BIND.__wrapped__)
+        self.cfg.set("workers", GUNICORN_WORKERS.__wrapped__)
+        self.cfg.set("preload_app", True)
+        self.cfg.set("post_fork", post_fork)
+
+        if GUNICORN_ASYNC.__wrapped__:
+            self.cfg.set("worker_class", "gevent")
+            self.cfg.set("worker_connections", GUNICORN_WORKER_CONNECTIONS.__wrapped__)
+
+    def load(self):
+        from .app import create_app, shared_engine, static_assets_extension, rp_app
+
+        create_app()
+        # Built once here, before forking, instead of by every process creating the app
+        static_assets_extension.build()
+        # Refuse to start with outdated tables, then close the connection used to check them, so that the workers don't inherit it
+        shared_engine().dispose()
+        return rp_app
+
+
+def main():
+    if GUNICORN_ASYNC.__wrapped__:
+        patch_for_gevent()
+
+    install_log_handler()
+    LokiWebServer().run()
+
+
+if __name__ == "__main__":
+    get_snapshot()
+    main()
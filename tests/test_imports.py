@@ -0,0 +1,10 @@
+import pytest
+
+from benchmarks.imports import BUDGETS, measure_imports
+
+
+# Only the forbidden packages are checked, as the time budgets depend too much on the machine; see benchmarks.imports for those
+@pytest.mark.parametrize("budget", BUDGETS, ids=[budget.module for budget in BUDGETS])
+def test_forbidden_imports(budget):
+    _, imported = measure_imports(budget.module)
+    assert sorted(package for package in budget.forbidden if package in imported) == []
@@ -0,0 +1,96 @@
+from lokiunimore.matrix.reconcile import plan_reconciliation
+
+BOT = "@loki:example.org"
+PUBLIC = "!public:example.org"
+PUBLIC_ROOM = "!public-room:example.org"
+PRIVATE = "!private:example.org"
+PRIVATE_ROOM = "!private-room:example.org"
+
+
+def plan(public_rooms, private_rooms, users):
+    return plan_reconciliation(
+        public_rooms=public_rooms,
+        private_rooms=private_rooms,
+        public_space_id=PUBLIC,
+        private_space_id=PRIVATE,
+        users=users,
+        bot_id=BOT,
+    )
+
+
+def test_in_sync():
+    result = plan(
+        public_rooms={PUBLIC: {BOT, "@alice:example.org"}, PUBLIC_ROOM: {BOT, "@alice:example.org"}},
+        private_rooms={PRIVATE: {BOT, "@alice:example.org"}, PRIVATE_ROOM: {BOT, "@alice:example.org"}},
+        users={"@alice:example.org": (True, True)},
+    )
+    assert len(result) == 0
+
+
+def test_unlinked_moderator_is_not_kicked():
+    # A moderator in the public space and in the private rooms, without a linked account
+    result = plan(
+        public_rooms={PUBLIC: {BOT, "@mod:example.org"}},
+        private_rooms={PRIVATE: {BOT, "@mod:example.org"}, PRIVATE_ROOM: {BOT, "@mod:example.org"}},
+        users={"@mod:example.org": (False, False)},
+    )
+    assert result.kicks == []
+    assert result.mark_joined == set()
+
+
+def test_untracked_moderator_is_not_kicked():
+    # A moderator of the private rooms who never joined the public space
+    result = plan(
+        public_rooms={PUBLIC: {BOT}},
+        private_rooms={PRIVATE: {BOT, "@mod:example.org"}, PRIVATE_ROOM: {BOT, "@mod:example.org"}},
+        users={},
+    )
+    assert result.kicks == []
+    assert result.create == set()
+
+
+def test_public_room_only_member_is_not_kicked():
+    # A federated user who joined a room of the public space directly
+    result = plan(
+        public_rooms={PUBLIC: {BOT}, PUBLIC_ROOM: {BOT, "@guest:elsewhere.org"}},
+        private_rooms={PRIVATE: {BOT}},
+        users={},
+    )
+    assert result.kicks == []
+    assert result.create == set()
+
+
+def test_missed_public_leaver_is_destroyed_and_kicked_everywhere():
+    result = plan(
+        public_rooms={PUBLIC: {BOT}, PUBLIC_ROOM: {BOT, "@alice:example.org"}},
+        private_rooms={PRIVATE: {BOT, "@alice:example.org"}, PRIVATE_ROOM: {BOT, "@alice:example.org"}},
+        users={"@alice:example.org": (True, True)},
+    )
+    assert result.destroy == {"@alice:example.org"}
+    assert result.unlink == set()
+    assert sorted(result.kicks) == [
+        (PRIVATE_ROOM, "@alice:example.org"),
+        (PRIVATE, "@alice:example.org"),
+        (PUBLIC_ROOM, "@alice:example.org"),
+    ]
+
+
+def test_missed_private_leaver_is_unlinked_and_kicked_from_private_rooms():
+    result = plan(
+        public_rooms={PUBLIC: {BOT, "@alice:example.org"}, PUBLIC_ROOM: {BOT, "@alice:example.org"}},
+        private_rooms={PRIVATE: {BOT}, PRIVATE_ROOM: {BOT, "@alice:example.org"}},
+        users={"@alice:example.org": (True, True)},
+    )
+    assert result.unlink == {"@alice:example.org"}
+    assert result.kicks == [(PRIVATE_ROOM, "@alice:example.org")]
+
+
+def test_missed_joins():
+    result = plan(
+        public_rooms={PUBLIC: {BOT, "@alice:example.org", "@bob:example.org"}},
+        private_rooms={PRIVATE: {BOT, "@alice:example.org"}},
+        users={"@alice:example.org": (True, False)},
+    )
+    assert result.create == {"@bob:example.org"}
+    assert result.mark_joined == {"@alice:example.org"}
+    assert result.kicks == []
@@ -0,0 +1,45 @@
+import pytest
+import sqlalchemy
+
+from lokiunimore.sql.tables import Base
+from lokiunimore.sql.upgrade import OutdatedSchemaError, check_schema, upgrade_schema
+
+OUTDATED_SCHEMA = (
+    "CREATE TABLE accounts (email VARCHAR PRIMARY KEY, first_name VARCHAR, last_name VARCHAR, private BOOLEAN)",
+    "CREATE TABLE matrix_users (id VARCHAR NOT NULL PRIMARY KEY, token VARCHAR NOT NULL, account_email VARCHAR REFERENCES accounts (email), joined_private_space BOOLEAN NOT NULL)",
+    "CREATE TABLE matrix_bulk_invites (matrix_user_id VARCHAR NOT NULL PRIMARY KEY REFERENCES matrix_users (id) ON DELETE CASCADE, attempted_at FLOAT NOT NULL, error VARCHAR)",
+    "INSERT INTO accounts VALUES ('steffo@unimore.it', 'Stefano', 'Pigozzi', 0)",
+    "INSERT INTO matrix_users VALUES ('@steffo:ryg.one', 'token', 'steffo@unimore.it', 1)",
+    "INSERT INTO matrix_bulk_invites VALUES ('@steffo:ryg.one', 1.0, NULL)",
+)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'loki.sqlite'}")
+    yield engine
+    engine.dispose()
+
+
+def test_new_database_is_current(engine):
+    Base.metadata.create_all(bind=engine)
+    check_schema(engine)
+    assert upgrade_schema(engine) == []
+
+
+def test_outdated_database_is_upgraded(engine):
+    with engine.begin() as connection:
+        for statement in OUTDATED_SCHEMA:
+            connection.execute(sqlalchemy.text(statement))
+
+    with pytest.raises(OutdatedSchemaError):
+        check_schema(engine)
+
+    assert upgrade_schema(engine) == ["matrix_users", "matrix_bulk_invites"]
+    check_schema(engine)
+
+    with engine.connect() as connection:
+        assert connection.execute(sqlalchemy.text("SELECT id, community_id, account_email FROM matrix_users")).all() == [("@steffo:ryg.one", "default", "steffo@unimore.it")]
+        assert connection.execute(sqlalchemy.text("SELECT matrix_user_id, community_id FROM matrix_bulk_invites")).all() == [("@steffo:ryg.one", "default")]
+        # A second community may now track the same user
+        connection.execute(sqlalchemy.text("INSERT INTO matrix_users (id, community_id, token, joined_private_space) VALUES ('@steffo:ryg.one', 'other', 'token', 0)"))